@@ -0,0 +1,129 @@
+"""
+Measure scheduling calls with single requests against bulk uploads.
+
+Serves the schedule endpoints in process on loopback, and schedules N calls
+first with one JSON POST each (from a few concurrent clients), then with one
+CSV upload and one NDJSON upload to /calls/bulk.
+
+Run from the project root:
+    python -m benchmarks.bulk_scheduling
+"""
+
+import asyncio
+import json
+import random
+import sys
+import time
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from {{cookiecutter.app_name}}.infrastructure import constants, server
+from {{cookiecutter.app_name}}.infrastructure.scheduler import UnifiedTimedQueue
+
+SIZES = [1_000, 10_000, 100_000]
+
+# Single requests are slow, so only this many are sent and the rate is scaled.
+SINGLE_LIMIT = 2_000
+
+CONCURRENCY = 16
+
+ROW = "{:>10}{:>16}{:>16}{:>16}"
+
+
+class NullDialer:
+    """Dials nothing."""
+
+    async def dial(self, data):
+        pass
+
+
+def calls(n):
+    """Random E.164 numbers with times tomorrow."""
+    rng = random.Random(n)
+    future = time.time() + 24 * 60 * 60
+    return [
+        (f"+1555{rng.randint(0, 9_999_999):07d}", future + rng.uniform(0, 3600))
+        for _ in range(n)
+    ]
+
+
+def create_app(loop):
+    async def startup_handler(app):
+        app[constants.SCHEDULER] = UnifiedTimedQueue(NullDialer(), loop=loop)
+
+    app = web.Application()
+    server.configure_app(app, startup_handler)
+    return app
+
+
+async def single(session, url, rows):
+    pending = iter(rows)
+
+    async def client():
+        for number, ts in pending:
+            day = time.strftime("%Y-%m-%d", time.localtime(ts))
+            hour = time.strftime("%H:%M", time.localtime(ts))
+            body = {"phone_number": number, "date": day, "time": hour}
+            async with session.post(url, json=body) as resp:
+                assert resp.status == 200, await resp.text()
+
+    await asyncio.gather(*(client() for _ in range(CONCURRENCY)))
+
+
+async def upload(session, url, body, content_type):
+    async with session.post(
+        url, data=body, headers={"Content-Type": content_type}
+    ) as resp:
+        summary = json.loads((await resp.read()).splitlines()[-1])
+    assert summary["failed"] == 0, summary
+
+
+async def run(n, loop):
+    """Return rows per second for single POSTs, CSV and NDJSON."""
+    rows = calls(n)
+    csv_body = "phone_number,ts\n" + "".join(f"{num},{ts}\n" for num, ts in rows)
+    ndjson_body = "".join(
+        json.dumps({"phone_number": num, "ts": ts}) + "\n" for num, ts in rows
+    )
+
+    rates = []
+    async with aiohttp.ClientSession() as session:
+        for kind in ("single", "csv", "ndjson"):
+            test_server = TestServer(create_app(loop))
+            await test_server.start_server(loop=loop)
+            url = str(test_server.make_url("/"))
+            bulk_url = str(test_server.make_url("/calls/bulk"))
+
+            start = time.perf_counter()
+            if kind == "single":
+                sent = rows[:SINGLE_LIMIT]
+                await single(session, url, sent)
+            elif kind == "csv":
+                sent = rows
+                await upload(session, bulk_url, csv_body.encode(), "text/csv")
+            else:
+                sent = rows
+                await upload(
+                    session, bulk_url, ndjson_body.encode(), "application/x-ndjson"
+                )
+            rates.append(len(sent) / (time.perf_counter() - start))
+
+            assert len(test_server.app[constants.SCHEDULER]) == len(sent)
+            await test_server.close()
+    return rates
+
+
+def main():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    print(ROW.format("calls", "single rows/s", "csv rows/s", "ndjson rows/s"))
+    for n in SIZES:
+        rates = loop.run_until_complete(run(n, loop))
+        print(ROW.format(f"{n:,}", *(f"{rate:,.0f}" for rate in rates)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,66 @@
+"""
+Measure the cost of recording metrics on the hot path.
+
+Times a million observations of each kind of metric, the way the call
+pipeline records them, against an empty loop, and reports the cost of one
+observation.
+
+Run from the project root:
+    python -m benchmarks.metrics_overhead
+"""
+
+import random
+import sys
+import time
+
+from {{cookiecutter.app_name}}.infrastructure.metrics import Registry
+
+OBSERVATIONS = 1_000_000
+
+EVENT_TYPES = ["call.initiated", "call.answered", "call.speak.ended", "call.hangup"]
+
+ROW = "{:>32}{:>16}"
+
+
+def timed(record, values):
+    """Return the seconds per call of record over the values."""
+    start = time.perf_counter()
+    for value in values:
+        record(value)
+    return (time.perf_counter() - start) / len(values)
+
+
+def main():
+    registry = Registry()
+    counter = registry.counter("counter", "A counter.")
+    histogram = registry.histogram("histogram", "A histogram.")
+    labelled = registry.histogram("labelled", "A labelled histogram.", ("type",))
+
+    rng = random.Random(1)
+    latencies = [rng.expovariate(10) for _ in range(OBSERVATIONS)]
+    types = [rng.choice(EVENT_TYPES) for _ in range(OBSERVATIONS)]
+
+    baseline = timed(lambda value: None, latencies)
+    variants = [
+        ("counter.inc()", lambda value: counter.inc(), latencies),
+        ("histogram.observe()", histogram.observe, latencies),
+        (
+            "labels(event_type).observe()",
+            lambda event_type: labelled.labels(event_type).observe(0.1),
+            types,
+        ),
+        (
+            "timed with monotonic()",
+            lambda value: histogram.observe(time.monotonic() - value),
+            latencies,
+        ),
+    ]
+
+    print(ROW.format("observation", "cost"))
+    for name, record, values in variants:
+        cost = timed(record, values) - baseline
+        print(ROW.format(name, f"{cost * 1e9:.0f} ns"))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+"""
+Measure how request throughput scales with the number of worker processes.
+
+Starts the service with 1 to N workers sharing the port, and for each drives
+it with as many client processes for a few seconds, first with webhooks and
+then with scheduled calls, which every worker but the owner forwards to the
+owner of the scheduler.
+
+The clients run on the same machine, so they compete with the workers for the
+cores; the numbers show the scaling, not the capacity of a dedicated host.
+
+Run from the project root:
+    python -m benchmarks.prefork_throughput [max workers]
+"""
+
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import tempfile
+import time
+import uuid
+
+import aiohttp
+
+from {{cookiecutter.app_name}} import main as app_main
+
+DURATION = 5
+
+CONCURRENCY = 32
+
+ROW = "{:>10}{:>16}{:>16}"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def config(directory, port, processes):
+    with open("config.dev.json") as f:
+        conf = json.load(f)
+
+    conf["http"] = {"host": "127.0.0.1", "port": port}
+    conf["telnyx_api_key"] = "benchmark"
+    conf["joke_pool"] = {"enabled": False}
+    conf["persistence"] = {"enabled": False}
+    conf["scheduler"] = {"backend": "heap"}
+    conf["workers"] = {
+        "processes": processes,
+        "lock_path": os.path.join(directory, "scheduler.lock"),
+        "socket_path": os.path.join(directory, "scheduler.sock"),
+    }
+    return conf
+
+
+def serve(conf):
+    processes = conf["workers"]["processes"]
+    if processes > 1:
+        app_main.run_workers(conf, processes)
+    else:
+        app_main.run_worker(conf)
+
+
+def webhook():
+    return {
+        "data": {
+            "id": str(uuid.uuid4()),
+            "event_type": "call.dtmf.received",
+            "payload": {"call_control_id": str(uuid.uuid4())},
+        }
+    }
+
+
+def schedule():
+    return {"phone_number": "+15551234567", "date": "2099-01-01", "time": "12:00"}
+
+
+async def drive(url, body):
+    """Send requests for DURATION seconds, returning how many succeeded."""
+    done = 0
+    deadline = time.monotonic() + DURATION
+
+    async def client(session):
+        nonlocal done
+        while time.monotonic() < deadline:
+            async with session.post(url, json=body()) as resp:
+                await resp.read()
+                if resp.status == 200:
+                    done += 1
+
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(client(session) for _ in range(CONCURRENCY)))
+    return done
+
+
+def run_client(url, kind):
+    body = webhook if kind == "webhook" else schedule
+    return asyncio.new_event_loop().run_until_complete(drive(url, body))
+
+
+async def wait_until_up(port):
+    async with aiohttp.ClientSession() as session:
+        for _ in range(100):
+            try:
+                async with session.get(f"http://127.0.0.1:{port}/health") as resp:
+                    if resp.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.1)
+    raise RuntimeError("The service did not start")
+
+
+def run(processes):
+    """Return (webhooks per second, schedules per second)."""
+    port = free_port()
+    with tempfile.TemporaryDirectory() as directory:
+        server = multiprocessing.Process(
+            target=serve, args=(config(directory, port, processes),)
+        )
+        server.start()
+        try:
+            loop = asyncio.new_event_loop()
+            loop.run_until_complete(wait_until_up(port))
+            loop.close()
+
+            rates = []
+            for kind, path in [("webhook", "/webhook"), ("schedule", "/")]:
+                url = f"http://127.0.0.1:{port}{path}"
+                with multiprocessing.Pool(processes) as pool:
+                    counts = pool.starmap(
+                        run_client, itertools.repeat((url, kind), processes)
+                    )
+                rates.append(sum(counts) / DURATION)
+            return rates
+        finally:
+            os.kill(server.pid, signal.SIGTERM)
+            server.join(10)
+            if server.is_alive():
+                server.kill()
+
+
+def main():
+    max_workers = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count()
+
+    print(ROW.format("workers", "webhooks/s", "schedules/s"))
+    for processes in range(1, max_workers + 1):
+        webhooks, schedules = run(processes)
+        print(ROW.format(processes, f"{webhooks:,.0f}", f"{schedules:,.0f}"))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""
+Compare the heap and timing wheel scheduler backends.
+
+Measures the cost of putting N calls onto each backend, both spread randomly
+over the next day and as a burst of near-term inserts that each land ahead of
+the current head, and then the cost of draining them all once they are due.
+
+Run from the project root:
+    python -m benchmarks.scheduler_backends
+"""
+
+import asyncio
+import heapq
+import math
+import random
+import sys
+import time
+
+from {{cookiecutter.app_name}}.infrastructure.scheduler import UnifiedTimedQueue
+from {{cookiecutter.app_name}}.infrastructure.timing_wheel import TimingWheelQueue
+
+SIZES = [10_000, 100_000, 1_000_000]
+
+DAY = 24 * 60 * 60
+
+ROW = "{:<14}{:>10}{:>14}{:>14}{:>10}"
+
+
+class NullDialer:
+    """Dials nothing."""
+
+    async def dial(self, data):
+        pass
+
+
+def random_timestamps(n, now):
+    """Timestamps spread randomly over the next day."""
+    rng = random.Random(n)
+    return [now + 60 + rng.random() * DAY for _ in range(n)]
+
+
+def burst_timestamps(n, now):
+    """Near-term timestamps where every insert lands ahead of the previous ones."""
+    return [now + 60 - i * 1e-6 for i in range(n)]
+
+
+async def time_puts(scheduler, timestamps):
+    """Return the seconds taken to put every timestamp onto the scheduler."""
+    start = time.perf_counter()
+    for n, ts in enumerate(timestamps):
+        scheduler.put(n, ts)
+    elapsed = time.perf_counter() - start
+
+    # Let the cancelled sleep tasks finish before the next measurement.
+    await asyncio.sleep(0)
+    await scheduler.close()
+    return elapsed
+
+
+def time_heap_drain(scheduler):
+    """Return the seconds taken to pop every item off the heap."""
+    queue = scheduler._queue
+    start = time.perf_counter()
+    while queue:
+        heapq.heappop(queue)
+    return time.perf_counter() - start
+
+
+def time_wheel_drain(scheduler, timestamps):
+    """Return the seconds taken to advance the wheel past every item."""
+    wheel = scheduler._wheel
+    start = time.perf_counter()
+    wheel.advance(math.ceil(max(timestamps)))
+    return time.perf_counter() - start
+
+
+def report(backend, n, *timings):
+    """Print a row of the results table."""
+    print(ROW.format(backend, n, *(f"{t:.3f}s" for t in timings)))
+
+
+async def main():
+    loop = asyncio.get_event_loop()
+    now = time.time()
+
+    print(ROW.format("backend", "entries", "random put", "burst put", "drain"))
+    for n in SIZES:
+        random_ts = random_timestamps(n, now)
+        burst_ts = burst_timestamps(n, now)
+
+        heap = UnifiedTimedQueue(NullDialer(), loop=loop)
+        random_put = await time_puts(heap, random_ts)
+        drain = time_heap_drain(heap)
+        heap = UnifiedTimedQueue(NullDialer(), loop=loop)
+        burst_put = await time_puts(heap, burst_ts)
+        report("heap", n, random_put, burst_put, drain)
+
+        wheel = TimingWheelQueue(NullDialer(), loop=loop)
+        random_put = await time_puts(wheel, random_ts)
+        drain = time_wheel_drain(wheel, random_ts)
+        wheel = TimingWheelQueue(NullDialer(), loop=loop)
+        burst_put = await time_puts(wheel, burst_ts)
+        report("timing_wheel", n, random_put, burst_put, drain)
+
+
+if __name__ == "__main__":
+    loop = asyncio.get_event_loop()
+    sys.exit(loop.run_until_complete(main()))
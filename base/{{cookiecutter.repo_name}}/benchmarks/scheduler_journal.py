@@ -0,0 +1,85 @@
+"""
+Measure the scheduler journal's write throughput and recovery time.
+
+Writes N puts through the journal (with batched fsyncs), compacts them into a
+snapshot, and then times a cold recovery of the heap from that snapshot.
+
+Run from the project root:
+    python -m benchmarks.scheduler_journal
+"""
+
+import asyncio
+import random
+import sys
+import tempfile
+import time
+
+from {{cookiecutter.app_name}}.infrastructure.persistence import SchedulerJournal
+from {{cookiecutter.app_name}}.infrastructure.scheduler import UnifiedTimedQueue
+
+SIZES = [10_000, 100_000, 1_000_000]
+
+ROW = "{:>10}{:>16}{:>14}{:>14}"
+
+
+class NullDialer:
+    """Dials nothing."""
+
+    async def dial(self, data):
+        pass
+
+
+def numbers(n):
+    """Random E.164 numbers."""
+    rng = random.Random(n)
+    return [f"+1555{rng.randint(0, 9_999_999):07d}" for _ in range(n)]
+
+
+async def run(n, directory, loop):
+    """Return (puts per second, compaction seconds, recovery seconds)."""
+    future = time.time() + 24 * 60 * 60
+    journal = SchedulerJournal(directory, loop=loop)
+    scheduler = UnifiedTimedQueue(NullDialer(), loop=loop, journal=journal)
+    journal.start(scheduler.items)
+
+    start = time.perf_counter()
+    for i, number in enumerate(numbers(n)):
+        scheduler.put(number, future + i)
+    await journal.flush()
+    write_rate = n / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await journal.compact()
+    compaction = time.perf_counter() - start
+
+    await scheduler.close()
+    await journal.close()
+
+    start = time.perf_counter()
+    journal = SchedulerJournal(directory, loop=loop)
+    scheduler = UnifiedTimedQueue(NullDialer(), loop=loop, journal=journal)
+    scheduler.restore(*journal.recover())
+    recovery = time.perf_counter() - start
+    assert len(scheduler) == n
+
+    await scheduler.close()
+    return write_rate, compaction, recovery
+
+
+async def main():
+    loop = asyncio.get_event_loop()
+
+    print(ROW.format("entries", "puts/s", "compaction", "recovery"))
+    for n in SIZES:
+        with tempfile.TemporaryDirectory() as directory:
+            write_rate, compaction, recovery = await run(n, directory, loop)
+        print(
+            ROW.format(
+                n, f"{write_rate:,.0f}", f"{compaction:.3f}s", f"{recovery:.3f}s"
+            )
+        )
+
+
+if __name__ == "__main__":
+    loop = asyncio.get_event_loop()
+    sys.exit(loop.run_until_complete(main()))
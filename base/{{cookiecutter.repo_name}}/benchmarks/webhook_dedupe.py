@@ -0,0 +1,74 @@
+"""
+Measure the cost of checking webhooks for redeliveries.
+
+Runs a stream of event ids, 5% of which are redeliveries of a recent event,
+through the deduplicator, with and without the bloom filters, and reports the
+cost per event and the share of one core needed at 10k events per second.
+
+Run from the project root:
+    python -m benchmarks.webhook_dedupe
+"""
+
+import random
+import sys
+import time
+import uuid
+
+from {{cookiecutter.app_name}}.infrastructure.dedupe import WebhookDeduplicator
+
+EVENTS = 1_000_000
+
+RATE = 10_000
+
+DUPLICATE_SHARE = 0.05
+
+ROW = "{:>24}{:>14}{:>16}{:>12}"
+
+
+def events(n):
+    """Event ids, with some redeliveries of recent events mixed in."""
+    rng = random.Random(n)
+    ids = []
+    for _ in range(n):
+        if ids and rng.random() < DUPLICATE_SHARE:
+            ids.append(ids[-rng.randint(1, min(len(ids), 1000))])
+        else:
+            ids.append(str(uuid.UUID(int=rng.getrandbits(128))))
+    return ids
+
+
+def run(deduplicator, ids):
+    """Return (seconds per event, duplicates found)."""
+    start = time.perf_counter()
+    for event_id in ids:
+        if event_id not in deduplicator:
+            deduplicator.add(event_id)
+    elapsed = time.perf_counter() - start
+    return elapsed / len(ids), deduplicator.duplicates
+
+
+def main():
+    ids = events(EVENTS)
+    variants = [
+        ("lru 100k", WebhookDeduplicator(max_size=100_000)),
+        (
+            "lru 10k + bloom 1M",
+            WebhookDeduplicator(max_size=10_000, bloom_capacity=1_000_000),
+        ),
+    ]
+
+    print(ROW.format("deduplicator", "per event", "core @ 10k/s", "duplicates"))
+    for name, deduplicator in variants:
+        per_event, duplicates = run(deduplicator, ids)
+        print(
+            ROW.format(
+                name,
+                f"{per_event * 1e6:.2f}us",
+                f"{per_event * RATE:.1%}",
+                f"{duplicates:,}",
+            )
+        )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -11,10 +11,43 @@ import telnyx
 
 from {{cookiecutter.app_name}}.infrastructure import constants
 from {{cookiecutter.app_name}}.infrastructure import server
+from {{cookiecutter.app_name}}.infrastructure.dedupe import WebhookDeduplicator
+from {{cookiecutter.app_name}}.infrastructure.events import EventBroadcaster
+from {{cookiecutter.app_name}}.infrastructure.listing import ScheduleListing
+from {{cookiecutter.app_name}}.infrastructure.numbers import NumberNormaliser
+from {{cookiecutter.app_name}}.infrastructure.scheduler import UnifiedTimedQueue
+from {{cookiecutter.app_name}}.infrastructure.webhook_queue import WebhookDispatcher
+
+
+class FakeDialer:
+    """Stands in for CallControl, recording dialled items and dial concurrency."""
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.dialled = []
+        self.webhooks = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def dial(self, data):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(self.delay)
+        self.in_flight -= 1
+        self.dialled.append(data)
+
+    async def process_webhook(self, call_control_id, event_type):
+        await asyncio.sleep(self.delay)
+        self.webhooks.append((call_control_id, event_type))
 
 
 @pytest.fixture
-def web_app(loop):
+def dialer():
+    return FakeDialer()
+
+
+@pytest.fixture
+def web_app(loop, dialer):
     async def startup_handler(app):
         # Save dependencies in the HTTP app.
 
@@ -23,6 +56,21 @@ def web_app(loop):
         telnyx.Call().return_value = Mock()
 
         app[constants.TELNYX] = telnyx
+        app[constants.NUMBERS] = NumberNormaliser(loop=loop)
+        app[constants.EVENTS] = EventBroadcaster()
+        app[constants.SCHEDULER] = UnifiedTimedQueue(
+            dialer, loop=loop, events=app[constants.EVENTS]
+        )
+        app[constants.LISTING] = ScheduleListing(app[constants.SCHEDULER])
+        app[constants.WEBHOOK_DISPATCHER] = WebhookDispatcher(dialer, loop=loop)
+        app[constants.WEBHOOK_DEDUPLICATOR] = WebhookDeduplicator(bloom_capacity=1000)
+
+        async def cleanup(app):
+            app[constants.EVENTS].close()
+            await app[constants.WEBHOOK_DISPATCHER].close()
+            await app[constants.SCHEDULER].close()
+
+        app.on_shutdown.append(cleanup)
 
     # Create the test web application
     app = web.Application()
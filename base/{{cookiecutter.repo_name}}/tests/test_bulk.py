@@ -0,0 +1,171 @@
+"""
+Test scheduling calls in bulk from CSV and NDJSON uploads
+"""
+
+import json
+
+import pytest
+
+from {{cookiecutter.app_name}}.infrastructure import bulk, constants
+from {{cookiecutter.app_name}}.infrastructure.numbers import NumberNormaliser
+
+
+class FakeStream:
+    """Hands out a body in fixed chunks, like the request's StreamReader."""
+
+    def __init__(self, body, chunk_size):
+        self._chunks = [
+            body[i : i + chunk_size] for i in range(0, len(body), chunk_size)
+        ]
+
+    async def iter_chunked(self, chunk_size):
+        for chunk in self._chunks:
+            yield chunk
+
+
+async def _rows(body, fmt, batch_size=1000, chunk_size=7, max_line=bulk.MAX_LINE):
+    batches = []
+    stream = FakeStream(body, chunk_size)
+    async for rows in bulk.read_rows(stream, fmt, batch_size, max_line):
+        batches.append(rows)
+    return batches
+
+
+async def test_csv_rows_span_chunks_and_batches():
+    body = (
+        b"\xef\xbb\xbfphone_number,ts\r\n"
+        b"+15551234567,4070952000\r\n"
+        b"\r\n"
+        b"+15551234568,4070952001\r\n"
+        b"+15551234569\r\n"
+        b"+15551234570,4070952002"
+    )
+
+    batches = await _rows(body, bulk.CSV, batch_size=2)
+
+    assert [len(rows) for rows in batches] == [2, 2]
+    first, second, third, fourth = [row for rows in batches for row in rows]
+    assert first == (2, {"phone_number": "+15551234567", "ts": "4070952000"})
+    assert second[0] == 4
+    assert third == (5, "Expected 2 columns.")
+    assert fourth == (6, {"phone_number": "+15551234570", "ts": "4070952002"})
+
+
+async def test_csv_stray_quote_spoils_only_its_row():
+    body = b'phone_number,ts\n"123,1\n456,4070952000\n789,4070952001\n'
+
+    (rows,) = await _rows(body, bulk.CSV)
+
+    assert rows == [
+        (2, "Expected 2 columns."),
+        (3, {"phone_number": "456", "ts": "4070952000"}),
+        (4, {"phone_number": "789", "ts": "4070952001"}),
+    ]
+
+
+async def test_ndjson_rows():
+    body = b'{"phone_number": "+15551234567", "ts": 4070952000}\nnope\n[1]\n\xff\n'
+
+    (rows,) = await _rows(body, bulk.NDJSON)
+
+    assert rows == [
+        (1, {"phone_number": "+15551234567", "ts": 4070952000}),
+        (2, "Invalid JSON."),
+        (3, "Expected an object."),
+        (4, bulk.NOT_UTF8),
+    ]
+
+
+async def test_too_long_lines_are_skipped():
+    long_row = b'{"phone_number": "' + b"5" * 100 + b'"}'
+    body = (
+        b'{"phone_number": "+15551234567", "ts": 4070952000}\n'
+        + long_row
+        + b"\n"
+        + b'{"phone_number": "+15551234568", "ts": 4070952000}\n'
+        + long_row
+    )
+
+    (rows,) = await _rows(body, bulk.NDJSON, chunk_size=16, max_line=60)
+
+    assert [row for row, _ in rows] == [1, 2, 3, 4]
+    assert rows[1] == (2, bulk.LINE_TOO_LONG)
+    assert rows[2] == (3, {"phone_number": "+15551234568", "ts": 4070952000})
+    assert rows[3] == (4, bulk.LINE_TOO_LONG)
+
+
+async def test_validate_rows(loop):
+    rows = [
+        (1, {"phone_number": "+15551234567", "date": "2099-01-01", "time": "12:00"}),
+        (2, {"phone_number": "+1 555 123 4567", "ts": 4070952000}),
+        (3, {"phone_number": "not a number", "ts": 4070952000}),
+        (4, {"phone_number": "+15551234567", "ts": 1}),
+        (5, "Invalid JSON."),
+        (6, {"phone_number": "+15551234567", "ts": "nan"}),
+        (7, {"phone_number": "+15551234567", "ts": float("inf")}),
+        (8, {"phone_number": "+15551234567", "ts": None}),
+        (9, {"phone_number": "+15551234567", "ts": [1]}),
+    ]
+
+    calls, errors = await bulk.validate_rows(
+        rows, now=1000, numbers=NumberNormaliser(loop=loop)
+    )
+
+    assert calls[1] == (2, "+15551234567", 4070952000)
+    assert [line for line, _, _ in calls] == [1, 2]
+    assert [line for line, _ in errors] == [3, 4, 5, 6, 7, 8, 9]
+    assert errors[4] == (7, "The scheduled time must be a finite number.")
+    assert errors[5:] == [(8, bulk.BAD_ROW), (9, bulk.BAD_ROW)]
+
+
+def _lines(text):
+    return [json.loads(line) for line in text.splitlines()]
+
+
+@pytest.mark.parametrize(
+    "content_type, body",
+    [
+        (
+            "text/csv",
+            "phone_number,date,time\n"
+            "+15551234567,2099-01-01,12:00\n"
+            "+15551234568,2000-01-01,12:00\n"
+            "+15551234569,2099-01-02,12:00\n",
+        ),
+        (
+            "application/x-ndjson",
+            '{"phone_number": "+15551234567", "ts": 4070952000}\n'
+            '{"phone_number": "+15551234568", "ts": 1}\n'
+            '{"phone_number": "+15551234569", "ts": 4071038400}\n',
+        ),
+    ],
+)
+async def test_bulk_endpoint(test_client, content_type, body):
+    scheduler = test_client.server.app[constants.SCHEDULER]
+
+    resp = await test_client.post(
+        "/calls/bulk?handles=true",
+        data=body.encode(),
+        headers={"Content-Type": content_type},
+    )
+
+    assert resp.status == 200
+    lines = _lines(await resp.text())
+    first_line = 2 if content_type == "text/csv" else 1
+    assert [line["line"] for line in lines[:3]] == [
+        first_line,
+        first_line + 1,
+        first_line + 2,
+    ]
+    assert "error" in lines[1]
+    assert lines[-1] == {"scheduled": 2, "failed": 1}
+    assert len(scheduler) == 2
+    assert scheduler.get(lines[0]["handle"]) is not None
+
+
+async def test_bulk_endpoint_needs_a_known_format(test_client):
+    resp = await test_client.post(
+        "/calls/bulk", data=b"[]", headers={"Content-Type": "application/json"}
+    )
+
+    assert resp.status == 415
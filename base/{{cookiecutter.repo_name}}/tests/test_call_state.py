@@ -0,0 +1,79 @@
+"""
+Test the table of calls in progress
+"""
+
+import asyncio
+from unittest.mock import Mock
+
+from {{cookiecutter.app_name}}.infrastructure.call_control import CallControl
+from {{cookiecutter.app_name}}.infrastructure.call_state import CallState, CallStateTable
+
+
+def test_call_lifecycle():
+    calls = CallStateTable()
+
+    calls.dialled("call-1", "+15551234567")
+    calls.observe("call-1", "call.initiated")
+    record = calls.observe("call-1", "call.answered")
+
+    assert record.state == CallState.ANSWERED
+    assert record.destination == "+15551234567"
+    assert record.answered >= record.created
+    assert calls.stats()["states"]["answered"] == 1
+
+    calls.observe("call-1", "call.hangup")
+
+    stats = calls.stats()
+    assert len(calls) == 0
+    assert stats["completed"] == 1
+    assert stats["states"]["answered"] == 0
+    assert len(calls.answer_times) == 1
+
+
+def test_unknown_calls_are_tracked_from_their_first_state():
+    calls = CallStateTable()
+
+    assert calls.observe("inbound", "call.dtmf.received") is None
+    assert calls.observe("inbound", "call.initiated").destination is None
+    assert len(calls) == 1
+
+
+def test_table_is_bounded():
+    calls = CallStateTable(max_size=2)
+
+    for n in range(3):
+        calls.dialled(f"call-{n}", "+1")
+
+    assert len(calls) == 2
+    assert calls.get("call-2") is None
+    assert calls.overflow == 1
+
+
+async def test_silent_calls_expire(loop):
+    calls = CallStateTable(ttl=0.05, tick=0.01)
+    calls.dialled("quiet", "+1")
+    calls.dialled("chatty", "+1")
+
+    for _ in range(4):
+        await asyncio.sleep(0.03)
+        calls.observe("chatty", "call.initiated")
+
+    assert calls.get("quiet") is None
+    assert calls.get("chatty").state == CallState.INITIATED
+    assert calls.stuck == 1
+
+
+async def test_call_control_tracks_calls(loop):
+    telnyx_app = Mock()
+    telnyx_app.Call.create.return_value = Mock(call_control_id="call-1")
+    calls = CallStateTable()
+    call_control_app = CallControl(
+        None, telnyx_app, "conn", "", "+2", call_states=calls
+    )
+
+    await call_control_app.dial("+15551234567")
+    await call_control_app.process_webhook("call-1", "call.speak.ended")
+
+    record = calls.get("call-1")
+    assert record.destination == "+15551234567"
+    assert record.state == CallState.SPOKEN
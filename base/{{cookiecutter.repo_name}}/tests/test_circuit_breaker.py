@@ -0,0 +1,53 @@
+"""
+Test the circuit breaker state machine
+"""
+
+from {{cookiecutter.app_name}}.infrastructure.circuit_breaker import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+)
+
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert breaker.trips == 1
+
+
+def test_half_open_trial_decides():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+
+    breaker.record_failure()
+    assert breaker.state == HALF_OPEN
+
+    # A single trial call is let through, and its failure opens the circuit again.
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.trips == 2
+
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+
+
+def test_release_frees_the_trial():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.allow()
@@ -0,0 +1,115 @@
+"""
+Test duplicate webhook suppression
+"""
+
+import asyncio
+
+import pytest
+
+from {{cookiecutter.app_name}}.infrastructure import constants
+from {{cookiecutter.app_name}}.infrastructure.dedupe import BloomFilter, LRUSet, WebhookDeduplicator
+
+
+def _webhook(event_id, call_control_id="call-1", event_type="call.answered"):
+    return {
+        "data": {
+            "id": event_id,
+            "event_type": event_type,
+            "payload": {"call_control_id": call_control_id},
+        }
+    }
+
+
+def test_lru_set_forgets_least_recently_seen():
+    keys = LRUSet(2)
+    keys.add("a")
+    keys.add("b")
+    assert "a" in keys
+
+    keys.add("c")
+
+    assert "a" in keys
+    assert "b" not in keys
+
+
+def test_bloom_filter_error_rate():
+    bloom = BloomFilter(10000, 0.01)
+    for n in range(10000):
+        bloom.add(f"added-{n}")
+
+    assert all(f"added-{n}" in bloom for n in range(10000))
+    false_positives = sum(f"other-{n}" in bloom for n in range(10000))
+    assert false_positives < 300
+
+
+def test_bloom_fronts_the_lru():
+    deduplicator = WebhookDeduplicator(max_size=10, bloom_capacity=1000)
+    for n in range(100):
+        deduplicator.add(f"event-{n}")
+
+    # The LRU set decides, even for ids the filters still remember.
+    assert "event-0" not in deduplicator
+    assert "event-99" in deduplicator
+    assert "event-100" not in deduplicator
+    assert deduplicator.stats() == {"remembered": 10, "duplicates": 1}
+
+
+def test_bloom_keeps_what_the_lru_keeps():
+    deduplicator = WebhookDeduplicator(max_size=10, bloom_capacity=5)
+    deduplicator.add("kept")
+    for n in range(30):
+        deduplicator.add(f"event-{n}")
+        # Seen again, so the LRU set keeps it
+        assert "kept" in deduplicator
+
+    assert "kept" in deduplicator
+
+
+def test_repeated_lookups_do_not_fill_the_bloom():
+    deduplicator = WebhookDeduplicator(max_size=100, bloom_capacity=100)
+    deduplicator.add("X")
+    deduplicator.add("Y")
+    for _ in range(250):
+        assert "Y" in deduplicator
+
+    assert "X" in deduplicator
+
+
+async def test_bloom_false_positive_is_delivered(test_client, dialer):
+    deduplicator = test_client.app[constants.WEBHOOK_DEDUPLICATOR]
+    # Set the bits of an id that was never processed.
+    deduplicator._bloom.add("event-1")
+
+    resp = await test_client.post("/webhook", json=_webhook("event-1"))
+    assert resp.status == 200
+
+    await test_client.app[constants.WEBHOOK_DISPATCHER].join()
+    assert dialer.webhooks == [("call-1", "call.answered")]
+    assert deduplicator.duplicates == 0
+    assert "event-1" in deduplicator
+
+
+async def test_redelivered_webhook_is_processed_once(test_client, dialer):
+    for _ in range(3):
+        resp = await test_client.post("/webhook", json=_webhook("event-1"))
+        assert resp.status == 200
+
+    await test_client.app[constants.WEBHOOK_DISPATCHER].join()
+    assert dialer.webhooks == [("call-1", "call.answered")]
+    assert test_client.app[constants.WEBHOOK_DEDUPLICATOR].duplicates == 2
+
+
+async def test_rejected_webhook_is_processed_when_resent(test_client, dialer):
+    dialer.delay = 1
+    dispatcher = test_client.app[constants.WEBHOOK_DISPATCHER]
+
+    # Keep the worker busy, then fill up the queue the call is sharded to.
+    dispatcher.submit("call-1", "call.answered")
+    await asyncio.sleep(0)
+    with pytest.raises(asyncio.QueueFull):
+        while True:
+            dispatcher.submit("call-1", "call.answered")
+
+    resp = await test_client.post("/webhook", json=_webhook("event-1"))
+    assert resp.status == 503
+    assert "event-1" not in test_client.app[constants.WEBHOOK_DEDUPLICATOR]
@@ -0,0 +1,126 @@
+"""
+Test the live feed of changes to the schedule and the calls
+"""
+
+import asyncio
+import json
+import time
+from unittest.mock import Mock
+
+from {{cookiecutter.app_name}}.infrastructure import constants, events
+from {{cookiecutter.app_name}}.infrastructure.call_control import CallControl
+from {{cookiecutter.app_name}}.infrastructure.events import EventBroadcaster
+from {{cookiecutter.app_name}}.infrastructure.recurrence import IntervalRule, Recurring
+from {{cookiecutter.app_name}}.infrastructure.scheduler import UnifiedTimedQueue
+
+FUTURE = 4070952000.0
+
+
+async def read_event(resp):
+    """Read the next event from an event stream, skipping comments."""
+    fields = {}
+    while True:
+        line = (await asyncio.wait_for(resp.content.readline(), 5)).decode()
+        if line == "":
+            return None
+        line = line.rstrip("\n")
+        if not line:
+            if fields:
+                return fields["event"], json.loads(fields["data"])
+            continue
+        if not line.startswith(":"):
+            name, value = line.split(": ", 1)
+            fields[name] = value
+
+
+async def test_events_are_fanned_out_in_one_chunk(loop):
+    broadcaster = EventBroadcaster()
+    first, second = broadcaster.subscribe(), broadcaster.subscribe()
+
+    broadcaster.publish(events.CANCELLED, {"handle": 1})
+    broadcaster.publish(events.CANCELLED, {"handle": 2})
+
+    chunk = await first.get(1)
+    assert chunk == (
+        b'id: 1\nevent: cancelled\ndata: {"handle": 1}\n\n'
+        b'id: 2\nevent: cancelled\ndata: {"handle": 2}\n\n'
+    )
+    assert await second.get(1) == chunk
+    assert await first.get(0.01) == events.KEEPALIVE
+    assert broadcaster.stats() == {"subscribers": 2, "published": 2, "dropped": 0}
+
+
+async def test_slow_subscribers_are_dropped(loop):
+    broadcaster = EventBroadcaster(max_pending=2)
+    slow, fast = broadcaster.subscribe(), broadcaster.subscribe()
+
+    for handle in range(3):
+        broadcaster.publish(events.CANCELLED, {"handle": handle})
+        if handle < 2:
+            await fast.get(1)
+
+    assert slow.dropped and not fast.dropped
+    assert await slow.get(1) is None
+    assert len(broadcaster) == 1
+    assert broadcaster.dropped == 1
+
+    # Closing ends the streams without sending what is still buffered.
+    broadcaster.close()
+    assert await fast.get(1) is None
+    assert await broadcaster.subscribe().get(1) is None
+
+
+async def test_recurring_dispatch_is_published_with_next_occurrence(loop, dialer):
+    broadcaster = EventBroadcaster()
+    subscription = broadcaster.subscribe()
+    scheduler = UnifiedTimedQueue(dialer, loop=loop, events=broadcaster)
+
+    now = time.time()
+    handle = scheduler.put(Recurring("+15550000000", IntervalRule(60, now)), now)
+    chunk = await subscription.get(1)
+    assert b"event: dispatched\n" in chunk
+    data = json.loads(chunk.split(b"data: ")[1])
+    assert data["handle"] == handle
+    assert data["phone_number"] == "+15550000000"
+    assert data["next_ts"] == now + 60
+    await scheduler.close()
+
+
+async def test_call_control_publishes_call_progress(loop):
+    broadcaster = EventBroadcaster()
+    subscription = broadcaster.subscribe()
+    call_control_app = CallControl(None, Mock(), "conn", "", "+2", events=broadcaster)
+
+    await call_control_app.process_webhook("call-1", "call.initiated")
+    await call_control_app.process_webhook("call-1", "call.hangup")
+
+    chunk = await subscription.get(1)
+    assert chunk.count(b"event: ") == 1
+    assert b'event: completed\ndata: {"call_control_id": "call-1"}' in chunk
+
+
+async def test_dashboards_follow_the_schedule(test_client):
+    resp = await test_client.get("/events")
+    assert resp.headers["Content-Type"] == "text/event-stream"
+
+    post = await test_client.post(
+        "/",
+        json={"date": "2099-01-01", "time": "10:00", "phone_number": "+15550000000"},
+    )
+    handle = (await post.json())["handle"]
+    event, data = await read_event(resp)
+    assert event == "scheduled"
+    assert data["handle"] == handle
+    assert data["phone_number"] == "+15550000000"
+
+    await test_client.delete(f"/calls/{handle}")
+    assert await read_event(resp) == ("cancelled", {"handle": handle})
+
+    scheduler = test_client.server.app[constants.SCHEDULER]
+    handle = scheduler.put("+15550000001", time.time())
+    event, data = await read_event(resp)
+    assert (event, data["handle"], data["next_ts"]) == ("dispatched", handle, None)
+
+    # Shutting down ends the stream.
+    test_client.server.app[constants.EVENTS].close()
+    assert await read_event(resp) is None
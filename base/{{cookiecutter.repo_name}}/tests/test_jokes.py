@@ -0,0 +1,178 @@
+"""
+Test the pool of pre-fetched jokes
+"""
+
+import asyncio
+import itertools
+from pathlib import Path
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+from {{cookiecutter.app_name}}.infrastructure import jokes
+from {{cookiecutter.app_name}}.infrastructure.call_control import CallControl
+from {{cookiecutter.app_name}}.infrastructure.circuit_breaker import OPEN, CircuitBreaker
+from {{cookiecutter.app_name}}.infrastructure.jokes import JokePool, JokeSource, hedged, load_corpus
+
+
+def _counting_fetch(jokes):
+    """A fetch function returning the given jokes in turn, counting the calls."""
+    jokes = itertools.cycle(jokes)
+
+    async def fetch():
+        fetch.calls += 1
+        return next(jokes)
+
+    fetch.calls = 0
+    return fetch
+
+
+async def test_fetch_releases_the_connection(aiohttp_server, loop):
+    async def joke(request):
+        if request.query.get("fail"):
+            return web.Response(status=500)
+        if request.query.get("slow"):
+            # Send the headers, then stall in the middle of the body
+            resp = web.StreamResponse(headers={"Content-Type": "application/json"})
+            resp.content_length = 100
+            await resp.prepare(request)
+            await resp.write(b'{"joke": ')
+            await asyncio.sleep(10)
+        return web.json_response({"joke": "Knock knock"})
+
+    app = web.Application()
+    app.router.add_get("/", joke)
+    server = await aiohttp_server(app)
+    url = str(server.make_url("/"))
+
+    # With a single connection, a leaked one would make the last fetch hang.
+    connector = aiohttp.TCPConnector(limit=1, loop=loop)
+    async with aiohttp.ClientSession(connector=connector, loop=loop) as session:
+        with pytest.raises(aiohttp.ClientResponseError):
+            await jokes.fetch_joke(session, url + "?fail=1")
+
+        slow = asyncio.ensure_future(jokes.fetch_joke(session, url + "?slow=1"))
+        await asyncio.sleep(0.05)
+        slow.cancel()
+        # Holding on to the error keeps the fetch's frame alive, as logging it would
+        (cancelled,) = await asyncio.gather(slow, return_exceptions=True)
+        assert isinstance(cancelled, asyncio.CancelledError)
+
+        assert await jokes.fetch_joke(session, url, timeout=1) == "Knock knock"
+
+
+async def test_refill_dedupes(loop):
+    pool = JokePool(_counting_fetch(["a", "b", "a", "c"]), size=10, loop=loop)
+
+    await pool.refill()
+
+    # The joke API only has three jokes, so the pool stops short of full.
+    assert len(pool) == 3
+    assert pool.duplicates > 0
+    assert sorted(pool.take() for _ in range(3)) == ["a", "b", "c"]
+
+
+async def test_take_counts_hits_and_misses(loop):
+    pool = JokePool(_counting_fetch(["a"]), size=1, loop=loop)
+    pool.add("a")
+
+    assert pool.take() == "a"
+    assert pool.take() is None
+    assert pool.stats()["hits"] == 1
+    assert pool.stats()["misses"] == 1
+    assert pool.stats()["hit_rate"] == 0.5
+
+
+async def test_evict_by_uses_and_age(loop):
+    pool = JokePool(_counting_fetch(["a"]), max_uses=2, max_age=60, loop=loop)
+    pool.add("a")
+    pool.add("b")
+
+    assert [pool.take() for _ in range(4)] == ["a", "b", "a", "b"]
+    assert pool.take() is None
+
+    pool.add("old")
+    pool._jokes[0].fetched -= 120
+    pool.evict_stale()
+    assert len(pool) == 0
+    assert pool.evicted == 1
+
+
+async def test_background_refill(loop):
+    fetch = _counting_fetch(range(100))
+    pool = JokePool(fetch, size=5, refill_interval=60, loop=loop)
+    pool.start()
+    await asyncio.sleep(0.01)
+    assert len(pool) == 5
+
+    # Taking a joke wakes the refill task straight away.
+    pool.take()
+    await asyncio.sleep(0.01)
+    assert len(pool) == 5
+    assert fetch.calls == 6
+    await pool.close()
+
+
+async def test_get_joke_falls_back_to_the_api(loop, monkeypatch):
+    pool = JokePool(_counting_fetch(["pooled"]), loop=loop)
+    pool.add("pooled")
+    call_control_app = CallControl(None, None, "conn", "", "+2", joke_pool=pool)
+
+    async def fetch_live(client_session, joke_url, timeout=None):
+        return "live"
+
+    monkeypatch.setattr(jokes, "fetch_joke", fetch_live)
+
+    assert await call_control_app._get_joke() == "pooled"
+    assert await call_control_app._get_joke() == "live"
+
+
+async def test_hedged_returns_the_first_answer(loop):
+    started = []
+
+    async def fetch():
+        started.append(len(started))
+        # The first attempt hangs, the hedged one answers.
+        await asyncio.sleep(10 if len(started) == 1 else 0)
+        return len(started)
+
+    assert await hedged(fetch, 0.01, 2, loop=loop) == 2
+    assert len(started) == 2
+
+
+async def test_hedged_raises_when_every_attempt_fails(loop):
+    async def fetch():
+        raise ValueError("down")
+
+    with pytest.raises(ValueError):
+        await hedged(fetch, 0.01, 3, loop=loop)
+
+
+async def test_source_falls_back_to_the_corpus(loop, monkeypatch):
+    calls = []
+
+    async def failing_fetch(client_session, joke_url, timeout=None):
+        calls.append(joke_url)
+        raise asyncio.TimeoutError()
+
+    monkeypatch.setattr(jokes, "fetch_joke", failing_fetch)
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    source = JokeSource(
+        None, "url", hedge_attempts=1, breaker=breaker, corpus=["local"], loop=loop
+    )
+
+    assert [await source.get() for _ in range(5)] == ["local"] * 5
+
+    # The circuit opened after two failures, the joke API was left alone after that.
+    assert len(calls) == 2
+    assert source.stats()["state"] == OPEN
+    assert source.stats()["fallbacks"] == 5
+
+
+def test_load_corpus():
+    path = Path(jokes.__file__).parent.parent / "data" / "jokes.txt.gz"
+
+    corpus = load_corpus(str(path))
+
+    assert len(corpus) == len(set(corpus)) > 0
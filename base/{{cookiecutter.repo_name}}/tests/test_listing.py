@@ -0,0 +1,138 @@
+"""
+Test listing the scheduled calls a page at a time
+"""
+
+import random
+import time
+from pathlib import Path
+
+import aiohttp_jinja2
+import jinja2
+import pytest
+
+from {{cookiecutter.app_name}}.infrastructure import constants
+from {{cookiecutter.app_name}}.infrastructure.listing import ScheduleListing
+from {{cookiecutter.app_name}}.infrastructure.scheduler import UnifiedTimedQueue
+from {{cookiecutter.app_name}}.infrastructure.window_store import (
+    SQLiteCallStore,
+    WindowedTimedQueue,
+)
+
+FUTURE = 4070952000.0
+
+
+async def test_pages_in_time_order(loop, dialer):
+    scheduler = UnifiedTimedQueue(dialer, loop=loop)
+    listing = ScheduleListing(scheduler, spacing=0)
+    for n in random.Random(1).sample(range(25), 25):
+        scheduler.put(n, FUTURE + n)
+
+    calls, cursor = await listing.page(limit=10)
+    first_generation = listing.generation
+    assert [qm.msg for qm in calls] == list(range(10))
+
+    # A call put before the cursor doesn't shift the next page.
+    scheduler.put("early", FUTURE - 1)
+    calls, cursor = await listing.page(cursor, limit=10)
+    assert [qm.msg for qm in calls] == list(range(10, 20))
+    assert listing.generation == first_generation + 1
+
+    calls, cursor = await listing.page(cursor, limit=10)
+    assert [qm.msg for qm in calls] == list(range(20, 25))
+    assert cursor is None
+
+    # Nothing changed, so the snapshot is reused.
+    await listing.page(limit=10)
+    assert listing.generation == first_generation + 1
+    await scheduler.close()
+
+
+async def test_snapshot_follows_changes(loop, dialer):
+    scheduler = UnifiedTimedQueue(dialer, loop=loop)
+    listing = ScheduleListing(scheduler, spacing=0)
+    handles = [scheduler.put(n, FUTURE + n) for n in range(10)]
+    await listing.page()
+
+    scheduler.cancel(handles[2])
+    scheduler.reschedule(handles[0], FUTURE + 5)
+    scheduler.reschedule(handles[9], FUTURE - 1)
+    scheduler.put_many([("a", FUTURE + 5), ("b", FUTURE + 0.5)])
+
+    calls, _ = await listing.page()
+    assert [qm.msg for qm in calls] == [9, "b", 1, 3, 4, 0, 5, "a", 6, 7, 8]
+    assert len(listing) == 11
+    await scheduler.close()
+
+
+async def test_windowed_scheduler_pages_itself(loop, dialer, tmp_path):
+    store = SQLiteCallStore(str(tmp_path / "scheduler.db"))
+    scheduler = WindowedTimedQueue(dialer, store, loop=loop, window=60)
+    scheduler.load()
+    listing = ScheduleListing(scheduler)
+    now = time.time()
+    for n in random.Random(1).sample(range(6), 6):
+        # Every other call is outside the window, on disk only
+        scheduler.put(str(n), now + 3600 * (n % 2) + n)
+
+    def no_snapshots():
+        raise AssertionError("The listing took a snapshot")
+
+    scheduler.items = no_snapshots
+
+    pages = []
+    cursor = None
+    while True:
+        calls, cursor = await listing.page(cursor, limit=2)
+        pages.append([qm.msg for qm in calls])
+        if cursor is None:
+            break
+    assert pages == [["0", "2"], ["4", "1"], ["3", "5"]]
+    assert len(listing) == 6
+    await scheduler.close()
+
+
+async def test_list_calls_endpoint(test_client):
+    scheduler = test_client.server.app[constants.SCHEDULER]
+    handles = [scheduler.put(f"+1555000000{n}", FUTURE + n) for n in range(5)]
+
+    resp = await test_client.get("/calls", params={"limit": 3})
+    page = await resp.json()
+    assert [call["handle"] for call in page["calls"]] == handles[:3]
+    assert page["calls"][0] == {
+        "handle": handles[0],
+        "ts": FUTURE,
+        "phone_number": "+15550000000",
+    }
+
+    resp = await test_client.get("/calls", params={"after": page["next"]})
+    page = await resp.json()
+    assert [call["handle"] for call in page["calls"]] == handles[3:]
+    assert page["next"] is None
+
+    resp = await test_client.get("/calls", params={"after": "nope"})
+    assert resp.status == 400
+
+
+@pytest.fixture
+async def ui_client(aiohttp_client, web_app):
+    templates = Path(constants.__file__).parents[1] / "templates"
+    aiohttp_jinja2.setup(web_app, loader=jinja2.FileSystemLoader(str(templates)))
+    return await aiohttp_client(web_app)
+
+
+async def test_homepage_is_cached_until_the_calls_change(ui_client):
+    app = ui_client.server.app
+    for n in range(60):
+        app[constants.SCHEDULER].put(f"+1555{n:07d}", FUTURE + n)
+
+    page = await (await ui_client.get("/")).text()
+    assert "+15550000049" in page and "+15550000050" not in page
+    assert "10 more" in page
+
+    cached = app[constants.LISTING].homepage
+    await ui_client.get("/")
+    assert app[constants.LISTING].homepage is cached
+
+    app[constants.SCHEDULER].put("+15559999999", FUTURE - 1)
+    page = await (await ui_client.get("/")).text()
+    assert "+15559999999" in page
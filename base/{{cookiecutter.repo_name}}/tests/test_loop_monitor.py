@@ -0,0 +1,93 @@
+"""
+Test watching the event loop for lag and blocking code
+"""
+
+import asyncio
+import time
+
+from aiohttp import web
+
+from {{cookiecutter.app_name}}.infrastructure import constants
+from {{cookiecutter.app_name}}.infrastructure.loop_monitor import LoopMonitor
+from {{cookiecutter.app_name}}.infrastructure.server import health_handlers
+
+
+def block_the_loop(seconds):
+    time.sleep(seconds)
+
+
+async def test_measures_lag(loop):
+    monitor = LoopMonitor(interval=0.01, loop=loop)
+    monitor.start()
+    await asyncio.sleep(0.1)
+    await monitor.close()
+
+    stats = monitor.stats()
+    assert not stats["degraded"]
+    assert 0 <= stats["p50_lag"] <= stats["p99_lag"] <= stats["max_lag"] < 0.25
+    assert stats["stalls"] == 0
+
+
+async def test_captures_the_stack_of_blocking_code(loop):
+    monitor = LoopMonitor(interval=0.02, slow_threshold=0.1, loop=loop)
+    monitor.start()
+    await asyncio.sleep(0.05)
+    block_the_loop(0.3)
+    await asyncio.sleep(0.05)
+    await monitor.close()
+
+    stats = monitor.stats()
+    assert stats["max_lag"] >= 0.2
+    assert stats["stalls"] == 1
+    stall = stats["recent_stalls"][0]
+    assert "block_the_loop" in stall["stack"]
+    assert "time.sleep(seconds)" in stall["stack"]
+    assert stall["duration"] >= 0.2
+
+
+async def test_not_degraded_until_started(loop):
+    monitor = LoopMonitor(degraded_after=0, loop=loop)
+    assert not monitor.degraded
+
+
+async def test_health_check_reports_degraded(aiohttp_client, loop):
+    monitor = LoopMonitor(
+        interval=0.01, degraded_lag=0.05, degraded_after=0.1, loop=loop
+    )
+    app = web.Application()
+    app[constants.LOOP_MONITOR] = monitor
+    app.router.add_get("/health", health_handlers.health_check)
+    client = await aiohttp_client(app)
+
+    monitor.start()
+    try:
+        resp = await client.get("/health")
+        assert resp.status == 200
+
+        # A single stall is not enough, the lag has to stay high.
+        block_the_loop(0.2)
+        await asyncio.sleep(0.05)
+        resp = await client.get("/health")
+        assert resp.status == 200
+
+        stop = asyncio.Event()
+
+        async def keep_blocking():
+            while not stop.is_set():
+                block_the_loop(0.1)
+                await asyncio.sleep(0)
+
+        blocker = asyncio.ensure_future(keep_blocking())
+        await asyncio.sleep(0.3)
+        resp = await client.get("/health")
+        stop.set()
+        await blocker
+        assert resp.status == 503
+        assert (await resp.json())["status"] == "DEGRADED"
+
+        # Recovers once the loop keeps up again
+        await asyncio.sleep(0.1)
+        resp = await client.get("/health")
+        assert resp.status == 200
+    finally:
+        await monitor.close()
@@ -0,0 +1,76 @@
+"""
+Test the metrics registry and the /metrics endpoint
+"""
+
+from {{cookiecutter.app_name}}.infrastructure import metrics
+from {{cookiecutter.app_name}}.infrastructure.metrics import Registry
+from {{cookiecutter.app_name}}.infrastructure.webhook_queue import WebhookDispatcher
+
+
+def test_exposition_format():
+    registry = Registry()
+    requests = registry.counter("requests", "Requests.", ("path",))
+    depth = registry.gauge("depth", "Queue depth.")
+    latency = registry.histogram("latency_seconds", "Latency.", buckets=(0.1, 1))
+
+    requests.labels('/a"b').inc()
+    requests.labels("/").inc(2)
+    depth.set(3)
+    for value in (0.05, 0.1, 0.5, 7):
+        latency.observe(value)
+
+    assert registry.expose() == (
+        "# HELP requests Requests.\n"
+        "# TYPE requests counter\n"
+        'requests_total{path="/"} 2\n'
+        'requests_total{path="/a\\"b"} 1\n'
+        "# HELP depth Queue depth.\n"
+        "# TYPE depth gauge\n"
+        "depth 3\n"
+        "# HELP latency_seconds Latency.\n"
+        "# TYPE latency_seconds histogram\n"
+        'latency_seconds_bucket{le="0.1"} 2\n'
+        'latency_seconds_bucket{le="1"} 3\n'
+        'latency_seconds_bucket{le="+Inf"} 4\n'
+        "latency_seconds_sum 7.65\n"
+        "latency_seconds_count 4\n"
+    )
+
+
+def test_label_values_are_bounded():
+    counter = Registry().counter("events", "Events.", ("type",))
+    for n in range(metrics.MAX_SERIES + 10):
+        counter.labels(str(n)).inc()
+
+    series = dict(counter.series())
+    assert len(series) == metrics.MAX_SERIES + 1
+    assert series[(metrics.OTHER,)].value == 10
+
+
+async def test_webhooks_are_timed_by_event_type(loop, dialer):
+    histogram = metrics.WEBHOOK_SECONDS.labels("call.test")
+    before = histogram.count
+
+    dispatcher = WebhookDispatcher(dialer, workers=1, loop=loop)
+    dispatcher.submit("call-1", "call.test")
+    dispatcher.submit("call-1", "call.test")
+    await dispatcher.join()
+    await dispatcher.close()
+
+    assert histogram.count == before + 2
+
+
+async def test_metrics_endpoint(test_client):
+    await test_client.get("/calls")
+    await test_client.get("/calls/1/nope")
+
+    resp = await test_client.get("/metrics")
+    assert resp.status == 200
+    assert resp.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+
+    text = await resp.text()
+    name = f"{metrics.NAMESPACE}_http_request_duration_seconds_count"
+    assert name + '{method="GET",route="/calls",status="200"} ' in text
+    assert name + '{method="GET",route="unmatched",status="404"} ' in text
+    assert f"{metrics.NAMESPACE}_scheduler_pending_calls 0\n" in text
+    assert f"{metrics.NAMESPACE}_webhooks_pending 0\n" in text
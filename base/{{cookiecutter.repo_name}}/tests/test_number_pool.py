@@ -0,0 +1,101 @@
+"""
+Test the pool of source numbers calls are dialled from
+"""
+
+from unittest.mock import Mock
+
+import pytest
+
+from {{cookiecutter.app_name}}.infrastructure.call_control import CallControl
+from {{cookiecutter.app_name}}.infrastructure.number_pool import ROUND_ROBIN, Route, RoutePool
+
+
+def _pool(n=3, **kwargs):
+    return RoutePool([Route("conn", f"+{i}") for i in range(n)], **kwargs)
+
+
+def test_least_loaded_spreads_calls():
+    pool = _pool()
+
+    routes = [pool.choose() for _ in range(6)]
+
+    assert [route.in_flight for route in pool.routes] == [2, 2, 2]
+    assert len({route.src_number for route in routes[:3]}) == 3
+
+
+def test_least_loaded_prefers_idle_routes():
+    pool = _pool()
+    busy = pool.choose()
+    pool.dialled(busy, "call-1")
+
+    assert busy not in [pool.choose(), pool.choose()]
+
+    pool.finished("call-1")
+    assert busy.in_flight == 0
+
+
+def test_round_robin():
+    pool = _pool(strategy=ROUND_ROBIN)
+
+    numbers = [pool.choose().src_number for _ in range(4)]
+
+    assert numbers == ["+0", "+1", "+2", "+0"]
+
+
+def test_failing_route_is_quarantined():
+    pool = _pool(n=2, strategy=ROUND_ROBIN, error_threshold=2)
+    bad = pool.routes[0]
+
+    for _ in range(2):
+        pool.failed(bad)
+
+    assert [pool.choose().src_number for _ in range(3)] == ["+1"] * 3
+    assert pool.stats()["quarantines"] == 1
+    assert pool.stats()["routes"][0]["quarantined"]
+
+
+def test_route_returns_after_quarantine():
+    pool = _pool(n=1, error_threshold=1, quarantine_seconds=0)
+    route = pool.routes[0]
+
+    pool.failed(route)
+
+    assert pool.choose() is route
+
+
+def test_from_config_defaults_to_the_single_number():
+    pool = RoutePool.from_config({}, "conn", "+1")
+    assert [(r.connection_id, r.src_number) for r in pool.routes] == [("conn", "+1")]
+
+    pool = RoutePool.from_config(
+        {"routes": [{"src_number": "+2"}, {"src_number": "+3", "connection_id": "c"}]},
+        "conn",
+        "+1",
+    )
+    assert [(r.connection_id, r.src_number) for r in pool.routes] == [
+        ("conn", "+2"),
+        ("c", "+3"),
+    ]
+
+
+async def test_dial_uses_the_pool(loop):
+    telnyx_app = Mock()
+    telnyx_app.Call.create.side_effect = [
+        Mock(call_control_id="call-1"),
+        RuntimeError("Number disabled"),
+    ]
+    pool = _pool(n=2, strategy=ROUND_ROBIN)
+    call_control_app = CallControl(None, telnyx_app, "conn", "", "+9", routes=pool)
+    number = "+15551234567"
+
+    await call_control_app.dial(number)
+    with pytest.raises(RuntimeError):
+        await call_control_app.dial(number)
+
+    senders = [c[1]["from_"] for c in telnyx_app.Call.create.call_args_list]
+    assert senders == ["+0", "+1"]
+    assert [route.in_flight for route in pool.routes] == [1, 0]
+    assert pool.routes[1].errors == 1
+
+    await call_control_app.process_webhook("call-1", "call.hangup")
+    assert pool.routes[0].in_flight == 0
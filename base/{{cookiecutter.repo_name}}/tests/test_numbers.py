@@ -0,0 +1,45 @@
+"""
+Test normalising the numbers calls are scheduled to
+"""
+
+import pytest
+
+from {{cookiecutter.app_name}}.infrastructure.cache import LRUCache
+from {{cookiecutter.app_name}}.infrastructure.numbers import InvalidNumber, NumberNormaliser
+
+
+def test_lru_cache_drops_the_least_recently_used():
+    cache = LRUCache(max_size=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert "a" in cache and "c" in cache
+    assert cache.get("b") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+async def test_normalise_is_cached(loop):
+    numbers = NumberNormaliser(loop=loop)
+
+    assert numbers.normalise("+1 (555) 123-4567") == "+15551234567"
+    assert numbers.normalise("+1 (555) 123-4567") == "+15551234567"
+    assert numbers.stats()["hits"] == 1
+
+    with pytest.raises(InvalidNumber):
+        numbers.normalise("not a number")
+
+
+@pytest.mark.parametrize("pool_threshold", [1000, 2])
+async def test_normalise_many(loop, pool_threshold):
+    numbers = NumberNormaliser(pool_threshold=pool_threshold, chunk_size=2, loop=loop)
+    numbers.normalise("+15551234567")
+
+    raws = ["+15551234567", "+1 555 123 4568", "nope", "+15551234569", "nope"]
+    e164s = await numbers.normalise_many(raws)
+
+    assert e164s == ["+15551234567", "+15551234568", None, "+15551234569", None]
+    # Only the uncached numbers go to the pool.
+    assert numbers.stats()["pooled"] == (3 if pool_threshold == 2 else 0)
+    numbers.close()
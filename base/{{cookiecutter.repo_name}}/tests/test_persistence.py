@@ -0,0 +1,95 @@
+"""
+Test the scheduler journal
+"""
+
+import asyncio
+import time
+
+from {{cookiecutter.app_name}}.infrastructure.persistence import LOG_FILE, SchedulerJournal
+from {{cookiecutter.app_name}}.infrastructure.scheduler import UnifiedTimedQueue
+
+
+async def _scheduler_with_journal(loop, dialer, directory):
+    journal = SchedulerJournal(str(directory), loop=loop)
+    scheduler = UnifiedTimedQueue(dialer, loop=loop, journal=journal)
+    entries, next_handle = journal.recover()
+    scheduler.restore(entries, next_handle)
+    journal.start(scheduler.items)
+    return scheduler, journal
+
+
+async def _restart(loop, dialer, directory, scheduler, journal):
+    await scheduler.close()
+    await journal.close()
+    return await _scheduler_with_journal(loop, dialer, directory)
+
+
+async def test_recover_after_restart(loop, dialer, tmp_path):
+    scheduler, journal = await _scheduler_with_journal(loop, dialer, tmp_path)
+
+    future = time.time() + 60
+    kept = scheduler.put("kept", future)
+    cancelled = scheduler.put("cancelled", future)
+    moved = scheduler.put("moved", future)
+    scheduler.cancel(cancelled)
+    scheduler.reschedule(moved, future + 60)
+
+    scheduler, journal = await _restart(loop, dialer, tmp_path, scheduler, journal)
+
+    assert sorted((qm.handle, qm.msg) for qm in scheduler.items()) == [
+        (kept, "kept"),
+        (moved, "moved"),
+    ]
+    assert scheduler.get(moved).ts == future + 60
+    assert scheduler.put("new", future) > moved
+    await scheduler.close()
+    await journal.close()
+
+
+async def test_recover_from_snapshot(loop, dialer, tmp_path):
+    scheduler, journal = await _scheduler_with_journal(loop, dialer, tmp_path)
+
+    future = time.time() + 60
+    for n in range(100):
+        scheduler.put(n, future + n)
+    await journal.flush()
+    await journal.compact()
+    scheduler.put("after", future)
+
+    scheduler, journal = await _restart(loop, dialer, tmp_path, scheduler, journal)
+
+    assert len(scheduler) == 101
+    assert len(scheduler._queue) == 101
+    await scheduler.close()
+    await journal.close()
+
+
+async def test_torn_tail_is_ignored(loop, dialer, tmp_path):
+    scheduler, journal = await _scheduler_with_journal(loop, dialer, tmp_path)
+    scheduler.put("kept", time.time() + 60)
+    await scheduler.close()
+    await journal.close()
+
+    with open(tmp_path / LOG_FILE, "ab") as f:
+        f.write(b"\x01\x02\x03")
+
+    scheduler, journal = await _scheduler_with_journal(loop, dialer, tmp_path)
+
+    assert [qm.msg for qm in scheduler.items()] == ["kept"]
+    await scheduler.close()
+    await journal.close()
+
+
+async def test_dispatched_items_are_not_recovered(loop, dialer, tmp_path):
+    scheduler, journal = await _scheduler_with_journal(loop, dialer, tmp_path)
+    scheduler.put("due", time.time())
+    scheduler.put("pending", time.time() + 60)
+
+    await asyncio.sleep(0.05)
+    await journal.flush()
+    scheduler, journal = await _restart(loop, dialer, tmp_path, scheduler, journal)
+
+    assert dialer.dialled == ["due"]
+    assert [qm.msg for qm in scheduler.items()] == ["pending"]
+    await scheduler.close()
+    await journal.close()
@@ -0,0 +1,112 @@
+"""
+Test prefetching jokes while calls ring
+"""
+
+import asyncio
+from unittest.mock import Mock
+
+from {{cookiecutter.app_name}}.infrastructure.cache import TTLMap
+from {{cookiecutter.app_name}}.infrastructure.call_control import CallControl, discard_prefetch
+
+
+class FakeJokeSource:
+    def __init__(self):
+        self.fetched = 0
+
+    async def get(self):
+        self.fetched += 1
+        return f"joke {self.fetched}"
+
+
+class FailingOnceJokeSource(FakeJokeSource):
+    async def get(self):
+        if not self.fetched:
+            self.fetched += 1
+            raise ConnectionError("The joke API is down")
+        return await super().get()
+
+
+def _call_control(ttl=60, joke_source=None):
+    telnyx_app = Mock()
+    prefetched = TTLMap(ttl, on_evict=discard_prefetch)
+    call_control_app = CallControl(
+        None,
+        telnyx_app,
+        "conn",
+        "",
+        "+2",
+        joke_source=joke_source or FakeJokeSource(),
+        prefetched=prefetched,
+    )
+    return call_control_app, telnyx_app, prefetched
+
+
+def test_ttl_map_expires_and_bounds():
+    evicted = []
+    ttl_map = TTLMap(60, max_size=2, on_evict=lambda k, v: evicted.append(k))
+
+    ttl_map.set("a", 1)
+    ttl_map.set("b", 2)
+    ttl_map.set("c", 3)
+    assert evicted == ["a"]
+    assert ttl_map.pop("b") == 2
+    assert ttl_map.pop("b") is None
+
+    expired = TTLMap(0, on_evict=lambda k, v: evicted.append(k))
+    expired.set("d", 4)
+    assert "d" not in expired
+    assert expired.get("d") is None
+    assert expired.pop("d") is None
+    assert evicted == ["a", "d"]
+
+
+async def test_joke_is_fetched_while_ringing(loop):
+    call_control_app, telnyx_app, prefetched = _call_control()
+
+    await call_control_app.process_webhook("call-1", "call.initiated")
+    assert "call-1" in prefetched
+
+    await call_control_app.process_webhook("call-1", "call.answered")
+
+    telnyx_app.Call().speak.assert_called_once_with(
+        payload="joke 1", voice="male", language="en-GB"
+    )
+    assert len(prefetched) == 0
+    assert call_control_app.prefetch_stats()["hit_rate"] == 1.0
+
+
+async def test_unanswered_call_drops_its_joke(loop):
+    call_control_app, _, prefetched = _call_control()
+
+    await call_control_app.process_webhook("call-1", "call.initiated")
+    fetch = prefetched.get("call-1")
+    await call_control_app.process_webhook("call-1", "call.hangup")
+    await asyncio.sleep(0)
+
+    assert len(prefetched) == 0
+    assert fetch.done()
+
+
+async def test_answer_without_prefetch_is_a_miss(loop):
+    call_control_app, telnyx_app, _ = _call_control(ttl=0)
+
+    await call_control_app.process_webhook("call-1", "call.initiated")
+    await call_control_app.process_webhook("call-1", "call.answered")
+
+    telnyx_app.Call().speak.assert_called_once()
+    stats = call_control_app.prefetch_stats()
+    assert (stats["hits"], stats["misses"], stats["expired"]) == (0, 1, 1)
+
+
+async def test_failed_prefetch_is_not_a_hit(loop):
+    call_control_app, telnyx_app, _ = _call_control(joke_source=FailingOnceJokeSource())
+
+    await call_control_app.process_webhook("call-1", "call.initiated")
+    await call_control_app.process_webhook("call-1", "call.answered")
+
+    telnyx_app.Call().speak.assert_called_once_with(
+        payload="joke 2", voice="male", language="en-GB"
+    )
+    stats = call_control_app.prefetch_stats()
+    assert (stats["hits"], stats["misses"], stats["failures"]) == (0, 0, 1)
+    assert stats["hit_rate"] == 0.0
@@ -0,0 +1,163 @@
+"""
+Test profiling the live process
+"""
+
+import asyncio
+import time
+
+import pytest
+from aiohttp import web
+
+from {{cookiecutter.app_name}}.infrastructure import constants
+from {{cookiecutter.app_name}}.infrastructure.profiling import (
+    TOKEN_HEADER,
+    Profiler,
+    ProfilerBusy,
+)
+from {{cookiecutter.app_name}}.infrastructure.server import diagnostic_handlers
+
+TOKEN = "s3cret"
+
+HELD = []
+
+
+def busy_work():
+    time.sleep(0.01)
+    return sum(range(1000))
+
+
+def grow_memory():
+    HELD.append(bytearray(100 * 1024))
+
+
+async def keep_calling(function):
+    while True:
+        function()
+        await asyncio.sleep(0)
+
+
+@pytest.fixture
+async def working(loop):
+    task = asyncio.ensure_future(keep_calling(busy_work))
+    yield
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+@pytest.fixture
+async def profiler(loop):
+    profiler = Profiler(TOKEN, max_seconds=1, sample_interval=0.001, loop=loop)
+    yield profiler
+    profiler.close()
+
+
+async def test_profile(profiler, working):
+    report = await profiler.profile(0.1, sort="tottime", limit=5)
+    assert "busy_work" in report
+    assert "Ordered by: internal time" in report
+
+
+async def test_sample_collapsed_stacks(profiler, working):
+    stacks = await profiler.sample(0.1)
+    lines = stacks.splitlines()
+    assert lines
+    for line in lines:
+        stack, count = line.rsplit(" ", 1)
+        assert int(count) > 0
+    assert any(
+        line.split(" ")[0].endswith("test_profiling:busy_work") for line in lines
+    )
+
+
+async def test_memory_growth(profiler, loop):
+    HELD.clear()
+    task = asyncio.ensure_future(keep_calling(grow_memory))
+    try:
+        report = await profiler.memory_growth(0.05, limit=3)
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        HELD.clear()
+
+    first, top = report.splitlines()[:2]
+    assert "KiB more held after 0.05s" in first
+    assert "test_profiling.py" in top
+
+
+async def test_one_session_at_a_time(profiler):
+    session = asyncio.ensure_future(profiler.profile(0.05))
+    await asyncio.sleep(0)
+    with pytest.raises(ProfilerBusy):
+        await profiler.memory_growth(0.05)
+    await session
+    assert profiler.stats() == {"running": None, "sessions": 1}
+
+
+@pytest.fixture
+async def diagnostics_client(aiohttp_client, profiler):
+    app = web.Application()
+    app[constants.PROFILER] = profiler
+    app.router.add_get("/debug/profile", diagnostic_handlers.profile)
+    app.router.add_get("/debug/memory", diagnostic_handlers.memory)
+    return await aiohttp_client(app)
+
+
+async def test_requires_the_token(diagnostics_client):
+    resp = await diagnostics_client.get("/debug/profile?seconds=0.01")
+    assert resp.status == 403
+
+    resp = await diagnostics_client.get(
+        "/debug/profile?seconds=0.01", headers={TOKEN_HEADER: "wrong"}
+    )
+    assert resp.status == 403
+
+
+async def test_no_token_allows_nothing(aiohttp_client, loop):
+    app = web.Application()
+    app[constants.PROFILER] = Profiler("", loop=loop)
+    app.router.add_get("/debug/profile", diagnostic_handlers.profile)
+    client = await aiohttp_client(app)
+
+    resp = await client.get("/debug/profile?seconds=0.01", headers={TOKEN_HEADER: ""})
+    assert resp.status == 403
+
+
+async def test_not_found_when_disabled(aiohttp_client):
+    app = web.Application()
+    app.router.add_get("/debug/profile", diagnostic_handlers.profile)
+    client = await aiohttp_client(app)
+
+    resp = await client.get("/debug/profile", headers={TOKEN_HEADER: TOKEN})
+    assert resp.status == 404
+
+
+@pytest.mark.parametrize(
+    "query", ["seconds=5", "seconds=0", "seconds=soon", "format=svg", "sort=size"]
+)
+async def test_rejects_bad_parameters(diagnostics_client, query):
+    resp = await diagnostics_client.get(
+        f"/debug/profile?{query}", headers={TOKEN_HEADER: TOKEN}
+    )
+    assert resp.status == 400
+
+
+async def test_profile_and_memory_handlers(diagnostics_client, working):
+    headers = {TOKEN_HEADER: TOKEN}
+
+    resp = await diagnostics_client.get(
+        "/debug/profile?seconds=0.05&limit=10", headers=headers
+    )
+    assert resp.status == 200
+    assert "busy_work" in await resp.text()
+
+    resp = await diagnostics_client.get(
+        "/debug/profile?seconds=0.05&format=collapsed", headers=headers
+    )
+    assert resp.status == 200
+    assert "test_profiling:busy_work" in await resp.text()
+
+    resp = await diagnostics_client.get(
+        "/debug/memory?seconds=0.05&group_by=traceback", headers=headers
+    )
+    assert resp.status == 200
+    assert "KiB more held" in await resp.text()
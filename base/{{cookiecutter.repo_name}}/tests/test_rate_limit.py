@@ -0,0 +1,87 @@
+"""
+Test outbound call rate limiting and slot admission
+"""
+
+import time
+
+import pytest
+
+from {{cookiecutter.app_name}}.infrastructure import constants
+from {{cookiecutter.app_name}}.infrastructure.rate_limit import (
+    DialRateLimiter,
+    SlotAllocator,
+    TokenBucket,
+)
+from {{cookiecutter.app_name}}.infrastructure.scheduler import UnifiedTimedQueue
+from {{cookiecutter.app_name}}.infrastructure.timing_wheel import TimingWheelQueue
+
+
+def test_token_bucket_paces_after_the_burst():
+    bucket = TokenBucket(rate=10, burst=2)
+
+    delays = [bucket.reserve() for _ in range(4)]
+
+    assert delays[:2] == [0.0, 0.0]
+    assert delays[2] == pytest.approx(0.1, abs=0.01)
+    assert delays[3] == pytest.approx(0.2, abs=0.01)
+
+
+def test_limits_are_per_number_and_per_connection():
+    limiter = DialRateLimiter(connection_cps=100, connection_burst=10, number_cps=1)
+
+    assert limiter.reserve("conn", "+1") == 0.0
+    assert limiter.reserve("conn", "+2") == 0.0
+    assert limiter.reserve("conn", "+1") > 0.9
+    assert limiter.stats()["delayed"] == 1
+
+
+async def test_acquire_waits(loop):
+    limiter = DialRateLimiter(number_cps=20)
+
+    start = time.monotonic()
+    for _ in range(3):
+        await limiter.acquire("conn", "+1")
+
+    assert time.monotonic() - start >= 0.09
+
+
+def test_slot_allocator_skips_full_slots():
+    slots = SlotAllocator(cps=2)
+    ts = 1000.5
+
+    due = [slots.allocate(ts) for _ in range(5)]
+
+    assert due == [1000.5, 1000.5, 1001.0, 1001.0, 1002.0]
+    assert slots.next_available(ts) == 1002.0
+
+    # A cancelled booking frees its slot for the next call.
+    slots.release(1000.5)
+    assert slots.allocate(ts) == 1000.5
+    assert slots.booked() == 5
+
+
+@pytest.mark.parametrize("backend", [UnifiedTimedQueue, TimingWheelQueue])
+async def test_scheduler_admission(loop, dialer, backend):
+    scheduler = backend(dialer, loop=loop, admission=SlotAllocator(cps=1))
+    ts = float(int(time.time()) + 60)
+
+    handles = [scheduler.put(n, ts) for n in range(3)]
+    assert [scheduler.get(h).ts for h in handles] == [ts, ts + 1, ts + 2]
+
+    # Cancelling frees the slot, and a rescheduled call takes it.
+    scheduler.cancel(handles[0])
+    scheduler.reschedule(handles[2], ts)
+    assert scheduler.get(handles[2]).ts == ts
+    await scheduler.close()
+
+
+async def test_schedule_response_has_the_admitted_time(test_client):
+    scheduler = test_client.server.app[constants.SCHEDULER]
+    scheduler._admission = SlotAllocator(cps=1)
+
+    body = {"phone_number": "+15551234567", "date": "2099-01-01", "time": "12:00"}
+    first = await (await test_client.post("/", json=body)).json()
+    second = await (await test_client.post("/", json=body)).json()
+
+    assert second["requested_ts"] == first["ts"]
+    assert second["ts"] == first["ts"] + 1
@@ -0,0 +1,143 @@
+"""
+Test recurring calls and their rules
+"""
+
+import asyncio
+import datetime
+import time
+
+import pytest
+
+from {{cookiecutter.app_name}}.infrastructure import constants
+from {{cookiecutter.app_name}}.infrastructure.recurrence import (
+    CronRule,
+    IntervalRule,
+    Recurring,
+    decode_message,
+    encode_message,
+    parse_rule,
+)
+from {{cookiecutter.app_name}}.infrastructure.scheduler import UnifiedTimedQueue
+from {{cookiecutter.app_name}}.infrastructure.timing_wheel import TimingWheelQueue
+from {{cookiecutter.app_name}}.infrastructure.window_store import (
+    SQLiteCallStore,
+    WindowedTimedQueue,
+)
+
+
+def _ts(*args):
+    return datetime.datetime(*args).timestamp()
+
+
+def test_cron_next_after():
+    weekdays = CronRule("0 9 * * 1-5")
+    # Friday the 3rd of January 2025, after nine.
+    assert weekdays.next_after(_ts(2025, 1, 3, 10, 0)) == _ts(2025, 1, 6, 9, 0)
+    assert weekdays.next_after(_ts(2025, 1, 6, 8, 59, 30)) == _ts(2025, 1, 6, 9, 0)
+
+    assert CronRule("*/15 * * * *").next_after(_ts(2025, 1, 1, 0, 0)) == _ts(
+        2025, 1, 1, 0, 15
+    )
+    assert CronRule("@monthly").next_after(_ts(2025, 1, 31, 12, 0)) == _ts(
+        2025, 2, 1, 0, 0
+    )
+    # Either day matches when both are restricted: the 13th, or a Friday.
+    assert CronRule("0 0 13 * 5").next_after(_ts(2025, 1, 1)) == _ts(2025, 1, 3)
+    assert CronRule("0 0 31 2 *").next_after(_ts(2025, 1, 1)) is None
+
+
+def test_bad_rules():
+    for spec in ["every 5s", "0 9 * *", "61 * * * *", "*/0 * * * *", "tomorrow"]:
+        with pytest.raises(ValueError):
+            parse_rule(spec, 0.0)
+
+
+def test_interval_and_encoding():
+    rule = parse_rule("every 1d", 1000.0)
+    assert isinstance(rule, IntervalRule)
+    assert rule.next_after(999.0) == 1000.0
+    assert rule.next_after(1000.0) == 1000.0 + 86400
+
+    msg = Recurring("+15551234567", rule)
+    assert msg.occurrences(1000.0, 3) == [1000.0, 87400.0, 173800.0]
+
+    decoded = decode_message(encode_message(msg))
+    assert decoded.item == "+15551234567"
+    assert decoded.rule.next_after(1000.0) == 87400.0
+    assert decode_message(encode_message("+15551234567")) == "+15551234567"
+
+
+class FastRule:
+    """Every 0.1 seconds, up to a number of occurrences."""
+
+    def __init__(self, count):
+        self.count = count
+
+    def next_after(self, ts):
+        self.count -= 1
+        return ts + 0.1 if self.count > 0 else None
+
+
+def _windowed(dialer, loop, tmp_path):
+    scheduler = WindowedTimedQueue(
+        dialer, SQLiteCallStore(str(tmp_path / "scheduler.db")), loop=loop
+    )
+    scheduler.load()
+    return scheduler
+
+
+@pytest.mark.parametrize(
+    "backend",
+    [
+        lambda dialer, loop, tmp_path: UnifiedTimedQueue(dialer, loop=loop),
+        lambda dialer, loop, tmp_path: TimingWheelQueue(dialer, loop=loop, tick=0.02),
+        _windowed,
+    ],
+)
+async def test_only_the_next_occurrence_is_queued(loop, dialer, tmp_path, backend):
+    scheduler = backend(dialer, loop, tmp_path)
+
+    handle = scheduler.put(Recurring("daily", FastRule(3)), time.time() + 0.05)
+    scheduler.put("once", time.time() + 0.05)
+
+    await asyncio.sleep(0.12)
+    assert len(scheduler) == 1
+    assert scheduler.get(handle).msg.item == "daily"
+
+    await asyncio.sleep(0.3)
+    assert sorted(dialer.dialled) == ["daily"] * 3 + ["once"]
+    assert len(scheduler) == 0
+    await scheduler.close()
+
+
+async def test_cancel_stops_the_series(loop, dialer):
+    scheduler = UnifiedTimedQueue(dialer, loop=loop)
+
+    handle = scheduler.put(Recurring("daily", FastRule(10)), time.time() + 0.05)
+    await asyncio.sleep(0.1)
+    assert scheduler.cancel(handle)
+
+    await asyncio.sleep(0.2)
+    assert dialer.dialled == ["daily"]
+    await scheduler.close()
+
+
+async def test_schedule_endpoint_repeats(test_client):
+    scheduler = test_client.server.app[constants.SCHEDULER]
+
+    body = {
+        "phone_number": "+15551234567",
+        "date": "2099-01-01",
+        "time": "12:00",
+        "repeat": "0 9 * * *",
+    }
+    resp = await test_client.post("/", json=body)
+    assert resp.status == 200
+    result = await resp.json()
+
+    # The first occurrence is the next nine o'clock.
+    assert result["ts"] == _ts(2099, 1, 2, 9, 0)
+    assert scheduler.get(result["handle"]).msg.item == "+15551234567"
+
+    resp = await test_client.post("/", json=dict(body, repeat="every 1s"))
+    assert resp.status == 400
@@ -0,0 +1,145 @@
+"""
+Test the scheduled call queue
+"""
+
+import asyncio
+import datetime
+import time
+
+import pytest
+
+from {{cookiecutter.app_name}}.infrastructure import constants
+from {{cookiecutter.app_name}}.infrastructure.scheduler import UnifiedTimedQueue
+
+
+async def test_dispatch_is_bounded(loop, dialer):
+    dialer.delay = 0.05
+    scheduler = UnifiedTimedQueue(dialer, loop=loop, concurrency=5)
+
+    ts = time.time() + 0.01
+    for n in range(20):
+        scheduler.put(n, ts)
+
+    await asyncio.sleep(0.5)
+
+    assert sorted(dialer.dialled) == list(range(20))
+    assert dialer.max_in_flight == 5
+    assert scheduler.stats.count == 20
+    assert scheduler.stats.max_lateness >= 0.05
+    await scheduler.close()
+
+
+async def test_dispatch_in_time_order(loop, dialer):
+    scheduler = UnifiedTimedQueue(dialer, loop=loop)
+
+    now = time.time()
+    scheduler.put("second", now + 0.1)
+    scheduler.put("first", now + 0.05)
+
+    await asyncio.sleep(0.3)
+
+    assert dialer.dialled == ["first", "second"]
+    assert len(scheduler) == 0
+    await scheduler.close()
+
+
+async def test_cancel_and_reschedule(loop, dialer):
+    scheduler = UnifiedTimedQueue(dialer, loop=loop)
+
+    now = time.time()
+    cancelled = scheduler.put("cancelled", now + 0.05)
+    moved = scheduler.put("moved", now + 0.05)
+    scheduler.put("kept", now + 0.1)
+
+    assert scheduler.cancel(cancelled)
+    assert not scheduler.cancel(cancelled)
+    assert scheduler.reschedule(moved, now + 0.15)
+    assert len(scheduler) == 2
+
+    await asyncio.sleep(0.3)
+
+    assert dialer.dialled == ["kept", "moved"]
+    assert not scheduler.reschedule(moved, now + 1)
+    await scheduler.close()
+
+
+async def test_tombstones_are_compacted(loop, dialer):
+    scheduler = UnifiedTimedQueue(dialer, loop=loop)
+
+    future = time.time() + 60
+    handles = [scheduler.put(n, future + n) for n in range(3000)]
+    for handle in handles[1:2500]:
+        scheduler.cancel(handle)
+
+    assert len(scheduler) == 501
+    assert len(scheduler._queue) < 3000
+    assert sorted(qm.msg for qm in scheduler.items()) == [0] + list(range(2500, 3000))
+    await scheduler.close()
+
+
+async def test_put_many(loop, dialer):
+    scheduler = UnifiedTimedQueue(dialer, loop=loop)
+
+    now = time.time()
+    scheduler.put("third", now + 0.15)
+    # A small batch is pushed onto the heap, a large one is heapified with it.
+    handles = scheduler.put_many([("second", now + 0.1), ("first", now + 0.05)])
+    scheduler.put_many([("later", now + 60 + n) for n in range(100)])
+
+    assert len(scheduler) == 103
+    assert scheduler.get(handles[0]).msg == "second"
+    assert scheduler.get(handles[1]).msg == "first"
+
+    await asyncio.sleep(0.3)
+
+    assert dialer.dialled == ["first", "second", "third"]
+    assert [qm.msg for qm in scheduler.items()][:2] == ["later"] * 2
+    await scheduler.close()
+
+
+@pytest.mark.parametrize("bad_ts", [float("nan"), float("inf"), float("-inf")])
+async def test_non_finite_times_are_refused(loop, dialer, bad_ts):
+    scheduler = UnifiedTimedQueue(dialer, loop=loop)
+
+    now = time.time()
+    handle = scheduler.put("valid", now + 0.05)
+    with pytest.raises(ValueError):
+        scheduler.put("bad", bad_ts)
+    with pytest.raises(ValueError):
+        scheduler.put_many([("also valid", now + 0.05), ("bad", bad_ts)])
+    with pytest.raises(ValueError):
+        scheduler.reschedule(handle, bad_ts)
+    assert len(scheduler) == 1
+
+    await asyncio.sleep(0.2)
+
+    assert dialer.dialled == ["valid"]
+    await scheduler.close()
+
+
+async def test_cancel_endpoint(test_client):
+    scheduler = test_client.server.app[constants.SCHEDULER]
+    handle = scheduler.put("+15551234567", time.time() + 60)
+
+    resp = await test_client.delete(f"/calls/{handle}")
+    assert resp.status == 200
+    assert len(scheduler) == 0
+
+    resp = await test_client.delete(f"/calls/{handle}")
+    assert resp.status == 404
+
+
+async def test_reschedule_endpoint(test_client):
+    scheduler = test_client.server.app[constants.SCHEDULER]
+    handle = scheduler.put("+15551234567", time.time() + 60)
+
+    when = datetime.datetime.now() + datetime.timedelta(days=1)
+    resp = await test_client.post(
+        f"/calls/{handle}/reschedule",
+        json={"date": when.strftime("%Y-%m-%d"), "time": when.strftime("%H:%M")},
+    )
+    assert resp.status == 200
+    body = await resp.json()
+
+    assert body["handle"] == handle
+    assert scheduler.get(handle).ts == body["ts"]
@@ -0,0 +1,213 @@
+"""
+Test splitting the call schedule across nodes, each served on loopback
+"""
+
+import collections
+
+import aiohttp
+from aiohttp import web
+import pytest
+
+from {{cookiecutter.app_name}}.infrastructure import constants
+from {{cookiecutter.app_name}}.infrastructure import server
+from {{cookiecutter.app_name}}.infrastructure.numbers import NumberNormaliser
+from {{cookiecutter.app_name}}.infrastructure.recurrence import (
+    Recurring,
+    decode_message,
+    encode_message,
+    parse_rule,
+)
+from {{cookiecutter.app_name}}.infrastructure.scheduler import UnifiedTimedQueue
+from {{cookiecutter.app_name}}.infrastructure.sharding import HashRing, ShardedScheduler
+
+SECRET = "cluster"
+
+NUMBERS = [f"+1555{n:07d}" for n in range(40)]
+
+
+def test_adding_a_node_only_moves_keys_to_it():
+    keys = [f"+1555{n:07d}" for n in range(5000)]
+    before = HashRing([1, 2, 3])
+    after = HashRing([1, 2, 3, 4])
+
+    moved = [key for key in keys if before.node_for(key) != after.node_for(key)]
+
+    assert all(after.node_for(key) == 4 for key in moved)
+    assert 0.15 < len(moved) / len(keys) < 0.35
+
+
+@pytest.fixture
+async def cluster(loop, dialer, aiohttp_server):
+    """Start nodes on loopback, returning a function that adds one more."""
+    session = aiohttp.ClientSession()
+    nodes = {}
+
+    async def start_node(node_id):
+        shards = ShardedScheduler(
+            UnifiedTimedQueue(dialer, loop=loop),
+            node_id,
+            {node_id: ""},
+            session,
+            encode=encode_message,
+            decode=decode_message,
+            secret=SECRET,
+        )
+
+        async def startup_handler(app):
+            app[constants.SCHEDULER] = shards
+            app[constants.NUMBERS] = NumberNormaliser(loop=loop)
+
+        app = web.Application()
+        server.configure_app(app, startup_handler)
+        node = await aiohttp_server(app)
+        node.shards = shards
+        nodes[node_id] = node
+        return node
+
+    yield start_node
+
+    for node in nodes.values():
+        await node.shards.local.close()
+    await session.close()
+
+
+def _urls(nodes):
+    return {node.shards.node_id: str(node.make_url("")) for node in nodes}
+
+
+def _assert_placed(nodes):
+    """Every call is on the node its number hashes to."""
+    for node in nodes:
+        for qm in node.shards.local.items():
+            assert node.shards.node_for(qm.msg) == node.shards.node_id
+
+
+async def test_calls_are_placed_and_moved(cluster):
+    nodes = [await cluster(node_id) for node_id in (1, 2, 3)]
+    for node in nodes:
+        await node.shards.set_nodes(_urls(nodes))
+
+    entry, other = nodes[0].shards, nodes[1].shards
+    handles = {}
+    for number in NUMBERS:
+        handles[number] = await entry.put(number, 4070952000.0)
+
+    _assert_placed(nodes)
+    assert sum(len(node.shards.local) for node in nodes) == len(NUMBERS)
+    assert all(len(node.shards.local) for node in nodes)
+
+    # Any node can find a call by its handle.
+    found = await other.get(handles[NUMBERS[0]])
+    assert found.msg == NUMBERS[0]
+
+    # A fourth node joins, and is told about the cluster by the first.
+    nodes.append(await cluster(4))
+    async with aiohttp.ClientSession() as session:
+        resp = await session.post(
+            nodes[0].make_url("/shard/nodes"),
+            json={"nodes": _urls(nodes)},
+            headers={"X-Shard-Secret": SECRET},
+        )
+        assert resp.status == 200
+        moved = (await resp.json())["moved"]
+
+    assert sum(moved.values()) == len(nodes[3].shards.local) > 0
+    _assert_placed(nodes)
+
+    # The old handles of the moved calls still work.
+    for number, handle in handles.items():
+        assert (await other.get(handle)).msg == number
+    assert await other.cancel(handles[NUMBERS[1]])
+    assert sum(len(node.shards.local) for node in nodes) == len(NUMBERS) - 1
+
+    # The second node leaves, handing its calls to the others.
+    await nodes[0].shards.set_nodes(_urls(nodes[:1] + nodes[2:]), propagate=True)
+    assert len(nodes[1].shards.local) == 0
+    _assert_placed(nodes[:1] + nodes[2:])
+    assert sum(len(node.shards.local) for node in nodes) == len(NUMBERS) - 1
+
+
+async def test_schedule_call_is_routed(cluster):
+    nodes = [await cluster(node_id) for node_id in (1, 2)]
+    for node in nodes:
+        await node.shards.set_nodes(_urls(nodes))
+
+    async with aiohttp.ClientSession() as session:
+        for number in NUMBERS[:10]:
+            body = {"phone_number": number, "date": "2099-01-01", "time": "12:00"}
+            resp = await session.post(nodes[0].make_url("/"), json=body)
+            handle = (await resp.json())["handle"]
+
+            resp = await session.delete(nodes[1].make_url(f"/calls/{handle}"))
+            assert resp.status == 200
+
+    assert all(len(node.shards.local) == 0 for node in nodes)
+    assert nodes[0].shards.forwarded > 0
+
+
+async def test_recurring_calls_are_placed_by_number(cluster):
+    nodes = [await cluster(node_id) for node_id in (1, 2, 3)]
+    for node in nodes:
+        await node.shards.set_nodes(_urls(nodes))
+
+    entry = nodes[0].shards
+    for number in NUMBERS[:10]:
+        await entry.put(number, 4070952000.0)
+        recurring = Recurring(number, parse_rule("every 1d", 4070952000.0))
+        await entry.put(recurring, 4070952000.0)
+        assert entry.node_for(recurring) == entry.node_for(number)
+
+    # Both calls to each number are on the same node.
+    _assert_placed(nodes)
+    for node in nodes:
+        numbers = collections.Counter(str(qm.msg) for qm in node.shards.local.items())
+        assert all(count == 2 for count in numbers.values())
+
+
+async def test_unreachable_nodes_are_reported(cluster):
+    nodes = [await cluster(node_id) for node_id in (1, 2)]
+    for node in nodes:
+        await node.shards.set_nodes(_urls(nodes))
+    for number in NUMBERS[:10]:
+        await nodes[0].shards.put(number, 4070952000.0)
+
+    # Nothing listens on port 1, so the third node can not be told.
+    urls = _urls(nodes)
+    urls[3] = "http://127.0.0.1:1"
+    async with aiohttp.ClientSession() as session:
+        resp = await session.post(
+            nodes[0].make_url("/shard/nodes"),
+            json={"nodes": urls},
+            headers={"X-Shard-Secret": SECRET},
+        )
+        assert resp.status == 200
+        body = await resp.json()
+
+    assert set(body["moved"]) == {"1", "2"}
+    assert list(body["failed"]) == ["3"]
+    # The reachable nodes switched, and kept the calls they could not move.
+    assert nodes[1].shards.nodes == nodes[0].shards.nodes == urls
+    assert len(nodes[0].shards.local) + len(nodes[1].shards.local) == 10
+
+
+def test_sharding_needs_a_secret(loop, dialer):
+    with pytest.raises(ValueError):
+        ShardedScheduler(
+            UnifiedTimedQueue(dialer, loop=loop),
+            1,
+            {1: ""},
+            None,
+            encode=encode_message,
+            decode=decode_message,
+        )
+
+
+async def test_requests_between_nodes_need_the_secret(cluster):
+    node = await cluster(1)
+
+    async with aiohttp.ClientSession() as session:
+        resp = await session.post(
+            node.make_url("/shard/op"), json={"op": "items", "args": []}
+        )
+
+    assert resp.status == 403
@@ -0,0 +1,109 @@
+"""
+Test pushing the metrics to Telegraf
+"""
+
+import asyncio
+
+import aiotelegraf
+import pytest
+
+from {{cookiecutter.app_name}}.infrastructure.metrics import Registry
+from {{cookiecutter.app_name}}.infrastructure.telegraf import (
+    TelegrafExporter,
+    bucket_percentile,
+)
+
+
+class Listener(asyncio.DatagramProtocol):
+    """Collects the UDP packets sent to it."""
+
+    def __init__(self):
+        self.packets = asyncio.Queue()
+
+    def datagram_received(self, data, addr):
+        self.packets.put_nowait(data.decode())
+
+
+@pytest.fixture
+async def listener(loop):
+    transport, protocol = await loop.create_datagram_endpoint(
+        Listener, local_addr=("127.0.0.1", 0)
+    )
+    protocol.port = transport.get_extra_info("sockname")[1]
+    yield protocol
+    transport.close()
+
+
+async def received(listener, packets):
+    return [await asyncio.wait_for(listener.packets.get(), 1) for _ in range(packets)]
+
+
+def test_bucket_percentile():
+    buckets = [(0.1, 50), (1.0, 50), (float("inf"), 0)]
+    assert bucket_percentile(buckets, 50) == 0.1
+    assert bucket_percentile(buckets, 75) == pytest.approx(0.55)
+    assert bucket_percentile([(0.1, 0), (float("inf"), 4)], 99) == 0.1
+
+
+async def test_metrics_are_sent_in_batches(loop, listener):
+    registry = Registry()
+    dials = registry.counter("dials", "Dials.", ("result",))
+    pending = registry.gauge("pending", "Pending.")
+    latency = registry.histogram("latency", "Latency.", buckets=(0.1, 1.0))
+
+    client = aiotelegraf.Client(host="127.0.0.1", port=listener.port, tags={"env": "t"})
+    await client.connect()
+    exporter = TelegrafExporter(client, registry, loop=loop)
+
+    for _ in range(3):
+        dials.labels("ok").inc()
+    pending.set(7)
+    for value in (0.05, 0.05, 0.5, 0.5):
+        latency.observe(value)
+
+    assert await exporter.flush() == 1
+    lines = (await received(listener, 1))[0].splitlines()
+    assert lines[0] == "dials,env=t,result=ok value=3.0"
+    assert lines[1] == "pending,env=t value=7.0"
+    measurement, fields = lines[2].split(" ")
+    assert measurement == "latency,env=t"
+    fields = dict(field.split("=") for field in fields.split(","))
+    assert fields.pop("count") == "4i"
+    assert {name: float(value) for name, value in fields.items()} == pytest.approx(
+        {"sum": 1.1, "mean": 0.275, "p50": 0.1, "p90": 0.82, "p99": 0.982}
+    )
+
+    # Only what changed since the last flush is sent, split to fit the packets.
+    exporter._max_packet = 40
+    dials.labels("ok").inc()
+    dials.labels("failed").inc()
+    assert await exporter.flush() == 3
+    packets = await received(listener, 3)
+    assert packets == [
+        "dials,env=t,result=failed value=1.0\n",
+        "dials,env=t,result=ok value=1.0\n",
+        "pending,env=t value=7.0\n",
+    ]
+    assert exporter.stats() == {"flushes": 2, "packets": 4, "lines": 6}
+    await exporter.close()
+
+
+async def test_exporter_flushes_in_the_background(loop, listener):
+    registry = Registry()
+    registry.gauge("pending", "Pending.").set(1)
+    collected = []
+
+    async def collect():
+        collected.append(True)
+
+    client = aiotelegraf.Client(host="127.0.0.1", port=listener.port)
+    await client.connect()
+    exporter = TelegrafExporter(
+        client, registry, interval=0.01, collect=collect, loop=loop
+    )
+    exporter.start()
+
+    assert await received(listener, 2) == ["pending value=1.0\n"] * 2
+    await exporter.close()
+    assert exporter.flushes >= 3
+    assert len(collected) == exporter.flushes
@@ -0,0 +1,80 @@
+"""
+Test the asyncio Telnyx client against a local fake Telnyx server
+"""
+
+import aiohttp
+from aiohttp import web
+import pytest
+
+from {{cookiecutter.app_name}}.infrastructure.call_control import CallControl
+from {{cookiecutter.app_name}}.infrastructure.telnyx_client import (
+    AsyncTelnyx,
+    TelnyxAPIError,
+)
+
+
+@pytest.fixture
+async def fake_telnyx(aiohttp_server):
+    """Serve the Call Control endpoints and record every request."""
+    requests = []
+
+    async def create_call(request):
+        requests.append(("create", await request.json(), request.headers))
+        return web.json_response({"data": {"call_control_id": "call-1"}})
+
+    async def call_action(request):
+        call_id = request.match_info["call_id"]
+        action = request.match_info["action"]
+        if call_id == "missing":
+            return web.json_response({"errors": [{"code": "404"}]}, status=404)
+        requests.append((action, await request.json(), call_id))
+        return web.json_response({"data": {"result": "ok"}})
+
+    app = web.Application()
+    app.router.add_post("/v2/calls", create_call)
+    app.router.add_post("/v2/calls/{call_id}/actions/{action}", call_action)
+
+    server = await aiohttp_server(app)
+    server.requests = requests
+    return server
+
+
+@pytest.fixture
+async def client_session():
+    session = aiohttp.ClientSession()
+    yield session
+    await session.close()
+
+
+def _client(client_session, fake_telnyx):
+    return AsyncTelnyx(client_session, "KEY", base_url=str(fake_telnyx.make_url("/v2")))
+
+
+async def test_create_call(fake_telnyx, client_session):
+    telnyx_app = _client(client_session, fake_telnyx)
+
+    call = await telnyx_app.Call.create(connection_id="conn", to="+1", from_="+2")
+
+    assert call.call_control_id == "call-1"
+    action, body, headers = fake_telnyx.requests[0]
+    assert action == "create"
+    assert body == {"connection_id": "conn", "to": "+1", "from": "+2"}
+    assert headers["Authorization"] == "Bearer KEY"
+
+
+async def test_api_error(fake_telnyx, client_session):
+    telnyx_app = _client(client_session, fake_telnyx)
+
+    with pytest.raises(TelnyxAPIError) as exc_info:
+        await telnyx_app.Call("missing").hangup()
+
+    assert exc_info.value.status == 404
+
+
+async def test_call_control_hangup(fake_telnyx, client_session):
+    telnyx_app = _client(client_session, fake_telnyx)
+    call_control_app = CallControl(client_session, telnyx_app, "conn", "", "+2")
+
+    await call_control_app.process_webhook("call-1", "call.speak.ended")
+
+    assert fake_telnyx.requests == [("hangup", {}, "call-1")]
@@ -0,0 +1,88 @@
+"""
+Test the timing wheel scheduler backend
+"""
+
+import asyncio
+import random
+import time
+
+import pytest
+
+from {{cookiecutter.app_name}}.infrastructure.timing_wheel import (
+    HierarchicalTimingWheel,
+    TimingWheelQueue,
+)
+
+
+def test_entries_expire_on_their_tick():
+    wheel = HierarchicalTimingWheel(levels=3, bits=2, start_tick=5)
+    rng = random.Random(42)
+
+    # Spread the ticks past the 64 tick reach of the wheels.
+    ticks = [rng.randint(5, 200) for _ in range(500)]
+    for n, tick in enumerate(ticks):
+        wheel.insert(tick, (tick, n))
+
+    for now in range(5, 220, 7):
+        expired = wheel.advance(now)
+        assert all(tick <= now for tick, _ in expired)
+        assert all(tick > now for tick, _ in wheel.entries())
+
+    assert len(wheel) == 0
+
+
+def test_idle_wheel_skips_ahead():
+    wheel = HierarchicalTimingWheel(start_tick=0)
+
+    assert wheel.advance(10 ** 9) == []
+    assert wheel.base == 10 ** 9 + 1
+
+
+async def test_dispatch_after_timestamp(loop, dialer):
+    scheduler = TimingWheelQueue(dialer, loop=loop, concurrency=2, tick=0.01)
+
+    now = time.time()
+    scheduler.put("second", now + 0.1)
+    scheduler.put("first", now + 0.05)
+    assert len(scheduler) == 2
+
+    await asyncio.sleep(0.3)
+
+    assert dialer.dialled == ["first", "second"]
+    assert len(scheduler) == 0
+    assert 0 <= scheduler.stats.max_lateness < 0.1
+    await scheduler.close()
+
+
+async def test_cancel_and_reschedule(loop, dialer):
+    scheduler = TimingWheelQueue(dialer, loop=loop, tick=0.01)
+
+    now = time.time()
+    cancelled = scheduler.put("cancelled", now + 0.05)
+    moved = scheduler.put("moved", now + 0.05)
+    scheduler.put("kept", now + 0.1)
+
+    assert scheduler.cancel(cancelled)
+    assert scheduler.reschedule(moved, now + 0.15)
+    assert len(scheduler) == 2
+
+    await asyncio.sleep(0.3)
+
+    assert dialer.dialled == ["kept", "moved"]
+    await scheduler.close()
+
+
+@pytest.mark.parametrize("bad_ts", [float("nan"), float("inf")])
+async def test_non_finite_times_are_refused(loop, dialer, bad_ts):
+    scheduler = TimingWheelQueue(dialer, loop=loop, tick=0.01)
+
+    handle = scheduler.put("valid", time.time() + 60)
+    with pytest.raises(ValueError):
+        scheduler.put("bad", bad_ts)
+    with pytest.raises(ValueError):
+        scheduler.put_many([("also valid", time.time() + 60), ("bad", bad_ts)])
+    with pytest.raises(ValueError):
+        scheduler.reschedule(handle, bad_ts)
+
+    assert [qm.msg for qm in scheduler.items()] == ["valid"]
+    await scheduler.close()
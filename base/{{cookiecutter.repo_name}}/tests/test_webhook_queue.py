@@ -0,0 +1,86 @@
+"""
+Test the background webhook processing
+"""
+
+import asyncio
+
+import pytest
+
+from {{cookiecutter.app_name}}.infrastructure import constants
+from {{cookiecutter.app_name}}.infrastructure.webhook_queue import WebhookDispatcher
+
+
+def _webhook(call_control_id, event_type):
+    return {
+        "data": {
+            "event_type": event_type,
+            "payload": {"call_control_id": call_control_id},
+        }
+    }
+
+
+async def test_events_for_a_call_keep_their_order(loop, dialer):
+    dispatcher = WebhookDispatcher(dialer, workers=4, loop=loop)
+
+    events = [
+        (f"call-{n % 5}", event_type)
+        for n in range(50)
+        for event_type in ("call.answered", "call.speak.ended")
+    ]
+    for call_control_id, event_type in events:
+        dispatcher.submit(call_control_id, event_type)
+    await dispatcher.join()
+
+    for n in range(5):
+        call_control_id = f"call-{n}"
+        assert [e for e in dialer.webhooks if e[0] == call_control_id] == [
+            e for e in events if e[0] == call_control_id
+        ]
+    assert dispatcher.stats.as_dict()["processed"] == len(events)
+    await dispatcher.close()
+
+
+async def test_submit_fails_when_full(loop, dialer):
+    dialer.delay = 1
+    dispatcher = WebhookDispatcher(dialer, workers=1, max_pending=2, loop=loop)
+
+    dispatcher.submit("call-1", "call.answered")
+    await asyncio.sleep(0)
+    dispatcher.submit("call-1", "call.answered")
+    dispatcher.submit("call-1", "call.answered")
+
+    with pytest.raises(asyncio.QueueFull):
+        dispatcher.submit("call-1", "call.answered")
+
+    assert dispatcher.stats.rejected == 1
+    assert len(dispatcher) == 2
+    await dispatcher.close()
+
+
+async def test_webhook_is_acknowledged_before_processing(test_client, dialer):
+    dialer.delay = 0.5
+
+    resp = await test_client.post("/webhook", json=_webhook("call-1", "call.answered"))
+
+    assert resp.status == 200
+    assert dialer.webhooks == []
+
+    await test_client.app[constants.WEBHOOK_DISPATCHER].join()
+    assert dialer.webhooks == [("call-1", "call.answered")]
+
+
+async def test_webhook_busy(test_client, dialer):
+    dialer.delay = 1
+    dispatcher = test_client.app[constants.WEBHOOK_DISPATCHER]
+
+    # Keep the worker busy, then fill up the queue the call is sharded to.
+    dispatcher.submit("call-1", "call.answered")
+    await asyncio.sleep(0)
+    with pytest.raises(asyncio.QueueFull):
+        while True:
+            dispatcher.submit("call-1", "call.answered")
+
+    resp = await test_client.post("/webhook", json=_webhook("call-1", "call.answered"))
+
+    assert resp.status == 503
+    assert resp.headers["Retry-After"] == "1"
@@ -0,0 +1,129 @@
+"""
+Test the windowed scheduler and its SQLite store
+"""
+
+import asyncio
+import time
+
+import pytest
+
+from {{cookiecutter.app_name}}.infrastructure.window_store import (
+    SQLiteCallStore,
+    WindowedTimedQueue,
+)
+
+
+def _windowed(loop, dialer, tmp_path, **kwargs):
+    store = SQLiteCallStore(str(tmp_path / "scheduler.db"))
+    scheduler = WindowedTimedQueue(dialer, store, loop=loop, **kwargs)
+    scheduler.load()
+    return scheduler, store
+
+
+async def test_far_calls_stay_on_disk(loop, dialer, tmp_path):
+    scheduler, store = _windowed(loop, dialer, tmp_path, window=60)
+
+    near = scheduler.put("near", time.time() + 30)
+    far = scheduler.put("far", time.time() + 3600)
+
+    assert len(scheduler) == 2
+    assert list(scheduler._entries) == [near]
+    assert store.count() == 2
+    assert scheduler.get(far).msg == "far"
+    assert [qm.msg for qm in scheduler.items()] == ["near", "far"]
+    await scheduler.close()
+
+
+async def test_put_many_across_window(loop, dialer, tmp_path):
+    scheduler, store = _windowed(loop, dialer, tmp_path, window=60)
+
+    now = time.time()
+    handles = scheduler.put_many(
+        [("far", now + 3600), ("near", now + 30), ("farther", now + 7200)]
+    )
+
+    assert len(scheduler) == 3
+    assert list(scheduler._entries) == [handles[1]]
+    assert store.count() == 3
+    assert [scheduler.get(handle).msg for handle in handles] == [
+        "far",
+        "near",
+        "farther",
+    ]
+    await scheduler.close()
+
+
+async def test_slide_loads_calls_in_batches(loop, dialer, tmp_path):
+    scheduler, _ = _windowed(loop, dialer, tmp_path, window=60, batch_size=3)
+
+    # Calls sharing a timestamp must not stall the batches.
+    future = time.time() + 120
+    handles = [scheduler.put(n, future) for n in range(10)]
+    assert not scheduler._entries
+
+    await scheduler._slide(future + 1)
+
+    assert sorted(scheduler._entries) == handles
+    assert len(scheduler) == 10
+    await scheduler.close()
+
+
+async def test_due_calls_are_dialled_and_forgotten(loop, dialer, tmp_path):
+    scheduler, store = _windowed(loop, dialer, tmp_path, window=60)
+
+    scheduler.put("due", time.time())
+    await asyncio.sleep(0.05)
+
+    assert dialer.dialled == ["due"]
+    assert store.count() == 0
+    await scheduler.close()
+
+
+async def test_cancel_and_reschedule_across_window(loop, dialer, tmp_path):
+    scheduler, store = _windowed(loop, dialer, tmp_path, window=60)
+
+    near = scheduler.put("near", time.time() + 30)
+    far = scheduler.put("far", time.time() + 3600)
+    dropped = scheduler.put("dropped", time.time() + 3600)
+
+    assert scheduler.reschedule(near, time.time() + 7200)
+    assert scheduler.reschedule(far, time.time() + 10)
+    assert scheduler.cancel(dropped)
+    assert not scheduler.cancel(dropped)
+
+    assert list(scheduler._entries) == [far]
+    assert len(scheduler) == 2
+    assert store.get(near)[0] > time.time() + 3600
+    assert store.get(dropped) is None
+    await scheduler.close()
+
+
+async def test_load_after_restart(loop, dialer, tmp_path):
+    scheduler, _ = _windowed(loop, dialer, tmp_path, window=60)
+    near = scheduler.put("near", time.time() + 30)
+    far = scheduler.put("far", time.time() + 3600)
+    await scheduler.close()
+
+    scheduler, _ = _windowed(loop, dialer, tmp_path, window=60)
+
+    assert list(scheduler._entries) == [near]
+    assert len(scheduler) == 2
+    assert scheduler.put("new", time.time() + 30) > far
+    await scheduler.close()
+
+
+@pytest.mark.parametrize("bad_ts", [float("nan"), float("inf")])
+async def test_non_finite_times_are_refused(loop, dialer, tmp_path, bad_ts):
+    scheduler, store = _windowed(loop, dialer, tmp_path, window=60)
+
+    far = scheduler.put("far", time.time() + 3600)
+    with pytest.raises(ValueError):
+        scheduler.put("bad", bad_ts)
+    with pytest.raises(ValueError):
+        scheduler.put_many([("near", time.time() + 30), ("bad", bad_ts)])
+    with pytest.raises(ValueError):
+        scheduler.reschedule(far, bad_ts)
+
+    assert len(scheduler) == 1
+    assert store.count() == 1
+    await scheduler.close()
@@ -0,0 +1,129 @@
+"""
+Test sharing the call scheduler between workers
+"""
+
+import time
+
+from {{cookiecutter.app_name}}.infrastructure import constants
+from {{cookiecutter.app_name}}.infrastructure.scheduler import UnifiedTimedQueue
+from {{cookiecutter.app_name}}.infrastructure.usecases import resolve
+from {{cookiecutter.app_name}}.infrastructure.workers import (
+    OwnerLock,
+    RemoteScheduler,
+    SchedulerProxy,
+    SchedulerServer,
+)
+
+
+def test_owner_lock_is_exclusive(tmp_path):
+    path = str(tmp_path / "scheduler.lock")
+    first, second = OwnerLock(path), OwnerLock(path)
+
+    assert first.acquire()
+    assert not second.acquire()
+
+    first.release()
+    assert second.acquire()
+    second.release()
+
+
+async def test_remote_scheduler(loop, dialer, tmp_path):
+    path = str(tmp_path / "scheduler.sock")
+    scheduler = UnifiedTimedQueue(dialer, loop=loop)
+    server = SchedulerServer(scheduler, path, encode=str, decode=str)
+    await server.start()
+    remote = RemoteScheduler(path, encode=str, decode=str)
+    ts = time.time() + 60
+
+    handle = await remote.put("+15551234567", ts)
+    assert scheduler.get(handle).msg == "+15551234567"
+
+    assert await remote.reschedule(handle, ts + 60)
+    entry = await remote.get(handle)
+    assert (entry.ts, entry.msg, entry.handle) == (ts + 60, "+15551234567", handle)
+    assert [entry.handle for entry in await remote.items()] == [handle]
+    assert (await remote.stats())["pending"] == 1
+
+    assert await remote.cancel(handle)
+    assert not await remote.cancel(handle)
+    assert await remote.get(handle) is None
+
+    remote.close()
+    await server.close()
+    await scheduler.close()
+
+
+async def test_scheduler_fails_over(loop, dialer, tmp_path):
+    # Stands in for the journal, which the next owner recovers the schedule from.
+    saved = {}
+
+    async def take_over():
+        scheduler = UnifiedTimedQueue(dialer, loop=loop)
+        scheduler.restore(
+            [(ts, msg, handle) for handle, (ts, msg) in saved.items()],
+            max(saved, default=0) + 1,
+        )
+
+        async def close():
+            saved.update({qm.handle: (qm.ts, qm.msg) for qm in scheduler.items()})
+            await scheduler.close()
+
+        return scheduler, close
+
+    def proxy():
+        return SchedulerProxy(
+            str(tmp_path / "scheduler.lock"),
+            str(tmp_path / "scheduler.sock"),
+            take_over,
+            encode=str,
+            decode=str,
+            election_interval=0.01,
+            timeout=2,
+            loop=loop,
+        )
+
+    first, second = proxy(), proxy()
+    await first.start()
+    await second.start()
+    assert first.owner and not second.owner
+
+    ts = time.time() + 60
+    handle = await resolve(second.put("+1", ts))
+    assert first.local.get(handle).msg == "+1"
+
+    # The owner goes away, and the other worker takes over its schedule.
+    await first.close()
+    second_handle = await resolve(second.put("+2", ts))
+    assert second.owner
+    assert sorted(qm.handle for qm in second.items()) == [handle, second_handle]
+
+    await second.close()
+
+
+async def test_schedule_is_unavailable_without_an_owner(test_client, tmp_path, loop):
+    async def take_over():
+        raise AssertionError("The owner is elsewhere")
+
+    lock_path = str(tmp_path / "scheduler.lock")
+    owner = OwnerLock(lock_path)
+    owner.acquire()
+    proxy = SchedulerProxy(
+        lock_path,
+        str(tmp_path / "scheduler.sock"),
+        take_over,
+        encode=str,
+        decode=str,
+        election_interval=60,
+        timeout=0.1,
+        loop=loop,
+    )
+    await proxy.start()
+    test_client.server.app[constants.SCHEDULER] = proxy
+
+    body = {"phone_number": "+15551234567", "date": "2099-01-01", "time": "12:00"}
+    resp = await test_client.post("/", json=body)
+
+    assert resp.status == 503
+    assert resp.headers["Retry-After"] == "1"
+    await proxy.close()
+    owner.release()
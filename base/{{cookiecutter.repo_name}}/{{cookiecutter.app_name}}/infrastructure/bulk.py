@@ -0,0 +1,210 @@
+"""
+Reading calls to schedule in bulk from CSV or NDJSON.
+
+The request body is read in chunks and parsed a batch of rows at a time, so a
+large upload is never held in memory as a whole, and a line longer than
+MAX_LINE bytes is reported as an error rather than buffered. Each row has a
+``phone_number``, and either a ``date`` and ``time`` like the form, or an
+epoch ``ts``. Rows are reported by their line number in the body.
+"""
+
+import csv
+import datetime
+import json
+import math
+from typing import AsyncIterator, List, Mapping, Optional, Tuple, Union
+
+from aiohttp import StreamReader
+
+from {{cookiecutter.app_name}}.infrastructure.numbers import NumberNormaliser
+
+CSV = "csv"
+NDJSON = "ndjson"
+
+CONTENT_TYPES = {
+    "text/csv": CSV,
+    "application/x-ndjson": NDJSON,
+    "application/ndjson": NDJSON,
+    "application/jsonl": NDJSON,
+}
+
+# A line number, and the fields of the row or why it could not be read.
+Row = Tuple[int, Union[Mapping, str]]
+
+NOT_UTF8 = "The row is not valid UTF-8."
+
+BAD_ROW = "Bad row. Please ensure the row is valid."
+
+# The longest line read, in bytes.
+MAX_LINE = 64 * 1024
+
+LINE_TOO_LONG = "The row is too long."
+
+
+async def read_lines(
+    stream: StreamReader, chunk_size: int = 64 * 1024, max_line: int = MAX_LINE
+) -> AsyncIterator[List[Optional[bytes]]]:
+    """Yield the complete lines of each chunk read from the stream.
+
+    A line longer than max_line bytes is yielded as None, and the rest of it is
+    skipped as it arrives.
+    """
+    tail = b""
+    too_long = False
+    async for chunk in stream.iter_chunked(chunk_size):
+        lines: List[Optional[bytes]] = []
+        if too_long:
+            end = chunk.find(b"\n")
+            if end < 0:
+                continue
+            lines.append(None)
+            chunk = chunk[end + 1 :]
+            too_long = False
+
+        parts = (tail + chunk).split(b"\n")
+        tail = parts.pop()
+        lines.extend(None if len(part) > max_line else part for part in parts)
+        if len(tail) > max_line:
+            too_long, tail = True, b""
+
+        if lines:
+            yield lines
+    if too_long:
+        yield [None]
+    elif tail:
+        yield [tail]
+
+
+def _csv_rows(
+    header: List[str], numbered: List[Tuple[int, Optional[str]]]
+) -> List[Row]:
+    rows: List[Row] = []
+    for line, text in numbered:
+        if text is None:
+            rows.append((line, NOT_UTF8))
+            continue
+        # Each line on its own, so a stray quote can not pull in the next ones
+        fields = next(csv.reader([text]))
+        if len(fields) != len(header):
+            rows.append((line, f"Expected {len(header)} columns."))
+        else:
+            rows.append((line, dict(zip(header, fields))))
+    return rows
+
+
+def _ndjson_rows(numbered: List[Tuple[int, Optional[str]]]) -> List[Row]:
+    rows: List[Row] = []
+    for line, text in numbered:
+        if text is None:
+            rows.append((line, NOT_UTF8))
+            continue
+        try:
+            fields = json.loads(text)
+        except ValueError:
+            rows.append((line, "Invalid JSON."))
+            continue
+        if not isinstance(fields, dict):
+            fields = "Expected an object."
+        rows.append((line, fields))
+    return rows
+
+
+async def read_rows(
+    stream: StreamReader, fmt: str, batch_size: int = 1000, max_line: int = MAX_LINE
+) -> AsyncIterator[List[Row]]:
+    """Yield the rows of a CSV or NDJSON body in batches of up to batch_size.
+
+    A CSV body starts with a header line naming the columns. Rows can not
+    span lines, and blank lines are skipped.
+    """
+    header = None
+    line_number = 0
+    numbered: List[Tuple[int, Optional[str]]] = []
+    too_long: List[Row] = []
+
+    def parse():
+        if fmt == CSV:
+            rows = _csv_rows(header, numbered)
+        else:
+            rows = _ndjson_rows(numbered)
+        if too_long:
+            rows = sorted(rows + too_long, key=lambda row: row[0])
+        return rows
+
+    async for lines in read_lines(stream, max_line=max_line):
+        for raw in lines:
+            line_number += 1
+            if raw is None:
+                too_long.append((line_number, LINE_TOO_LONG))
+                continue
+            try:
+                text = raw.decode("utf-8-sig" if line_number == 1 else "utf-8")
+            except UnicodeDecodeError:
+                numbered.append((line_number, None))
+                continue
+            text = text.rstrip("\r")
+            if not text.strip():
+                continue
+
+            if fmt == CSV and header is None:
+                header = next(csv.reader([text]))
+                continue
+
+            numbered.append((line_number, text))
+            if len(numbered) + len(too_long) >= batch_size:
+                yield parse()
+                numbered, too_long = [], []
+
+    if numbered or too_long:
+        yield parse()
+
+
+async def validate_rows(
+    rows: List[Row], now: float, numbers: NumberNormaliser
+) -> Tuple[List[Tuple[int, str, float]], List[Tuple[int, str]]]:
+    """Split rows into (line, E.164 number, ts) calls and (line, error) errors.
+
+    The numbers of the batch are normalised together, off the event loop when
+    there are many of them.
+    """
+    errors = []
+    parsed = []
+
+    for line, fields in rows:
+        if isinstance(fields, str):
+            errors.append((line, fields))
+            continue
+
+        try:
+            raw_number = str(fields["phone_number"])
+            if "ts" in fields:
+                ts = float(fields["ts"])
+            else:
+                ts = datetime.datetime.strptime(
+                    f"{fields['date']} {fields['time']}", "%Y-%m-%d %H:%M"
+                ).timestamp()
+        except (KeyError, TypeError, ValueError):
+            errors.append((line, BAD_ROW))
+            continue
+
+        if not math.isfinite(ts):
+            errors.append((line, "The scheduled time must be a finite number."))
+            continue
+
+        if ts <= now:
+            errors.append((line, "The scheduled time must be in the future."))
+            continue
+
+        parsed.append((line, raw_number, ts))
+
+    e164s = await numbers.normalise_many(raw for _, raw, _ in parsed)
+
+    calls = []
+    for (line, _, ts), e164 in zip(parsed, e164s):
+        if e164 is None:
+            errors.append((line, BAD_ROW))
+        else:
+            calls.append((line, e164, ts))
+
+    errors.sort()
+    return calls, errors
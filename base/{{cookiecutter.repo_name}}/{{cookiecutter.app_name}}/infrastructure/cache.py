@@ -0,0 +1,112 @@
+"""
+In-memory caches.
+"""
+
+import collections
+import time
+from typing import Any, Callable, Hashable, Optional, Tuple
+
+
+class TTLMap:
+    """A mapping whose entries expire ``ttl`` seconds after they were set.
+
+    Every entry lives for the same ``ttl``, so the entries are kept in expiry
+    order and expired ones are dropped from the front as new ones are set.
+    At most ``max_size`` entries are kept, the oldest making way for new ones.
+    ``on_evict(key, value)`` is called for entries dropped without being
+    popped.
+    """
+
+    def __init__(
+        self,
+        ttl: float,
+        max_size: int = 10000,
+        on_evict: Optional[Callable[[Hashable, Any], None]] = None,
+    ) -> None:
+        self._ttl = ttl
+        self._max_size = max(1, max_size)
+        self._on_evict = on_evict
+        self._data: "collections.OrderedDict[Hashable, Tuple[float, Any]]" = (
+            collections.OrderedDict()
+        )
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self._data.get(key)
+        return entry is not None and entry[0] > time.time()
+
+    def _evict_first(self) -> None:
+        key, (_, value) = self._data.popitem(last=False)
+        self.evicted += 1
+        if self._on_evict:
+            self._on_evict(key, value)
+
+    def purge(self) -> None:
+        """Drop every expired entry."""
+        now = time.time()
+        while self._data and next(iter(self._data.values()))[0] <= now:
+            self._evict_first()
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Set the value for a key, restarting its time to live."""
+        self._data.pop(key, None)
+        self._data[key] = (time.time() + self._ttl, value)
+
+        self.purge()
+        while len(self._data) > self._max_size:
+            self._evict_first()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the value for a key, unless it is missing or expired."""
+        entry = self._data.get(key)
+        if entry is None or entry[0] <= time.time():
+            return default
+        return entry[1]
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Remove a key and return its value, unless it is missing or expired."""
+        entry = self._data.pop(key, None)
+        if entry is None:
+            return default
+
+        if entry[0] <= time.time():
+            self.evicted += 1
+            if self._on_evict:
+                self._on_evict(key, entry[1])
+            return default
+        return entry[1]
+
+
+class LRUCache:
+    """A mapping of at most ``max_size`` entries, dropping the least recently used."""
+
+    def __init__(self, max_size: int = 10000) -> None:
+        self._max_size = max(1, max_size)
+        self._data: "collections.OrderedDict[Hashable, Any]" = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the value for a key, marking it as recently used."""
+        try:
+            self._data.move_to_end(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return self._data[key]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self._max_size:
+            self._data.popitem(last=False)
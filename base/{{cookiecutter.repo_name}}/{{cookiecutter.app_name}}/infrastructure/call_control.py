@@ -4,18 +4,59 @@ Processes webhooks and controls the flow of active calls
 """
 
 import asyncio
-from typing import Mapping, Optional
+from typing import TYPE_CHECKING, Hashable, Mapping, Optional
 
-import phonenumbers
 import telnyx
 from aiohttp import ClientSession
 
+from {{cookiecutter.app_name}}.infrastructure.cache import TTLMap
+from {{cookiecutter.app_name}}.infrastructure.events import (
+    ANSWERED,
+    COMPLETED,
+    DIALLED,
+    EventBroadcaster,
+)
+from {{cookiecutter.app_name}}.infrastructure.jokes import JokePool, JokeSource
+from {{cookiecutter.app_name}}.infrastructure.number_pool import Route, RoutePool
+from {{cookiecutter.app_name}}.infrastructure.rate_limit import DialRateLimiter
+from {{cookiecutter.app_name}}.infrastructure.usecases import resolve
+
+if TYPE_CHECKING:
+    # The call state table uses the timing wheel, which imports this module.
+    from {{cookiecutter.app_name}}.infrastructure.call_state import CallStateTable
+
+# The webhooks published to the live feed, and the events they are published as
+PUBLISHED_WEBHOOKS = {"call.answered": ANSWERED, "call.hangup": COMPLETED}
+
+
+def discard_prefetch(call_control_id: Hashable, fetch: asyncio.Future) -> None:
+    """Drop a prefetched joke that expired before the call was answered."""
+    if not fetch.done():
+        fetch.cancel()
+    elif not fetch.cancelled():
+        # Retrieve any error, so asyncio does not log it as never retrieved.
+        fetch.exception()
+
 
 class CallControl:
     """
     This class handles all incoming telnyx call control webhooks.
 
     Creates the initial call request, and handles all subsequent webhooks.
+
+    If ``prefetched`` is given, the joke for a call is fetched as soon as the
+    call is initiated, and kept there until it is answered or hung up.
+
+    If ``call_states`` is given, every dialled call and webhook is recorded in it.
+
+    If ``rate_limiter`` is given, dials wait until they are within its limits.
+
+    If ``routes`` is given, each call is dialled from a source number and
+    connection chosen from the pool, otherwise from ``src_number`` over
+    ``connection_id``.
+
+    If ``events`` is given, dialled, answered and completed calls are published
+    to it.
     """
 
     def __init__(
@@ -25,27 +66,80 @@ class CallControl:
         connection_id: str,
         joke_url: str,
         src_number: str,
+        joke_pool: Optional[JokePool] = None,
+        joke_source: Optional[JokeSource] = None,
+        prefetched: Optional[TTLMap] = None,
+        call_states: Optional["CallStateTable"] = None,
+        rate_limiter: Optional[DialRateLimiter] = None,
+        routes: Optional[RoutePool] = None,
+        events: Optional[EventBroadcaster] = None,
     ) -> None:
         self._client_session = client_session
         self._telnyx_app = telnyx_app
         self._connection_id = connection_id
         self._joke_url = joke_url
         self._src_number = src_number
+        self._joke_pool = joke_pool
+        self._joke_source = joke_source or JokeSource(client_session, joke_url)
+        self._prefetched = prefetched
+        self._call_states = call_states
+        self.rate_limiter = rate_limiter
+        self.routes = routes or RoutePool([Route(connection_id, src_number)])
+        self._events = events
+        self.prefetch_hits = 0
+        self.prefetch_misses = 0
+        self.prefetch_failures = 0
 
     async def _get_joke(self) -> str:
-        """Calls out to the joke API and parses the response
-        and returns the given joke as a string.
+        """Returns a joke from the pool, calling out to the joke API
+        only if the pool is empty.
         """
-        headers = {"Accept": "application/json"}
+        if self._joke_pool is not None:
+            joke = self._joke_pool.take()
+            if joke is not None:
+                return joke
 
-        # Make the GET request to the Joke API
-        resp = await self._client_session.get(self._joke_url, headers=headers)
+        return await self._joke_source.get()
 
-        # Parse the json from the response
-        joke = await resp.json()
+    def _prefetch_joke(self, call_control_id: str) -> None:
+        """Start fetching the joke for a call that is ringing."""
+        if self._prefetched is None or call_control_id is None:
+            return
 
-        # Return the joke
-        return joke["joke"]
+        fetch = asyncio.ensure_future(self._get_joke())
+        self._prefetched.set(call_control_id, fetch)
+
+    async def _get_call_joke(self, call_control_id: str) -> str:
+        """Returns the joke prefetched for the call, or a new one."""
+        fetch = None
+        if self._prefetched is not None:
+            fetch = self._prefetched.pop(call_control_id)
+
+        if fetch is None:
+            self.prefetch_misses += 1
+            return await self._get_joke()
+
+        try:
+            joke = await fetch
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.prefetch_failures += 1
+            return await self._get_joke()
+        self.prefetch_hits += 1
+        return joke
+
+    def prefetch_stats(self) -> Mapping:
+        """How often answered calls found their joke already fetched."""
+        answered = self.prefetch_hits + self.prefetch_misses + self.prefetch_failures
+        return {
+            "pending": len(self._prefetched) if self._prefetched is not None else 0,
+            "hits": self.prefetch_hits,
+            "misses": self.prefetch_misses,
+            "failures": self.prefetch_failures,
+            "hit_rate": self.prefetch_hits / answered if answered else 0.0,
+            "expired": self._prefetched.evicted if self._prefetched is not None else 0,
+        }
 
     async def process_webhook(
         self, call_control_id: Optional[str], event_type: str
@@ -55,39 +149,93 @@ class CallControl:
 
         Checks the event type in the webhook and follows the sequence for that event.
 
+        For call.initiated, start fetching the joke while the call rings.
+
         For call.answered, get the joke and speak the joke.
 
         For call.speak.ended, hang up the call.
+
+        For call.hangup, drop the joke if it was never told.
         """
+        if self._call_states is not None and call_control_id is not None:
+            self._call_states.observe(call_control_id, event_type)
+
+        if self._events is not None and event_type in PUBLISHED_WEBHOOKS:
+            self._events.publish(
+                PUBLISHED_WEBHOOKS[event_type], {"call_control_id": call_control_id}
+            )
+
+        if event_type == "call.initiated":
+            self._prefetch_joke(call_control_id)
+            return
+
+        if event_type == "call.hangup":
+            self.routes.finished(call_control_id)
+            if self._prefetched is not None:
+                fetch = self._prefetched.pop(call_control_id)
+                if fetch is not None:
+                    discard_prefetch(call_control_id, fetch)
+            return
+
+        # Nothing to do for the other events
+        if event_type not in ("call.answered", "call.speak.ended"):
+            return
+
         # Create the call object and populate it with the webhook call control id
         current_call = self._telnyx_app.Call()
         current_call.call_control_id = call_control_id
 
         if event_type == "call.answered":
-            # Get the joke
-            jk = await self._get_joke()
+            # Get the joke, usually fetched while the call was ringing
+            jk = await self._get_call_joke(call_control_id)
 
             # Sleep to ensure the speak happens after the user is listening
             await asyncio.sleep(0.5)
 
             # Request the joke be spoken in the call
-            current_call.speak(payload=jk, voice="male", language="en-GB")
+            await resolve(
+                current_call.speak(payload=jk, voice="male", language="en-GB")
+            )
 
             return
 
         if event_type == "call.speak.ended":
             # Hang up the call after the joke is finished
-            current_call.hangup()
+            await resolve(current_call.hangup())
 
-    async def dial(self, data) -> None:
-        """This takes in call data and initates the call.
+    async def dial(self, dst: str) -> None:
+        """This takes in the number to call, in E.164 format, and initates the call.
         Saves the information to self._requested_calsl to be tracked with future webhooks.
 
         """
-        # Format the number in +E.164 format
-        dst = phonenumbers.format_number(data, phonenumbers.PhoneNumberFormat.E164)
 
-        # Request the call to be initiated
-        self._telnyx_app.Call.create(
-            connection_id=self._connection_id, to=dst, from_=self._src_number
-        )
+        # Pick the number to call from, and wait for our turn within the
+        # carrier's calls per second limits for it
+        route = self.routes.choose()
+        try:
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire(route.connection_id, route.src_number)
+
+            # Request the call to be initiated
+            call = await resolve(
+                self._telnyx_app.Call.create(
+                    connection_id=route.connection_id, to=dst, from_=route.src_number
+                )
+            )
+        except asyncio.CancelledError:
+            # Not the route's fault, just stop counting the call against it.
+            self.routes.release(route)
+            raise
+        except Exception:
+            self.routes.failed(route)
+            raise
+
+        # Track the call, so its webhooks can be correlated with it
+        call_control_id = getattr(call, "call_control_id", None)
+        self.routes.dialled(route, call_control_id)
+        if self._call_states is not None and call_control_id:
+            self._call_states.dialled(call_control_id, dst)
+        if self._events is not None:
+            self._events.publish(
+                DIALLED, {"call_control_id": call_control_id, "phone_number": dst}
+            )
@@ -0,0 +1,184 @@
+"""
+In-process state of the calls in progress.
+
+Each call is tracked in a small slotted record, keyed by its call control id.
+Records expire when a call has not been heard from for ``ttl`` seconds, using
+a timing wheel so that expiry never scans the table.
+"""
+
+import collections
+import enum
+import math
+import time
+from typing import Deque, Dict, Mapping, Optional
+
+from {{cookiecutter.app_name}}.infrastructure.scheduler import _percentile
+from {{cookiecutter.app_name}}.infrastructure.timing_wheel import HierarchicalTimingWheel
+
+
+class CallState(enum.IntEnum):
+    """How far a call has got"""
+
+    DIALLED = 1
+    INITIATED = 2
+    ANSWERED = 3
+    SPEAKING = 4
+    SPOKEN = 5
+
+
+# The state each webhook event moves a call to. call.hangup ends the call.
+EVENT_STATES = {
+    "call.initiated": CallState.INITIATED,
+    "call.answered": CallState.ANSWERED,
+    "call.speak.started": CallState.SPEAKING,
+    "call.speak.ended": CallState.SPOKEN,
+}
+
+
+class CallRecord:
+    """What is known about a single call.
+
+    Timestamps are seconds since the epoch, ``deadline`` is the timing wheel
+    tick the record expires at unless the call is heard from again.
+    """
+
+    __slots__ = ("state", "destination", "created", "answered", "updated", "deadline")
+
+    def __init__(
+        self, state: CallState, destination: Optional[str], now: float, deadline: int
+    ) -> None:
+        self.state = state
+        self.destination = destination
+        self.created = now
+        self.answered = 0.0
+        self.updated = now
+        self.deadline = deadline
+
+
+class CallStateTable:
+    """Calls in progress, keyed by call control id.
+
+    A call is forgotten when it hangs up, or ``ttl`` seconds after its last
+    event, in which case it is counted as stuck. At most ``max_size`` calls are
+    tracked; calls beyond that are counted as overflow rather than tracked.
+    """
+
+    def __init__(self, ttl: float = 3600, max_size: int = 200000, tick: float = 1.0):
+        self._ttl = ttl
+        self._max_size = max_size
+        self._tick = tick
+        self._records: Dict[str, CallRecord] = {}
+        self._wheel = HierarchicalTimingWheel(start_tick=self._current_tick())
+        self._states: Dict[CallState, int] = collections.Counter()
+
+        self.completed = 0
+        self.stuck = 0
+        self.overflow = 0
+        self.answer_times: Deque[float] = collections.deque(maxlen=1000)
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def _current_tick(self) -> int:
+        return math.floor(time.time() / self._tick)
+
+    def _deadline(self, now: float) -> int:
+        return math.ceil((now + self._ttl) / self._tick)
+
+    def get(self, call_control_id: str) -> Optional[CallRecord]:
+        """Return the record of a call in progress, if any."""
+        return self._records.get(call_control_id)
+
+    def _track(
+        self, call_control_id: str, state: CallState, destination: Optional[str]
+    ) -> Optional[CallRecord]:
+        """Start tracking a new call, unless the table is full."""
+        if len(self._records) >= self._max_size:
+            self.overflow += 1
+            return None
+
+        now = time.time()
+        record = CallRecord(state, destination, now, self._deadline(now))
+        self._records[call_control_id] = record
+        self._states[state] += 1
+        self._wheel.insert(record.deadline, call_control_id)
+        return record
+
+    def _forget(self, call_control_id: str) -> Optional[CallRecord]:
+        record = self._records.pop(call_control_id, None)
+        if record is not None:
+            self._states[record.state] -= 1
+        return record
+
+    def dialled(self, call_control_id: str, destination: str) -> None:
+        """Track a call we have just dialled."""
+        self.expire()
+        if call_control_id not in self._records:
+            self._track(call_control_id, CallState.DIALLED, destination)
+
+    def observe(self, call_control_id: str, event_type: str) -> Optional[CallRecord]:
+        """Apply a webhook event to the call, returning its record."""
+        self.expire()
+
+        if event_type == "call.hangup":
+            if self._forget(call_control_id) is not None:
+                self.completed += 1
+            return None
+
+        state = EVENT_STATES.get(event_type)
+        record = self._records.get(call_control_id)
+        if record is None:
+            # A call we did not dial, or one dropped when the table was full.
+            if state is None:
+                return None
+            return self._track(call_control_id, state, None)
+
+        now = time.time()
+        record.updated = now
+        record.deadline = self._deadline(now)
+
+        if state is not None and state != record.state:
+            self._states[record.state] -= 1
+            self._states[state] += 1
+            record.state = state
+
+            if state == CallState.ANSWERED:
+                record.answered = now
+                self.answer_times.append(now - record.created)
+
+        return record
+
+    def expire(self) -> int:
+        """Forget the calls whose deadline has passed, returning how many."""
+        now_tick = self._current_tick()
+        expired = 0
+        for call_control_id in self._wheel.advance(now_tick):
+            record = self._records.get(call_control_id)
+            if record is None:
+                # The call hung up in the meantime.
+                continue
+
+            # Heard from since it was armed, wait for the new deadline instead.
+            if record.deadline > now_tick:
+                self._wheel.insert(record.deadline, call_control_id)
+                continue
+
+            self._forget(call_control_id)
+            expired += 1
+
+        self.stuck += expired
+        return expired
+
+    def stats(self) -> Mapping:
+        """Counts of the calls in progress, by state, and the answer times."""
+        self.expire()
+        answer_times = sorted(self.answer_times)
+        return {
+            "active": len(self._records),
+            "states": {state.name.lower(): self._states[state] for state in CallState},
+            "completed": self.completed,
+            "stuck": self.stuck,
+            "overflow": self.overflow,
+            "p50_answer_time": _percentile(answer_times, 50),
+            "p99_answer_time": _percentile(answer_times, 99),
+        }
@@ -0,0 +1,91 @@
+"""
+Circuit breaker for calls to external services.
+"""
+
+import time
+from typing import Mapping
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a service whose circuit is open."""
+
+
+class CircuitBreaker:
+    """Stops calling a failing service for a while.
+
+    The circuit starts closed. After ``failure_threshold`` consecutive
+    failures it opens, and every call is refused for ``reset_timeout``
+    seconds. It is then half open: up to ``half_open_calls`` trial calls are
+    let through, and the first result decides whether it closes or opens again.
+
+    Callers ask ``allow()`` before each call and then report the outcome with
+    ``record_success()``, ``record_failure()`` or, if the call was abandoned,
+    ``release()``.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30,
+        half_open_calls: int = 1,
+    ) -> None:
+        self._failure_threshold = max(1, failure_threshold)
+        self._reset_timeout = reset_timeout
+        self._half_open_calls = max(1, half_open_calls)
+
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trials = 0
+        self.trips = 0
+
+    @property
+    def state(self) -> str:
+        """The current state, moving an open circuit to half open once it is due."""
+        if self._state == OPEN and time.time() - self._opened_at >= self._reset_timeout:
+            self._state = HALF_OPEN
+            self._trials = 0
+        return self._state
+
+    def allow(self) -> bool:
+        """Whether a call may be made now."""
+        state = self.state
+        if state == CLOSED:
+            return True
+
+        if state == HALF_OPEN and self._trials < self._half_open_calls:
+            self._trials += 1
+            return True
+        return False
+
+    def _open(self) -> None:
+        self._state = OPEN
+        self._opened_at = time.time()
+        self.trips += 1
+
+    def record_success(self) -> None:
+        """A call succeeded, close the circuit."""
+        self._state = CLOSED
+        self._failures = 0
+
+    def record_failure(self) -> None:
+        """A call failed, opening the circuit if there have been too many."""
+        if self._state == HALF_OPEN:
+            self._open()
+            return
+
+        self._failures += 1
+        if self._state == CLOSED and self._failures >= self._failure_threshold:
+            self._open()
+
+    def release(self) -> None:
+        """A call was abandoned before it finished, free its trial slot."""
+        if self._state == HALF_OPEN and self._trials:
+            self._trials -= 1
+
+    def as_dict(self) -> Mapping:
+        return {"state": self.state, "failures": self._failures, "trips": self.trips}
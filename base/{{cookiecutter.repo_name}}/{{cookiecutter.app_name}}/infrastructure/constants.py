@@ -1,7 +1,31 @@
 """Define constants to be used throughout the app"""
 
+BULK_BATCH_SIZE = "bulk_batch_size"
+
 CALL_CONTROL_APP = "call_control_app"
 
+CALL_STATES = "call_states"
+
+EVENTS = "events"
+
+JOKE_POOL = "joke_pool"
+
+JOKE_SOURCE = "joke_source"
+
+LISTING = "listing"
+
+LOOP_MONITOR = "loop_monitor"
+
+NUMBERS = "numbers"
+
+PROFILER = "profiler"
+
 SCHEDULER = "scheduler"
 
+TELEGRAF = "telegraf"
+
 TELNYX = "telnyx"
+
+WEBHOOK_DISPATCHER = "webhook_dispatcher"
+
+WEBHOOK_DEDUPLICATOR = "webhook_deduplicator"
@@ -0,0 +1,170 @@
+"""
+Duplicate webhook suppression.
+
+Telnyx redelivers a webhook if it is not acknowledged in time, with the same
+event id. The WebhookDeduplicator remembers the ids of recent webhooks, so a
+redelivery can be acknowledged without being processed again.
+"""
+
+import collections
+import math
+from typing import Hashable, List, Mapping, Optional, Tuple
+
+
+class LRUSet:
+    """A set of at most ``max_size`` keys, forgetting the least recently seen."""
+
+    def __init__(self, max_size: int) -> None:
+        self._max_size = max(1, max_size)
+        self._keys: "collections.OrderedDict[Hashable, None]" = (
+            collections.OrderedDict()
+        )
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, key: Hashable) -> bool:
+        if key in self._keys:
+            self._keys.move_to_end(key)
+            return True
+        return False
+
+    def add(self, key: Hashable) -> None:
+        self._keys[key] = None
+        self._keys.move_to_end(key)
+        if len(self._keys) > self._max_size:
+            self._keys.popitem(last=False)
+
+    def discard(self, key: Hashable) -> None:
+        self._keys.pop(key, None)
+
+
+class BloomFilter:
+    """A fixed size bloom filter for strings.
+
+    Sized so that after ``capacity`` keys, a key that was never added is
+    reported as present with probability ``error_rate``. Filters with the same
+    capacity and error rate share bit positions, so a key's positions can be
+    computed once and checked against several filters.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001) -> None:
+        self.capacity = capacity
+        self.count = 0
+        self._size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self._hashes = max(1, round(self._size / capacity * math.log(2)))
+        self._bits = bytearray((self._size + 7) // 8)
+
+    def positions(self, key: str) -> List[int]:
+        """The bit positions of a key, by double hashing its hash.
+
+        The string hash is randomised per process, which is fine for a filter
+        that only lives in memory.
+        """
+        h = hash(key) & 0xFFFFFFFFFFFFFFFF
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        size = self._size
+        return [(h1 + i * h2) % size for i in range(self._hashes)]
+
+    def has(self, positions: List[int]) -> bool:
+        """Whether every one of the bits is set."""
+        bits = self._bits
+        for p in positions:
+            if not bits[p >> 3] & (1 << (p & 7)):
+                return False
+        return True
+
+    def set(self, positions: List[int]) -> None:
+        """Set the bits of a key."""
+        bits = self._bits
+        for p in positions:
+            bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return self.has(self.positions(key))
+
+    def add(self, key: str) -> None:
+        self.set(self.positions(key))
+
+
+class WebhookDeduplicator:
+    """Remembers the ids of recently processed webhooks.
+
+    The last ``max_size`` ids are kept exactly in an LRU set, which decides
+    whether a webhook is a duplicate. With a ``bloom_capacity``, ids are also
+    added to a pair of rotating bloom filters in front of it. An id the filters
+    have not seen is new without looking in the LRU set, which is the case for
+    almost every webhook. An id they report is checked in the LRU set, so a
+    false positive only costs a lookup and no webhook is ever dropped on the
+    filters' word alone.
+
+    The filters hold at least ``max_size`` ids each, so they never forget an
+    id that is still in the LRU set.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 100000,
+        bloom_capacity: int = 0,
+        bloom_error_rate: float = 0.001,
+    ) -> None:
+        self._recent = LRUSet(max_size)
+        if bloom_capacity:
+            bloom_capacity = max(bloom_capacity, max_size)
+        self._bloom_capacity = bloom_capacity
+        self._bloom_error_rate = bloom_error_rate
+        self._bloom: Optional[BloomFilter] = None
+        self._previous_bloom: Optional[BloomFilter] = None
+        if bloom_capacity:
+            self._bloom = BloomFilter(bloom_capacity, bloom_error_rate)
+
+        # The bloom positions of the id last checked, which is usually added next.
+        self._last: Tuple[Optional[str], List[int]] = (None, [])
+
+        self.duplicates = 0
+
+    def _positions(self, event_id: str) -> List[int]:
+        if self._last[0] != event_id:
+            self._last = (event_id, self._bloom.positions(event_id))
+        return self._last[1]
+
+    def _bloom_has(self, event_id: str) -> bool:
+        positions = self._positions(event_id)
+        return self._bloom.has(positions) or (
+            self._previous_bloom is not None and self._previous_bloom.has(positions)
+        )
+
+    def _bloom_add(self, event_id: str) -> None:
+        positions = self._positions(event_id)
+        # Only ids new to the current filter count towards filling it up.
+        if self._bloom.has(positions):
+            return
+        # Start a new filter when the current one is full, keeping the last one
+        # so that recent ids are not forgotten all at once.
+        if self._bloom.count >= self._bloom_capacity:
+            self._previous_bloom = self._bloom
+            self._bloom = BloomFilter(self._bloom_capacity, self._bloom_error_rate)
+        self._bloom.set(positions)
+
+    def __contains__(self, event_id: str) -> bool:
+        """Whether the webhook with this id has already been processed."""
+        if self._bloom is not None and not self._bloom_has(event_id):
+            return False
+
+        if event_id in self._recent:
+            if self._bloom is not None:
+                # The LRU set just kept the id, so the filters must keep it too.
+                self._bloom_add(event_id)
+            self.duplicates += 1
+            return True
+        return False
+
+    def add(self, event_id: str) -> None:
+        """Remember that the webhook with this id has been processed."""
+        self._recent.add(event_id)
+        if self._bloom is not None:
+            self._bloom_add(event_id)
+
+    def stats(self) -> Mapping:
+        return {"remembered": len(self._recent), "duplicates": self.duplicates}
@@ -0,0 +1,147 @@
+"""
+A live feed of changes to the schedule and the calls, as server-sent events.
+
+Each event is serialised once when it is published, and the same bytes are
+handed to every connected dashboard. A dashboard buffers at most
+``max_pending`` events it has not been sent yet. One that falls further behind
+is dropped rather than buffered for, and reloads the page to catch up.
+
+Events are published by the process they happen in. With several workers, a
+dashboard sees the calls scheduled through its own worker, and the dispatches
+of the worker owning the scheduler.
+"""
+
+import asyncio
+import itertools
+import json
+from typing import Any, Dict, List, Mapping, Optional, Set
+
+from {{cookiecutter.app_name}}.infrastructure.recurrence import Recurring
+
+SCHEDULED = "scheduled"
+RESCHEDULED = "rescheduled"
+CANCELLED = "cancelled"
+BULK_SCHEDULED = "bulk_scheduled"
+DISPATCHED = "dispatched"
+DIALLED = "dialled"
+ANSWERED = "answered"
+COMPLETED = "completed"
+
+# Sent to a dropped dashboard before its stream ends, so it knows to reload.
+RESET = b"event: reset\ndata: {}\n\n"
+
+# Sent when there have been no events for a while, so dead connections are noticed.
+KEEPALIVE = b": keepalive\n\n"
+
+
+def call_data(qm) -> Dict[str, Any]:
+    """A scheduled call, as sent in events and listed by the JSON API."""
+    data = {"handle": qm.handle, "ts": qm.ts, "phone_number": str(qm.msg)}
+    if isinstance(qm.msg, Recurring):
+        data["repeat"] = str(qm.msg.rule)
+    return data
+
+
+def format_event(event_id: int, event: str, data: Any) -> bytes:
+    """Serialise an event in the text/event-stream format."""
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n".encode()
+
+
+class Subscription:
+    """The events waiting to be sent to one dashboard."""
+
+    def __init__(self, max_pending: int) -> None:
+        self._queue: asyncio.Queue = asyncio.Queue(max_pending)
+        self.dropped = False
+
+    def _offer(self, chunk: bytes) -> bool:
+        """Buffer an event, returning False if the buffer is full."""
+        try:
+            self._queue.put_nowait(chunk)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    def _end(self) -> None:
+        """Discard the buffered events and end the stream."""
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        self._queue.put_nowait(None)
+
+    async def get(self, timeout: float) -> Optional[bytes]:
+        """Wait for the next events, returned together as one chunk.
+
+        Returns KEEPALIVE if nothing was published within timeout seconds,
+        and None once the subscription has ended.
+        """
+        try:
+            first = await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return KEEPALIVE
+
+        chunks: List[bytes] = [first]
+        while chunks[-1] is not None and not self._queue.empty():
+            chunks.append(self._queue.get_nowait())
+
+        if chunks[-1] is None:
+            # Send what came before the end, and end on the next call.
+            chunks.pop()
+            self._queue.put_nowait(None)
+            if not chunks:
+                return None
+        return b"".join(chunks)
+
+
+class EventBroadcaster:
+    """Fans published events out to the subscribed dashboards."""
+
+    def __init__(self, max_pending: int = 100) -> None:
+        self._max_pending = max(1, max_pending)
+        self._subscribers: Set[Subscription] = set()
+        self._ids = itertools.count(1)
+        self._closed = False
+        self.published = 0
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        """Number of subscribed dashboards."""
+        return len(self._subscribers)
+
+    def subscribe(self) -> Subscription:
+        subscription = Subscription(self._max_pending)
+        if self._closed:
+            subscription._end()
+        else:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self._subscribers.discard(subscription)
+
+    def publish(self, event: str, data: Mapping) -> None:
+        """Send an event to every subscriber, dropping the ones too far behind."""
+        event_id = next(self._ids)
+        self.published += 1
+        if not self._subscribers:
+            return
+
+        chunk = format_event(event_id, event, data)
+        for subscription in [s for s in self._subscribers if not s._offer(chunk)]:
+            self._subscribers.discard(subscription)
+            subscription.dropped = True
+            subscription._end()
+            self.dropped += 1
+
+    def close(self) -> None:
+        """End every stream, and any started later."""
+        self._closed = True
+        for subscription in self._subscribers:
+            subscription._end()
+        self._subscribers.clear()
+
+    def stats(self) -> Mapping:
+        return {
+            "subscribers": len(self._subscribers),
+            "published": self.published,
+            "dropped": self.dropped,
+        }
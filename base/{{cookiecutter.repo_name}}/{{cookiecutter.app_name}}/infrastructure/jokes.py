@@ -0,0 +1,351 @@
+"""
+Jokes from the external joke API.
+
+The JokeSource fetches jokes through a circuit breaker, with hedged requests and
+timeouts, and falls back to a local corpus while the joke API is unavailable.
+The JokePool keeps a number of jokes fetched ahead of time, so that a call can
+be told a joke as soon as it is answered instead of waiting on the joke API.
+"""
+
+import asyncio
+import collections
+import gzip
+import logging
+import random
+import time
+from typing import Any, Awaitable, Callable, Deque, List, Mapping, Optional, Set
+
+import aiohttp
+import attr
+from aiohttp import ClientSession
+
+from {{cookiecutter.app_name}}.infrastructure.circuit_breaker import CircuitBreaker, CircuitOpenError
+from {{cookiecutter.app_name}}.infrastructure.metrics import (
+    JOKE_FETCH_ERRORS,
+    JOKE_FETCH_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+
+async def fetch_joke(
+    client_session: ClientSession, joke_url: str, timeout: Optional[float] = None
+) -> str:
+    """Calls out to the joke API and parses the response
+    and returns the given joke as a string.
+    """
+    headers = {"Accept": "application/json"}
+
+    # Make the GET request to the Joke API, releasing the connection even when
+    # it fails or a hedged attempt is cancelled
+    async with client_session.get(
+        joke_url, headers=headers, timeout=aiohttp.ClientTimeout(total=timeout)
+    ) as resp:
+        resp.raise_for_status()
+
+        # Parse the json from the response
+        joke = await resp.json()
+
+    # Return the joke
+    return joke["joke"]
+
+
+async def hedged(
+    fetch: Callable[[], Awaitable[Any]],
+    delay: float,
+    attempts: int = 2,
+    *,
+    loop: asyncio.AbstractEventLoop = None,
+) -> Any:
+    """Await ``fetch()``, starting another attempt whenever the ones in flight
+    have taken ``delay`` seconds or failed, up to ``attempts`` in total.
+
+    Returns the first successful result and cancels the other attempts.
+    """
+    tasks: List[asyncio.Future] = []
+    try:
+        while True:
+            if len(tasks) < attempts:
+                tasks.append(asyncio.ensure_future(fetch(), loop=loop))
+
+            pending = [task for task in tasks if not task.done()]
+            if not pending:
+                # Every attempt failed, so this raises the error of the last one.
+                return tasks[-1].result()
+
+            done, _ = await asyncio.wait(
+                pending,
+                timeout=delay if len(tasks) < attempts else None,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def load_corpus(path: str) -> List[str]:
+    """Read a gzipped file of jokes, one per line."""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+class JokeSource:
+    """Fetches jokes from the joke API, guarded by a circuit breaker.
+
+    Every fetch is limited to ``timeout`` seconds, and a second request is sent
+    if the first has not answered within ``hedge_delay`` seconds. While the
+    circuit is open, or if a fetch fails, ``get`` tells a joke from the local
+    ``corpus`` instead, so answering a call never waits on a broken joke API.
+    """
+
+    def __init__(
+        self,
+        client_session: ClientSession,
+        joke_url: str,
+        *,
+        timeout: float = 2.0,
+        hedge_delay: float = 0.5,
+        hedge_attempts: int = 2,
+        breaker: CircuitBreaker = None,
+        corpus: List[str] = None,
+        loop: asyncio.AbstractEventLoop = None,
+    ) -> None:
+        self._client_session = client_session
+        self._joke_url = joke_url
+        self._timeout = timeout
+        self._hedge_delay = hedge_delay
+        self._hedge_attempts = max(1, hedge_attempts)
+        self._breaker = breaker or CircuitBreaker()
+        self._corpus = corpus or []
+        self._loop = loop
+
+        self.fetched = 0
+        self.failed = 0
+        self.fallbacks = 0
+
+    def _fetch_once(self) -> Awaitable[str]:
+        return fetch_joke(self._client_session, self._joke_url, self._timeout)
+
+    async def fetch(self) -> str:
+        """Fetch a joke from the joke API, raising CircuitOpenError if it is down."""
+        if not self._breaker.allow():
+            raise CircuitOpenError(self._joke_url)
+
+        started = time.monotonic()
+        try:
+            joke = await hedged(
+                self._fetch_once,
+                self._hedge_delay,
+                self._hedge_attempts,
+                loop=self._loop,
+            )
+        except asyncio.CancelledError:
+            self._breaker.release()
+            raise
+        except Exception:
+            self.failed += 1
+            JOKE_FETCH_ERRORS.inc()
+            JOKE_FETCH_SECONDS.observe(time.monotonic() - started)
+            self._breaker.record_failure()
+            raise
+
+        self.fetched += 1
+        JOKE_FETCH_SECONDS.observe(time.monotonic() - started)
+        self._breaker.record_success()
+        return joke
+
+    async def get(self) -> str:
+        """Fetch a joke, telling one from the local corpus if that fails."""
+        try:
+            return await self.fetch()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if not self._corpus:
+                raise
+
+            if not isinstance(e, CircuitOpenError):
+                logger.warning("Failed to fetch a joke, using the local corpus: %r", e)
+            self.fallbacks += 1
+            return random.choice(self._corpus)
+
+    def stats(self) -> Mapping:
+        """Circuit state and how jokes have been served so far."""
+        return dict(
+            self._breaker.as_dict(),
+            fetched=self.fetched,
+            failed=self.failed,
+            fallbacks=self.fallbacks,
+            corpus=len(self._corpus),
+        )
+
+
+@attr.s(slots=True)
+class PooledJoke:
+    """A joke, when it was fetched and how many calls have heard it"""
+
+    text = attr.ib()
+    fetched = attr.ib(factory=time.time)
+    uses = attr.ib(default=0)
+
+
+class JokePool:
+    """Jokes fetched ahead of time, kept topped up by a background task.
+
+    The pool holds up to ``size`` distinct jokes. A joke is dropped once it is
+    older than ``max_age`` seconds or has been told ``max_uses`` times. The
+    refill task checks the pool every ``refill_interval`` seconds, or as soon
+    as it is drained, and fetches up to ``concurrency`` jokes at a time.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[], Awaitable[str]],
+        *,
+        size: int = 50,
+        max_age: float = 3600,
+        max_uses: int = 1,
+        refill_interval: float = 5,
+        concurrency: int = 4,
+        loop: asyncio.AbstractEventLoop = None,
+    ) -> None:
+        self._fetch = fetch
+        self._size = size
+        self._max_age = max_age
+        self._max_uses = max(1, max_uses)
+        self._refill_interval = refill_interval
+        self._concurrency = max(1, concurrency)
+        self._loop = loop or asyncio.get_event_loop()
+
+        self._jokes: Deque[PooledJoke] = collections.deque()
+        self._texts: Set[str] = set()
+        self._task: Optional[asyncio.Future[None]] = None
+        self._drained: Optional[asyncio.Event] = None
+
+        self.hits = 0
+        self.misses = 0
+        self.duplicates = 0
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._jokes)
+
+    def _is_stale(self, joke: PooledJoke, now: float) -> bool:
+        """Whether the joke is too old to be told."""
+        return now - joke.fetched > self._max_age
+
+    def _discard(self, joke: PooledJoke) -> None:
+        """Forget a joke that has left the pool."""
+        self._texts.discard(joke.text)
+
+    def add(self, text: str) -> bool:
+        """Add a freshly fetched joke. Returns False if it is already pooled."""
+        if text in self._texts:
+            self.duplicates += 1
+            return False
+
+        self._texts.add(text)
+        self._jokes.append(PooledJoke(text))
+        return True
+
+    def take(self) -> Optional[str]:
+        """Return a joke from the pool, or None if it is empty."""
+        now = time.time()
+        while self._jokes:
+            joke = self._jokes.popleft()
+            if self._is_stale(joke, now):
+                self.evicted += 1
+                self._discard(joke)
+                continue
+
+            # Jokes that may be told again go to the back of the line.
+            joke.uses += 1
+            if joke.uses < self._max_uses:
+                self._jokes.append(joke)
+            else:
+                self._discard(joke)
+
+            self.hits += 1
+            self._wake_refill()
+            return joke.text
+
+        self.misses += 1
+        self._wake_refill()
+        return None
+
+    def evict_stale(self) -> None:
+        """Drop every joke that is older than max_age."""
+        now = time.time()
+        fresh: Deque[PooledJoke] = collections.deque()
+        for joke in self._jokes:
+            if self._is_stale(joke, now):
+                self.evicted += 1
+                self._discard(joke)
+            else:
+                fresh.append(joke)
+        self._jokes = fresh
+
+    async def refill(self) -> None:
+        """Fetch jokes until the pool is full, or a round brings nothing new."""
+        self.evict_stale()
+        while len(self._jokes) < self._size:
+            batch = min(self._size - len(self._jokes), self._concurrency)
+            results = await asyncio.gather(
+                *(self._fetch() for _ in range(batch)), return_exceptions=True
+            )
+
+            added = 0
+            for result in results:
+                if isinstance(result, Exception):
+                    logger.warning("Failed to fetch a joke for the pool: %r", result)
+                elif self.add(result):
+                    added += 1
+
+            if not added:
+                return
+
+    def _wake_refill(self) -> None:
+        """Let the refill task know a joke was taken."""
+        if self._drained is not None:
+            self._drained.set()
+
+    async def _run(self) -> None:
+        """Refill the pool periodically, and whenever jokes are taken from it."""
+        while True:
+            try:
+                await self.refill()
+            except Exception:
+                logger.exception("Failed to refill the joke pool")
+
+            self._drained.clear()
+            try:
+                await asyncio.wait_for(self._drained.wait(), self._refill_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self) -> None:
+        """Start filling the pool in the background."""
+        self._drained = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run(), loop=self._loop)
+
+    def stats(self) -> Mapping:
+        """Pool size and hit rate so far."""
+        lookups = self.hits + self.misses
+        return {
+            "pooled": len(self._jokes),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "duplicates": self.duplicates,
+            "evicted": self.evicted,
+        }
+
+    async def close(self) -> None:
+        """Stop the refill task."""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
@@ -0,0 +1,123 @@
+"""
+Listing the scheduled calls in time order, a page at a time.
+"""
+
+import bisect
+import time
+from typing import Any, Iterable, List, Optional, Tuple
+
+from {{cookiecutter.app_name}}.infrastructure.usecases import resolve
+
+# Where a page starts: after the call with this (ts, handle).
+Cursor = Tuple[float, int]
+
+
+def format_cursor(cursor: Cursor) -> str:
+    return f"{cursor[0]!r}_{cursor[1]}"
+
+
+def parse_cursor(text: str) -> Cursor:
+    """Parse a cursor from format_cursor, raising ValueError if it isn't one."""
+    ts, handle = text.split("_")
+    return float(ts), int(handle)
+
+
+class ScheduleListing:
+    """Pages through the scheduled calls of a scheduler in time order.
+
+    Schedulers that can ``page`` through their calls in time order, like the
+    windowed one, are asked for every page. For the others, pages are cut from
+    a sorted snapshot of the calls, rather than sorting the scheduler on every
+    request. The snapshot is brought up to date when the scheduler's
+    ``version`` has changed, sorting in only the calls added or moved since.
+    Going through a big schedule still takes a while, so updates are spaced
+    out to take at most 1/``spacing`` of the time, and the snapshot of a big
+    schedule can be a little behind. Schedulers without a version, like the
+    ones in other processes, are snapshotted again after ``max_age`` seconds.
+
+    Each update starts a new ``generation``, which pages rendered from the
+    listing can be cached by.
+    """
+
+    def __init__(self, scheduler, max_age: float = 1.0, spacing: float = 10) -> None:
+        self._scheduler = scheduler
+        self._paged = hasattr(scheduler, "page")
+        self._max_age = max_age
+        self._spacing = spacing
+        self._entries: List[Any] = []
+        self._keys: List[Cursor] = []
+        self._version: Optional[int] = None
+        self._built_at = 0.0
+        self._build_seconds = 0.0
+        self.generation = 0
+        # The rendered homepage, and the (generation, ...) key it was rendered for.
+        self.homepage: Optional[Tuple[Any, str]] = None
+
+    def _is_fresh(self) -> bool:
+        if not self.generation:
+            return False
+
+        version = getattr(self._scheduler, "version", None)
+        if version is not None and version == self._version:
+            return True
+
+        min_age = self._build_seconds * self._spacing
+        if version is None:
+            min_age = max(min_age, self._max_age)
+        return time.monotonic() - self._built_at < min_age
+
+    def _update(self, entries: Iterable[Any]) -> None:
+        """Bring the sorted snapshot up to date with the scheduler's calls."""
+        current = {qm.handle: qm for qm in entries}
+        kept = []
+        for (ts, handle), _ in zip(self._keys, self._entries):
+            qm = current.get(handle)
+            if qm is not None and qm.ts == ts:
+                kept.append(((ts, handle), qm))
+                del current[handle]
+
+        # What is left was added or moved. Sorting it on its own and then the
+        # two sorted runs together is a merge, so only the changes are sorted.
+        kept.extend(sorted(((qm.ts, qm.handle), qm) for qm in current.values()))
+        kept.sort(key=lambda entry: entry[0])
+        self._keys = [key for key, _ in kept]
+        self._entries = [qm for _, qm in kept]
+
+    async def refresh(self) -> None:
+        """Update the snapshot, unless it is still fresh."""
+        if self._is_fresh():
+            return
+
+        version = getattr(self._scheduler, "version", None)
+        started = time.monotonic()
+        if not self._paged:
+            self._update(await resolve(self._scheduler.items()))
+
+        self._version = version
+        self._built_at = time.monotonic()
+        self._build_seconds = self._built_at - started
+        self.generation += 1
+
+    def __len__(self) -> int:
+        """How many calls there are to list."""
+        if self._paged:
+            return len(self._scheduler)
+        return len(self._keys)
+
+    async def page(
+        self, after: Optional[Cursor] = None, limit: int = 100
+    ) -> Tuple[List[Any], Optional[Cursor]]:
+        """Return up to limit calls after the cursor, and the next page's cursor."""
+        await self.refresh()
+
+        if self._paged:
+            entries = list(await resolve(self._scheduler.page(after, limit + 1)))
+            if len(entries) <= limit:
+                return entries, None
+            last = entries[limit - 1]
+            return entries[:limit], (last.ts, last.handle)
+
+        start = bisect.bisect_right(self._keys, after) if after else 0
+        entries = self._entries[start : start + limit]
+        more = start + limit < len(self._keys)
+        return entries, self._keys[start + limit - 1] if more else None
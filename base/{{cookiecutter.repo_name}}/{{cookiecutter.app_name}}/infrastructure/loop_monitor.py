@@ -0,0 +1,169 @@
+"""
+Watching the event loop for code that blocks it.
+
+A probe task sleeps for ``interval`` seconds at a time and measures how much
+later than asked it woke up. That lag is how long every other callback waited
+too. A watchdog thread checks that the probe keeps beating, and when the loop
+has been stuck for ``slow_threshold`` seconds it captures the stack of the
+loop's thread, which shows the code that is blocking it.
+"""
+
+import asyncio
+import collections
+import logging
+import sys
+import threading
+import time
+import traceback
+from typing import Any, Deque, Dict, List, Mapping, Optional
+
+from {{cookiecutter.app_name}}.infrastructure.metrics import LOOP_LAG
+from {{cookiecutter.app_name}}.infrastructure.scheduler import _percentile
+
+logger = logging.getLogger(__name__)
+
+
+class LoopMonitor:
+    """Measures event loop lag and captures the stacks of slow callbacks.
+
+    The loop is ``degraded`` once the lag has stayed above ``degraded_lag``
+    seconds for ``degraded_after`` seconds. Percentiles are over the last
+    ``window`` probes, and the last ``max_stalls`` stalls are kept.
+    """
+
+    def __init__(
+        self,
+        *,
+        interval: float = 0.1,
+        slow_threshold: float = 0.25,
+        degraded_lag: float = 0.5,
+        degraded_after: float = 10.0,
+        window: int = 1000,
+        max_stalls: int = 10,
+        loop: asyncio.AbstractEventLoop = None,
+    ) -> None:
+        self._interval = interval
+        self._slow_threshold = slow_threshold
+        self._degraded_lag = degraded_lag
+        self._degraded_after = degraded_after
+        self._loop = loop or asyncio.get_event_loop()
+        self._lags: Deque[float] = collections.deque(maxlen=window)
+        self._task: Optional[asyncio.Future] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._loop_thread: Optional[int] = None
+
+        # Set by the probe on the loop, read by the watchdog thread.
+        self._beats = 0
+        self._beat_at = time.monotonic()
+
+        # The stall being captured by the watchdog, until the probe ends it.
+        self._stall: Optional[Dict[str, Any]] = None
+        self._stalled_beat = -1
+        self._lagging_since: Optional[float] = None
+
+        self.stalls: Deque[Dict[str, Any]] = collections.deque(maxlen=max_stalls)
+        self.stall_count = 0
+
+    @property
+    def degraded(self) -> bool:
+        """Whether the lag has stayed over the limit for long enough."""
+        if self._task is None:
+            return False
+
+        now = time.monotonic()
+        if now - self._beat_at > self._degraded_after + self._interval:
+            # Stuck right now, for longer than would be tolerated.
+            return True
+        since = self._lagging_since
+        return since is not None and now - since >= self._degraded_after
+
+    def _record(self, lag: float) -> None:
+        self._lags.append(lag)
+        LOOP_LAG.observe(lag)
+
+        if lag > self._degraded_lag:
+            if self._lagging_since is None:
+                self._lagging_since = time.monotonic() - lag
+        else:
+            self._lagging_since = None
+
+        stall = self._stall
+        if stall is not None:
+            self._stall = None
+            stall["duration"] = lag
+            logger.warning("The event loop was blocked for %.3fs", lag)
+
+        self._beats += 1
+        self._beat_at = time.monotonic()
+
+    async def _probe(self) -> None:
+        while True:
+            expected = self._loop.time() + self._interval
+            await asyncio.sleep(self._interval)
+            self._record(max(0.0, self._loop.time() - expected))
+
+    def _capture(self) -> None:
+        """Capture the stack of the loop's thread while it is blocked."""
+        frame = sys._current_frames().get(self._loop_thread)
+        stack = "".join(traceback.format_stack(frame)) if frame else ""
+        self._stall = {"at": time.time(), "duration": None, "stack": stack}
+        self.stalls.append(self._stall)
+        self.stall_count += 1
+        # Logged from here, so a loop that never recovers is still reported.
+        logger.warning(
+            "The event loop has been blocked for %.3fs by:\n%s",
+            time.monotonic() - self._beat_at,
+            stack,
+        )
+
+    def _watch(self) -> None:
+        poll = max(self._slow_threshold / 4, 0.001)
+        while not self._stopping.wait(poll):
+            beats = self._beats
+            blocked = time.monotonic() - self._beat_at
+            # Capture each stall once, while it is still going on.
+            if (
+                blocked > self._interval + self._slow_threshold
+                and beats != self._stalled_beat
+            ):
+                self._stalled_beat = beats
+                self._capture()
+
+    def start(self) -> None:
+        """Start probing, from the loop's thread."""
+        if self._task is not None:
+            return
+
+        self._loop_thread = threading.get_ident()
+        self._beat_at = time.monotonic()
+        self._stopping.clear()
+        self._task = asyncio.ensure_future(self._probe(), loop=self._loop)
+        self._watchdog = threading.Thread(
+            target=self._watch, name="loop-watchdog", daemon=True
+        )
+        self._watchdog.start()
+
+    async def close(self) -> None:
+        if self._task is None:
+            return
+
+        self._stopping.set()
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        self._watchdog.join()
+        self._watchdog = None
+
+    def stats(self) -> Mapping:
+        """Lag percentiles over the recent probes, and the recent stalls."""
+        lags = sorted(self._lags)
+        stalls: List[Mapping] = [dict(stall) for stall in self.stalls]
+        return {
+            "degraded": self.degraded,
+            "p50_lag": _percentile(lags, 50),
+            "p99_lag": _percentile(lags, 99),
+            "max_lag": lags[-1] if lags else 0.0,
+            "stalls": self.stall_count,
+            "recent_stalls": stalls,
+        }
@@ -0,0 +1,279 @@
+"""
+Metrics about the service, served at /metrics in the Prometheus text format.
+
+Counters, gauges and histograms with fixed buckets are plain objects updated in
+place, so an observation costs a few hundred nanoseconds. Histograms keep a
+count per bucket and only add them up when scraped. Gauges of things that are
+cheap to count, like queue depths, are set when scraped instead of on every
+change.
+
+The metrics of the call pipeline are defined here, in the default REGISTRY.
+Each process has its own registry, so with several workers a scrape sees the
+worker it reached.
+"""
+
+import bisect
+import math
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+NAMESPACE = "{{cookiecutter.app_name}}"
+
+# Buckets in seconds for the latency of requests to us and to the APIs we use.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Buckets in seconds for how late scheduled calls are dispatched.
+LATENESS_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0)
+
+# Label values past this many series are counted under OTHER, so a label taken
+# from a request can't grow a metric without bound.
+MAX_SERIES = 100
+OTHER = "other"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _format_labels(pairs: Sequence[Tuple[str, str]]) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Metric:
+    """A named metric, and its series for each combination of label values.
+
+    A metric without labels is its own only series.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._series: Dict[Tuple[str, ...], "Metric"] = {}
+
+    def _new_series(self) -> "Metric":
+        raise NotImplementedError
+
+    def labels(self, *values: str) -> "Metric":
+        """The series for the given label values."""
+        series = self._series.get(values)
+        if series is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}")
+            if len(self._series) >= MAX_SERIES:
+                values = (OTHER,) * len(values)
+                series = self._series.get(values)
+            if series is None:
+                series = self._series[values] = self._new_series()
+        return series
+
+    def series(self) -> Iterator[Tuple[Tuple[str, ...], "Metric"]]:
+        if not self.labelnames:
+            yield (), self
+        else:
+            yield from sorted(self._series.items())
+
+    def samples(
+        self, labels: List[Tuple[str, str]]
+    ) -> Iterator[Tuple[str, List[Tuple[str, str]], float]]:
+        """The (suffix, labels, value) samples of one series."""
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """A count that only goes up."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self.value = 0.0
+
+    def _new_series(self) -> "Counter":
+        return Counter(self.name, self.help)
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def samples(self, labels):
+        yield "_total", labels, self.value
+
+
+class Gauge(Metric):
+    """A value that goes up and down."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self.value = 0.0
+
+    def _new_series(self) -> "Gauge":
+        return Gauge(self.name, self.help)
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+    def samples(self, labels):
+        yield "", labels, self.value
+
+
+class Histogram(Metric):
+    """Counts observations into buckets by their upper bounds."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, help_text, labelnames)
+        self._bounds = sorted(buckets)
+        # The last count is for observations above every bound.
+        self._counts = [0] * (len(self._bounds) + 1)
+        self.sum = 0.0
+
+    def _new_series(self) -> "Histogram":
+        return Histogram(self.name, self.help, buckets=self._bounds)
+
+    def observe(self, value: float) -> None:
+        self._counts[bisect.bisect_left(self._bounds, value)] += 1
+        self.sum += value
+
+    @property
+    def count(self) -> int:
+        return sum(self._counts)
+
+    def buckets(self) -> List[Tuple[float, int]]:
+        """The (upper bound, count) of each bucket, not added up."""
+        return list(zip(self._bounds + [math.inf], self._counts))
+
+    def samples(self, labels):
+        total = 0
+        for bound, count in self.buckets():
+            total += count
+            yield "_bucket", labels + [("le", _format_value(float(bound)))], total
+        yield "_sum", labels, self.sum
+        yield "_count", labels, total
+
+
+class Registry:
+    """The metrics served by a process."""
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"A metric named {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames=()) -> Counter:
+        return self.register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name: str, help_text: str, labelnames=()) -> Gauge:
+        return self.register(Gauge(name, help_text, labelnames))
+
+    def histogram(
+        self, name: str, help_text: str, labelnames=(), buckets=LATENCY_BUCKETS
+    ) -> Histogram:
+        return self.register(Histogram(name, help_text, labelnames, buckets))
+
+    def get(self, name: str) -> Optional[Metric]:
+        return self._metrics.get(name)
+
+    def __iter__(self) -> Iterator[Metric]:
+        return iter(list(self._metrics.values()))
+
+    def expose(self) -> str:
+        """Every metric in the Prometheus text exposition format."""
+        lines = []
+        for metric in self:
+            lines.append(f"# HELP {metric.name} {_escape(metric.help)}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for values, series in metric.series():
+                labels = list(zip(metric.labelnames, values))
+                for suffix, pairs, value in series.samples(labels):
+                    lines.append(
+                        f"{metric.name}{suffix}{_format_labels(pairs)} "
+                        f"{_format_value(value)}"
+                    )
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    f"{NAMESPACE}_http_request_duration_seconds",
+    "Time taken to handle HTTP requests, by route.",
+    ("method", "route", "status"),
+)
+
+SCHEDULER_PENDING = REGISTRY.gauge(
+    f"{NAMESPACE}_scheduler_pending_calls", "Calls waiting to be dispatched."
+)
+
+DISPATCH_LATENESS = REGISTRY.histogram(
+    f"{NAMESPACE}_dispatch_lateness_seconds",
+    "How long after their scheduled time calls were handed to a dial worker.",
+    buckets=LATENESS_BUCKETS,
+)
+
+DIAL_SECONDS = REGISTRY.histogram(
+    f"{NAMESPACE}_dial_duration_seconds",
+    "Time taken to dial a call, including waiting for the rate limits.",
+)
+
+DIAL_ERRORS = REGISTRY.counter(f"{NAMESPACE}_dial_errors", "Calls that failed to dial.")
+
+WEBHOOKS_PENDING = REGISTRY.gauge(
+    f"{NAMESPACE}_webhooks_pending", "Webhooks waiting for a worker."
+)
+
+WEBHOOK_SECONDS = REGISTRY.histogram(
+    f"{NAMESPACE}_webhook_duration_seconds",
+    "Time taken to process webhooks, by event type.",
+    ("event_type",),
+)
+
+WEBHOOK_ERRORS = REGISTRY.counter(
+    f"{NAMESPACE}_webhook_errors",
+    "Webhooks that failed to be processed, by event type.",
+    ("event_type",),
+)
+
+JOKE_FETCH_SECONDS = REGISTRY.histogram(
+    f"{NAMESPACE}_joke_fetch_duration_seconds",
+    "Time taken to fetch a joke from the joke API.",
+)
+
+JOKE_FETCH_ERRORS = REGISTRY.counter(
+    f"{NAMESPACE}_joke_fetch_errors", "Joke fetches that failed."
+)
+
+LOOP_LAG = REGISTRY.histogram(
+    f"{NAMESPACE}_event_loop_lag_seconds",
+    "How late the event loop ran a callback scheduled by the loop monitor.",
+    buckets=LATENESS_BUCKETS,
+)
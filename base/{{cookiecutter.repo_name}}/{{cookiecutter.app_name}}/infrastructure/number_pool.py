@@ -0,0 +1,174 @@
+"""
+The pool of source numbers and connections calls are dialled from.
+
+Each source number has its own calls per second limit with the carrier, so
+dial throughput grows with the number of routes in the pool. Calls are spread
+over the routes by load, and routes whose dials keep failing are taken out of
+rotation for a while.
+"""
+
+import time
+from operator import attrgetter
+from typing import Hashable, List, Mapping, Optional, Sequence
+
+import attr
+
+from {{cookiecutter.app_name}}.infrastructure.cache import TTLMap
+
+LEAST_LOADED = "least_loaded"
+ROUND_ROBIN = "round_robin"
+
+
+@attr.s(slots=True, cmp=False)
+class Route:
+    """A source number and the connection it dials through"""
+
+    connection_id = attr.ib()
+    src_number = attr.ib()
+    in_flight = attr.ib(default=0)
+    dials = attr.ib(default=0)
+    errors = attr.ib(default=0)
+    consecutive_errors = attr.ib(default=0)
+    # time.monotonic() until which the route is out of rotation.
+    quarantined_until = attr.ib(default=0.0)
+
+    def as_dict(self, now: float) -> Mapping:
+        return {
+            "connection_id": self.connection_id,
+            "src_number": self.src_number,
+            "in_flight": self.in_flight,
+            "dials": self.dials,
+            "errors": self.errors,
+            "quarantined": self.quarantined_until > now,
+        }
+
+
+class RoutePool:
+    """Chooses the route each call is dialled from.
+
+    With the ``least_loaded`` strategy, the route with the fewest calls in
+    flight is chosen, ties going round robin; with ``round_robin``, routes are
+    used in turn. A call is in flight from the dial until it hangs up, or for
+    at most ``call_ttl`` seconds if its hangup is never seen.
+
+    After ``error_threshold`` failed dials in a row, a route is quarantined for
+    ``quarantine_seconds``. It is then tried again, and quarantined again on
+    the next failure unless a dial succeeds. If every route is quarantined,
+    calls go to the one due back soonest rather than being dropped.
+    """
+
+    def __init__(
+        self,
+        routes: Sequence[Route],
+        strategy: str = LEAST_LOADED,
+        error_threshold: int = 3,
+        quarantine_seconds: float = 60,
+        call_ttl: float = 3600,
+        max_calls: int = 200000,
+    ) -> None:
+        if not routes:
+            raise ValueError("At least one route is required.")
+        if strategy not in (LEAST_LOADED, ROUND_ROBIN):
+            raise ValueError(f"Unknown route selection strategy: {strategy}")
+
+        self._routes: List[Route] = list(routes)
+        self._strategy = strategy
+        self._error_threshold = max(1, error_threshold)
+        self._quarantine_seconds = quarantine_seconds
+        self._cursor = 0
+        # The route of each call in flight, by call control id.
+        self._calls = TTLMap(call_ttl, max_calls, on_evict=self._call_expired)
+
+        self.quarantines = 0
+
+    @classmethod
+    def from_config(
+        cls, conf: Mapping, connection_id: str, src_number: str
+    ) -> "RoutePool":
+        """Build the pool from the ``outbound_routes`` config.
+
+        Routes without a ``connection_id`` use the default one, and without
+        any routes the pool holds just the default source number.
+        """
+        routes = [
+            Route(route.get("connection_id", connection_id), route["src_number"])
+            for route in conf.get("routes", [])
+        ] or [Route(connection_id, src_number)]
+        return cls(
+            routes,
+            strategy=conf.get("strategy", LEAST_LOADED),
+            error_threshold=conf.get("error_threshold", 3),
+            quarantine_seconds=conf.get("quarantine_seconds", 60),
+            call_ttl=conf.get("call_ttl", 3600),
+        )
+
+    def __len__(self) -> int:
+        return len(self._routes)
+
+    @property
+    def routes(self) -> List[Route]:
+        return list(self._routes)
+
+    def _next_start(self, n: int) -> int:
+        start = self._cursor % n
+        self._cursor = start + 1
+        return start
+
+    def choose(self) -> Route:
+        """Choose the route for the next call, counting it as in flight."""
+        now = time.monotonic()
+        healthy = [route for route in self._routes if route.quarantined_until <= now]
+
+        if not healthy:
+            route = min(self._routes, key=attrgetter("quarantined_until"))
+        elif self._strategy == ROUND_ROBIN:
+            route = healthy[self._next_start(len(healthy))]
+        else:
+            # Start the scan at a rotating offset, so ties are spread evenly.
+            start = self._next_start(len(healthy))
+            route = min(healthy[start:] + healthy[:start], key=attrgetter("in_flight"))
+
+        route.in_flight += 1
+        route.dials += 1
+        return route
+
+    def dialled(self, route: Route, call_control_id: Optional[Hashable]) -> None:
+        """Record that a call was placed, keeping it in flight until it hangs up."""
+        route.consecutive_errors = 0
+        if call_control_id is None:
+            # Without an id, the hangup can not be matched to the route.
+            self.release(route)
+            return
+        self._calls.set(call_control_id, route)
+
+    def release(self, route: Route) -> None:
+        """Stop counting a call that was abandoned before it was placed."""
+        route.in_flight -= 1
+
+    def failed(self, route: Route) -> None:
+        """Record that a call could not be placed from the route."""
+        self.release(route)
+        route.errors += 1
+        route.consecutive_errors += 1
+        if route.consecutive_errors >= self._error_threshold:
+            route.quarantined_until = time.monotonic() + self._quarantine_seconds
+            self.quarantines += 1
+
+    def finished(self, call_control_id: Hashable) -> None:
+        """Record that a call hung up."""
+        route = self._calls.pop(call_control_id)
+        if route is not None:
+            route.in_flight -= 1
+
+    def _call_expired(self, _call_control_id: Hashable, route: Route) -> None:
+        route.in_flight -= 1
+
+    def stats(self) -> Mapping:
+        self._calls.purge()
+        now = time.monotonic()
+        return {
+            "strategy": self._strategy,
+            "in_flight": len(self._calls),
+            "quarantines": self.quarantines,
+            "routes": [route.as_dict(now) for route in self._routes],
+        }
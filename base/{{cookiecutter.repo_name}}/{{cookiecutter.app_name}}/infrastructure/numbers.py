@@ -0,0 +1,135 @@
+"""
+Normalising the phone numbers calls are scheduled to.
+
+Numbers are parsed once, when the call is scheduled, and kept as E.164 strings
+from then on. Parsing is pure Python and slow, so the results are cached, and
+large batches are parsed on a pool of processes rather than the event loop.
+"""
+
+import asyncio
+import concurrent.futures
+import logging
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterable, List, Optional
+
+import phonenumbers
+
+from {{cookiecutter.app_name}}.infrastructure.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidNumber(ValueError):
+    """A phone number that could not be parsed."""
+
+
+def to_e164(raw: str) -> str:
+    """Parse a phone number and format it as E.164."""
+    try:
+        number = phonenumbers.parse(raw)
+    except phonenumbers.NumberParseException as e:
+        raise InvalidNumber(str(e)) from None
+    return phonenumbers.format_number(number, phonenumbers.PhoneNumberFormat.E164)
+
+
+def to_e164_many(raws: List[str]) -> List[Optional[str]]:
+    """to_e164 for each number, with None for the invalid ones."""
+    results: List[Optional[str]] = []
+    for raw in raws:
+        try:
+            results.append(to_e164(raw))
+        except InvalidNumber:
+            results.append(None)
+    return results
+
+
+class NumberNormaliser:
+    """Turns the numbers entered by users into E.164 strings.
+
+    The last ``cache_size`` results are cached. Batches with at least
+    ``pool_threshold`` uncached numbers are split into chunks of
+    ``chunk_size`` and parsed on a pool of ``processes`` processes, one per
+    core by default, which is started when first needed.
+    """
+
+    def __init__(
+        self,
+        cache_size: int = 100000,
+        pool_threshold: int = 1000,
+        chunk_size: int = 1000,
+        processes: Optional[int] = None,
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+    ) -> None:
+        self._cache = LRUCache(cache_size)
+        self._pool_threshold = pool_threshold
+        self._chunk_size = max(1, chunk_size)
+        self._processes = processes or None
+        self._loop = loop or asyncio.get_event_loop()
+        self._executor: Optional[concurrent.futures.ProcessPoolExecutor] = None
+
+        self.pooled = 0
+
+    def normalise(self, raw: str) -> str:
+        """Return the E.164 form of a number, raising InvalidNumber if it has none."""
+        e164 = self._cache.get(raw)
+        if e164 is None:
+            e164 = to_e164(raw)
+            self._cache.set(raw, e164)
+        return e164
+
+    async def normalise_many(self, raws: Iterable[str]) -> List[Optional[str]]:
+        """Return the E.164 form of each number, or None for the invalid ones."""
+        raws = list(raws)
+        found: Dict[str, Optional[str]] = {}
+        for raw in raws:
+            if raw not in found:
+                found[raw] = self._cache.get(raw)
+        missing = [raw for raw, e164 in found.items() if e164 is None]
+
+        if len(missing) >= self._pool_threshold:
+            parsed = await self._parse_on_pool(missing)
+        else:
+            parsed = to_e164_many(missing)
+
+        for raw, e164 in zip(missing, parsed):
+            found[raw] = e164
+            if e164 is not None:
+                self._cache.set(raw, e164)
+        return [found[raw] for raw in raws]
+
+    async def _parse_on_pool(self, raws: List[str]) -> List[Optional[str]]:
+        if self._executor is None:
+            self._executor = concurrent.futures.ProcessPoolExecutor(self._processes)
+
+        chunks = [
+            raws[start : start + self._chunk_size]
+            for start in range(0, len(raws), self._chunk_size)
+        ]
+        try:
+            results = await asyncio.gather(
+                *(
+                    self._loop.run_in_executor(self._executor, to_e164_many, chunk)
+                    for chunk in chunks
+                )
+            )
+        except BrokenProcessPool:
+            # A worker died, start a new pool next time and parse these here.
+            logger.exception("The number parsing pool broke")
+            self._executor = None
+            return to_e164_many(raws)
+
+        self.pooled += len(raws)
+        return [e164 for chunk in results for e164 in chunk]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "cached": len(self._cache),
+            "hits": self._cache.hits,
+            "misses": self._cache.misses,
+            "pooled": self.pooled,
+        }
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
@@ -0,0 +1,248 @@
+"""
+Durable storage for the call scheduler.
+
+Every put, dispatch and cancel is appended to a binary write-ahead log, which is
+written and fsynced in batches from a background task. Once the log grows past
+a threshold it is compacted into a snapshot of the pending items. On startup the
+snapshot is memory-mapped and bulk loaded, and the log is replayed on top of it.
+"""
+
+import asyncio
+import logging
+import mmap
+import os
+import struct
+import zlib
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+OP_PUT = 1
+OP_DISPATCH = 2
+OP_CANCEL = 3
+
+# Log record: crc32 of the rest of the record, then op, handle, ts and payload size.
+LOG_CRC = struct.Struct("<I")
+LOG_RECORD = struct.Struct("<BQdH")
+
+# Snapshot: magic, then the item count and next free handle, then the items.
+SNAPSHOT_MAGIC = b"DAJ1"
+SNAPSHOT_HEADER = struct.Struct("<4sQQ")
+SNAPSHOT_RECORD = struct.Struct("<QdH")
+
+LOG_FILE = "scheduler.log"
+SNAPSHOT_FILE = "scheduler.snapshot"
+
+# A recovered item: (ts, msg, handle)
+Entry = Tuple[float, Any, int]
+
+
+class SchedulerJournal:
+    """Append-only log of scheduler changes, compacted into snapshots.
+
+    ``encode`` and ``decode`` convert the scheduled messages to and from strings.
+    Records are buffered in memory and written with one write and one fsync
+    every ``flush_interval`` seconds, so a crash loses at most that much.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        *,
+        encode: Callable[[Any], str] = str,
+        decode: Callable[[str], Any] = str,
+        flush_interval: float = 0.05,
+        compact_bytes: int = 64 * 1024 * 1024,
+        loop: asyncio.AbstractEventLoop = None,
+    ) -> None:
+        self._directory = Path(directory)
+        self._log_path = self._directory / LOG_FILE
+        self._snapshot_path = self._directory / SNAPSHOT_FILE
+        self._encode = encode
+        self._decode = decode
+        self._flush_interval = flush_interval
+        self._compact_bytes = compact_bytes
+        self._loop = loop or asyncio.get_event_loop()
+
+        self._buffer = bytearray()
+        self._log = None
+        self._log_size = 0
+        self._next_handle = 1
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Future[None]] = None
+        self._snapshot_source: Optional[Callable[[], Iterable[Any]]] = None
+
+    # Recovery
+
+    def _load_snapshot(self, entries: Dict[int, Entry]) -> None:
+        """Bulk load the snapshot through a memory map."""
+        if not self._snapshot_path.exists():
+            return
+
+        with open(self._snapshot_path, "rb") as f:
+            if os.fstat(f.fileno()).st_size < SNAPSHOT_HEADER.size:
+                return
+
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                magic, count, next_handle = SNAPSHOT_HEADER.unpack_from(data, 0)
+                if magic != SNAPSHOT_MAGIC:
+                    raise ValueError(f"{self._snapshot_path} is not a snapshot")
+
+                decode = self._decode
+                unpack_from = SNAPSHOT_RECORD.unpack_from
+                record_size = SNAPSHOT_RECORD.size
+                offset = SNAPSHOT_HEADER.size
+                for _ in range(count):
+                    handle, ts, size = unpack_from(data, offset)
+                    offset += record_size
+                    msg = decode(data[offset : offset + size].decode())
+                    offset += size
+                    entries[handle] = (ts, msg, handle)
+
+        self._next_handle = max(self._next_handle, next_handle)
+
+    def _replay_log(self, entries: Dict[int, Entry]) -> None:
+        """Apply the log on top of the snapshot, stopping at a torn tail."""
+        if not self._log_path.exists():
+            return
+
+        with open(self._log_path, "rb") as f:
+            data = f.read()
+
+        offset = 0
+        header_size = LOG_CRC.size + LOG_RECORD.size
+        while offset + header_size <= len(data):
+            (crc,) = LOG_CRC.unpack_from(data, offset)
+            op, handle, ts, size = LOG_RECORD.unpack_from(data, offset + LOG_CRC.size)
+            end = offset + header_size + size
+            if end > len(data) or zlib.crc32(data[offset + LOG_CRC.size : end]) != crc:
+                logger.warning("Ignoring a torn scheduler log record at %d", offset)
+                break
+
+            if op == OP_PUT:
+                msg = self._decode(data[end - size : end].decode())
+                entries[handle] = (ts, msg, handle)
+            else:
+                entries.pop(handle, None)
+
+            self._next_handle = max(self._next_handle, handle + 1)
+            offset = end
+
+        # Drop a torn tail, so new records are not appended after garbage.
+        if offset != len(data):
+            with open(self._log_path, "r+b") as f:
+                f.truncate(offset)
+        self._log_size = offset
+
+    def recover(self) -> Tuple[List[Entry], int]:
+        """Read back the pending items and the next free handle."""
+        entries: Dict[int, Entry] = {}
+        self._load_snapshot(entries)
+        self._replay_log(entries)
+        return list(entries.values()), self._next_handle
+
+    # Recording
+
+    def _append(self, op: int, handle: int, ts: float, payload: bytes = b"") -> None:
+        """Buffer a record, to be written by the next flush."""
+        body = LOG_RECORD.pack(op, handle, ts, len(payload)) + payload
+        self._buffer += LOG_CRC.pack(zlib.crc32(body))
+        self._buffer += body
+
+    def record_put(self, handle: int, ts: float, msg: Any) -> None:
+        """Record a new or rescheduled item."""
+        self._append(OP_PUT, handle, ts, self._encode(msg).encode())
+        self._next_handle = max(self._next_handle, handle + 1)
+
+    def record_dispatch(self, handle: int) -> None:
+        """Record that an item was handed to the dial workers."""
+        self._append(OP_DISPATCH, handle, 0.0)
+
+    def record_cancel(self, handle: int) -> None:
+        """Record that an item was cancelled."""
+        self._append(OP_CANCEL, handle, 0.0)
+
+    # Writing
+
+    def start(self, snapshot_source: Callable[[], Iterable[Any]]) -> None:
+        """Start flushing in the background.
+
+        ``snapshot_source`` returns the pending QueuedMessages when compacting.
+        """
+        self._directory.mkdir(parents=True, exist_ok=True)
+        self._log = open(self._log_path, "ab")
+        self._snapshot_source = snapshot_source
+        self._task = asyncio.ensure_future(self._run(), loop=self._loop)
+
+    async def _run(self) -> None:
+        """Flush the buffer periodically, compacting when the log is too big."""
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            try:
+                await self.flush()
+                if self._log_size >= self._compact_bytes:
+                    await self.compact()
+            except Exception:
+                logger.exception("Failed to write the scheduler journal")
+
+    def _write(self, data: bytes) -> None:
+        """Append to the log and fsync it. Runs in the executor."""
+        self._log.write(data)
+        self._log.flush()
+        os.fsync(self._log.fileno())
+
+    async def flush(self) -> None:
+        """Write and fsync everything buffered so far."""
+        async with self._lock:
+            if not self._buffer:
+                return
+
+            data = bytes(self._buffer)
+            self._buffer.clear()
+            await self._loop.run_in_executor(None, self._write, data)
+            self._log_size += len(data)
+
+    def _write_snapshot(self, items: List[Any], next_handle: int) -> None:
+        """Write a new snapshot and empty the log. Runs in the executor."""
+        tmp_path = self._snapshot_path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(items), next_handle))
+            pack = SNAPSHOT_RECORD.pack
+            encode = self._encode
+            for qm in items:
+                payload = encode(qm.msg).encode()
+                f.write(pack(qm.handle, qm.ts, len(payload)))
+                f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(str(tmp_path), str(self._snapshot_path))
+
+        # The snapshot covers everything in the log.
+        self._log.flush()
+        os.ftruncate(self._log.fileno(), 0)
+        os.fsync(self._log.fileno())
+
+    async def compact(self) -> None:
+        """Replace the log with a snapshot of the pending items."""
+        async with self._lock:
+            # Anything still buffered is already reflected in the pending items.
+            items = list(self._snapshot_source())
+            self._buffer.clear()
+            await self._loop.run_in_executor(
+                None, self._write_snapshot, items, self._next_handle
+            )
+            self._log_size = 0
+
+    async def close(self) -> None:
+        """Stop the background task and write out what is left."""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+        if self._log:
+            await self.flush()
+            self._log.close()
+            self._log = None
@@ -0,0 +1,176 @@
+"""
+Profiling the live process, for a few seconds at a time.
+
+Everything the service does runs on the event loop's thread, so that is the
+thread profiled:
+
+- ``profile`` runs cProfile for a while and returns its pstats report. It
+  counts every call, which slows the loop down while it runs.
+- ``sample`` reads the loop thread's stack from another thread every few
+  milliseconds instead, and returns how often each stack was seen in the
+  collapsed format that flamegraph.pl and speedscope read. The loop barely
+  notices.
+- ``memory_growth`` traces allocations with tracemalloc for a while and
+  returns where the memory still held at the end was allocated.
+
+Only one session runs at a time. Each process profiles itself, so with several
+workers a request profiles the worker it reached.
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import cProfile
+import hmac
+import io
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Counter, Mapping, Optional
+
+# Header carrying the token that allows running a session.
+TOKEN_HEADER = "X-Diagnostics-Token"
+
+PSTATS_SORT_KEYS = tuple(pstats.Stats.sort_arg_dict_default)
+MEMORY_GROUPS = ("lineno", "filename", "traceback")
+
+
+class ProfilerBusy(Exception):
+    """Raised when a session is asked for while another one is running."""
+
+
+def _collapse(frame) -> str:
+    """A stack as its functions from the outermost in, separated by semicolons."""
+    names = []
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "?")
+        names.append(f"{module}:{frame.f_code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class Profiler:
+    """Runs profiling sessions on the process, for requests carrying ``token``.
+
+    No request is allowed when the token is empty. Sessions are meant to last
+    at most ``max_seconds``, and stacks are sampled every ``sample_interval``
+    seconds.
+    """
+
+    def __init__(
+        self,
+        token: str,
+        *,
+        max_seconds: float = 60.0,
+        sample_interval: float = 0.005,
+        loop: asyncio.AbstractEventLoop = None,
+    ) -> None:
+        self._token = token
+        self.max_seconds = max_seconds
+        self._sample_interval = sample_interval
+        self._loop = loop or asyncio.get_event_loop()
+        self._executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self._running: Optional[str] = None
+        self.sessions = 0
+
+    def authorized(self, token: Optional[str]) -> bool:
+        """Whether a request carries the token."""
+        return bool(self._token) and hmac.compare_digest(self._token, token or "")
+
+    def _begin(self, kind: str) -> None:
+        if self._running is not None:
+            raise ProfilerBusy(f"A {self._running} session is already running")
+        self._running = kind
+        self.sessions += 1
+
+    async def profile(
+        self, seconds: float, sort: str = "cumulative", limit: int = 50
+    ) -> str:
+        """Run cProfile for ``seconds``, returning the ``limit`` top functions."""
+        self._begin("profile")
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                profile.disable()
+        finally:
+            self._running = None
+
+        out = io.StringIO()
+        stats = pstats.Stats(profile, stream=out)
+        stats.sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+    def _sample(self, thread_id: int, seconds: float) -> Counter[str]:
+        stacks: Counter[str] = collections.Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(thread_id)
+            if frame is not None:
+                stacks[_collapse(frame)] += 1
+            del frame
+            time.sleep(self._sample_interval)
+        return stacks
+
+    async def sample(self, seconds: float) -> str:
+        """Sample the loop's stack for ``seconds``, as collapsed stacks."""
+        self._begin("sample")
+        try:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(1)
+            stacks = await self._loop.run_in_executor(
+                self._executor, self._sample, threading.get_ident(), seconds
+            )
+        finally:
+            self._running = None
+
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+    async def memory_growth(
+        self, seconds: float, group_by: str = "lineno", limit: int = 50
+    ) -> str:
+        """Trace allocations for ``seconds``, returning where memory grew most.
+
+        Tracing stops again afterwards, unless it was already on.
+        """
+        self._begin("memory")
+        # Tracebacks need more than the one frame traced by default
+        frames = 25 if group_by == "traceback" else 1
+        started = not tracemalloc.is_tracing()
+        try:
+            if started:
+                tracemalloc.start(frames)
+            before = tracemalloc.take_snapshot()
+            await asyncio.sleep(seconds)
+            after = tracemalloc.take_snapshot()
+        finally:
+            if started:
+                tracemalloc.stop()
+            self._running = None
+
+        ignored = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        differences = after.filter_traces(ignored).compare_to(
+            before.filter_traces(ignored), group_by
+        )
+        growth = sum(stat.size_diff for stat in differences)
+        lines = [
+            f"{growth / 1024:.1f} KiB more held after {seconds}s, "
+            f"top {min(limit, len(differences))} of {len(differences)}:"
+        ]
+        for stat in differences[:limit]:
+            lines.append(str(stat))
+            if group_by == "traceback":
+                lines.extend(stat.traceback.format())
+        return "\n".join(lines) + "\n"
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def stats(self) -> Mapping:
+        return {"running": self._running, "sessions": self.sessions}
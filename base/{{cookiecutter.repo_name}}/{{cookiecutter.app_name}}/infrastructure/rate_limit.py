@@ -0,0 +1,191 @@
+"""
+Outbound call rate limiting.
+
+Carriers limit the calls per second (CPS) placed on a connection and from a
+source number. The DialRateLimiter paces the dials so those limits are never
+exceeded, and the SlotAllocator books scheduled calls into per-second slots so
+that bursts are spread out before they are due rather than when dialled.
+"""
+
+import asyncio
+import math
+import time
+from typing import Dict, Hashable, Mapping, Optional
+
+
+class TokenBucket:
+    """Allows ``rate`` events per second on average, and bursts of up to ``burst``.
+
+    ``reserve`` always takes a token, letting the bucket go into debt, and
+    returns how long the caller has to wait before using it. Callers are
+    served in the order they reserved.
+    """
+
+    def __init__(self, rate: float, burst: float = 1) -> None:
+        self._rate = rate
+        self._burst = max(1, burst)
+        self._tokens = self._burst
+        self._updated = time.monotonic()
+
+    def reserve(self) -> float:
+        """Take a token, returning the seconds to wait until it is available."""
+        now = time.monotonic()
+        self._tokens = min(
+            self._burst, self._tokens + (now - self._updated) * self._rate
+        )
+        self._updated = now
+
+        self._tokens -= 1
+        if self._tokens >= 0:
+            return 0.0
+        return -self._tokens / self._rate
+
+
+class DialRateLimiter:
+    """Paces dials per connection and per source number.
+
+    Each connection id gets its own bucket of ``connection_cps`` calls per
+    second with bursts of ``connection_burst``, and each source number its own
+    of ``number_cps`` and ``number_burst``. A rate of 0 leaves that limit off.
+    """
+
+    def __init__(
+        self,
+        connection_cps: float = 0,
+        connection_burst: float = 1,
+        number_cps: float = 0,
+        number_burst: float = 1,
+    ) -> None:
+        self._connection_cps = connection_cps
+        self._connection_burst = connection_burst
+        self._number_cps = number_cps
+        self._number_burst = number_burst
+        self._buckets: Dict[Hashable, TokenBucket] = {}
+
+        self.dials = 0
+        self.delayed = 0
+        self.total_delay = 0.0
+
+    def _bucket(self, key: Hashable, rate: float, burst: float) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(rate, burst)
+        return bucket
+
+    def reserve(self, connection_id: str, src_number: str) -> float:
+        """Reserve a dial, returning the seconds to wait before dialling."""
+        delay = 0.0
+        if self._connection_cps:
+            bucket = self._bucket(
+                ("connection", connection_id),
+                self._connection_cps,
+                self._connection_burst,
+            )
+            delay = bucket.reserve()
+        if self._number_cps:
+            bucket = self._bucket(
+                ("number", src_number), self._number_cps, self._number_burst
+            )
+            delay = max(delay, bucket.reserve())
+
+        self.dials += 1
+        if delay:
+            self.delayed += 1
+            self.total_delay += delay
+        return delay
+
+    async def acquire(self, connection_id: str, src_number: str) -> None:
+        """Wait until a dial is allowed."""
+        delay = self.reserve(connection_id, src_number)
+        if delay:
+            await asyncio.sleep(delay)
+
+    def stats(self) -> Mapping:
+        return {
+            "dials": self.dials,
+            "delayed": self.delayed,
+            "mean_delay": self.total_delay / self.dials if self.dials else 0.0,
+        }
+
+
+class SlotAllocator:
+    """Books scheduled calls into slots of ``slot_seconds``, each holding up to
+    ``cps * slot_seconds`` calls.
+
+    A call is booked into the slot of its timestamp, or the first later slot
+    with room left, and is then due at the later of its timestamp and the start
+    of that slot. Runs of full slots are skipped with path compression, so
+    booking stays cheap however long the run.
+    """
+
+    def __init__(self, cps: float, slot_seconds: float = 1.0) -> None:
+        self._slot_seconds = slot_seconds
+        self._capacity = max(1, math.floor(cps * slot_seconds))
+        self._counts: Dict[int, int] = {}
+        # Maps a full slot to a later slot that may have room.
+        self._next: Dict[int, int] = {}
+        self._bookings = 0
+
+    def _slot(self, ts: float) -> int:
+        return math.floor(ts / self._slot_seconds)
+
+    def _find(self, slot: int) -> int:
+        """The first slot at or after the given one with room left."""
+        path = []
+        while self._counts.get(slot, 0) >= self._capacity:
+            path.append(slot)
+            slot = self._next.get(slot, slot + 1)
+        for full in path:
+            self._next[full] = slot
+        return slot
+
+    def allocate(self, ts: float) -> float:
+        """Book a call due at ts, returning when it will actually be due."""
+        self._prune()
+
+        slot = self._find(self._slot(ts))
+        self._counts[slot] = self._counts.get(slot, 0) + 1
+        return max(ts, slot * self._slot_seconds)
+
+    def occupy(self, ts: float) -> None:
+        """Count an already booked call, such as one recovered after a restart."""
+        slot = self._slot(ts)
+        self._counts[slot] = self._counts.get(slot, 0) + 1
+
+    def release(self, ts: float) -> None:
+        """Give back the booking of a call that was cancelled or moved."""
+        slot = self._slot(ts)
+        count = self._counts.get(slot, 0)
+        if not count:
+            return
+
+        if count >= self._capacity:
+            # Skips may lead past the slot that now has room, rebuild them lazily.
+            self._next.clear()
+        if count == 1:
+            del self._counts[slot]
+        else:
+            self._counts[slot] = count - 1
+
+    def next_available(self, ts: float) -> float:
+        """When a call booked now for ts would be due, without booking it."""
+        slot = self._find(self._slot(ts))
+        return max(ts, slot * self._slot_seconds)
+
+    def _prune(self) -> None:
+        """Every so often, forget the slots that are in the past."""
+        self._bookings += 1
+        if self._bookings % 1024:
+            return
+
+        now_slot = self._slot(time.time())
+        for slot in [slot for slot in self._counts if slot < now_slot]:
+            del self._counts[slot]
+        for slot in [slot for slot in self._next if slot < now_slot]:
+            del self._next[slot]
+
+    def booked(self, ts: Optional[float] = None) -> int:
+        """Number of calls booked in the slot of ts, or in every slot."""
+        if ts is None:
+            return sum(self._counts.values())
+        return self._counts.get(self._slot(ts), 0)
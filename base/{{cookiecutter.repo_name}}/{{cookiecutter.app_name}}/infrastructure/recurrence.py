@@ -0,0 +1,202 @@
+"""
+Recurring calls.
+
+A recurring call is scheduled once, as a single entry whose message is a
+Recurring: the number to call and the rule it repeats by. When the entry is
+dispatched, the scheduler puts it back for the next occurrence under the same
+handle, so only the next occurrence of each rule is ever queued.
+
+Rules are either intervals, like ``every 1d``, or cron expressions in local
+time, like ``0 9 * * 1-5`` or ``@daily``.
+"""
+
+import datetime
+import json
+import math
+import re
+from typing import Any, FrozenSet, List, Optional
+
+import attr
+
+# Intervals shorter than this are refused, so a rule can't flood the dialler.
+MIN_INTERVAL = 60
+
+_UNITS = {
+    "": 1,
+    "s": 1,
+    "m": 60,
+    "h": 60 * 60,
+    "d": 24 * 60 * 60,
+    "w": 7 * 24 * 60 * 60,
+}
+
+_INTERVAL = re.compile(r"every\s+(\d+(?:\.\d+)?)\s*([smhdw]?)(?:\s+from\s+(\S+))?$")
+
+_ALIASES = {
+    "@hourly": "0 * * * *",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@weekly": "0 0 * * 0",
+    "@monthly": "0 0 1 * *",
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+}
+
+# How far ahead to look for the next match of a cron expression, so that
+# one that can never match (like the 31st of February) gives up.
+_CRON_YEARS = 5
+
+
+class IntervalRule:
+    """Occurrences every ``seconds``, counting from ``anchor``."""
+
+    def __init__(self, seconds: float, anchor: float) -> None:
+        if seconds < MIN_INTERVAL:
+            raise ValueError(f"Intervals must be at least {MIN_INTERVAL} seconds")
+        self.seconds = seconds
+        self.anchor = anchor
+
+    def __str__(self) -> str:
+        return f"every {float(self.seconds)!r}s from {float(self.anchor)!r}"
+
+    def next_after(self, ts: float) -> Optional[float]:
+        """The first occurrence strictly after ts."""
+        if ts < self.anchor:
+            return self.anchor
+        return self.anchor + (math.floor((ts - self.anchor) / self.seconds) + 1) * (
+            self.seconds
+        )
+
+
+def _parse_field(text: str, low: int, high: int) -> FrozenSet[int]:
+    """The values matched by one field of a cron expression."""
+    values = set()
+    for part in text.split(","):
+        step = 1
+        if "/" in part:
+            part, step_text = part.split("/", 1)
+            step = int(step_text)
+            if step < 1:
+                raise ValueError(f"Bad step in {text!r}")
+
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start_text, end_text = part.split("-", 1)
+            start, end = int(start_text), int(end_text)
+        else:
+            start = int(part)
+            end = high if step > 1 else start
+
+        if not low <= start <= end <= high:
+            raise ValueError(f"{text!r} is out of range {low}-{high}")
+        values.update(range(start, end + 1, step))
+    return frozenset(values)
+
+
+class CronRule:
+    """Occurrences at the minutes matching a five field cron expression.
+
+    The fields are minute, hour, day of month, month and day of week, with
+    Sunday as 0 or 7. As in cron, when both days are restricted a day matching
+    either will do.
+    """
+
+    def __init__(self, expression: str) -> None:
+        self.expression = expression.strip()
+        fields = _ALIASES.get(self.expression, self.expression).split()
+        if len(fields) != 5:
+            raise ValueError(f"{expression!r} does not have five fields")
+
+        minutes, hours, days, months, weekdays = fields
+        self._minutes = _parse_field(minutes, 0, 59)
+        self._hours = _parse_field(hours, 0, 23)
+        self._days = _parse_field(days, 1, 31)
+        self._months = _parse_field(months, 1, 12)
+        self._weekdays = frozenset(day % 7 for day in _parse_field(weekdays, 0, 7))
+        self._any_day = days == "*"
+        self._any_weekday = weekdays == "*"
+
+    def __str__(self) -> str:
+        return self.expression
+
+    def _day_matches(self, dt: datetime.datetime) -> bool:
+        in_days = dt.day in self._days
+        # Python counts weekdays from Monday, cron from Sunday.
+        in_weekdays = (dt.weekday() + 1) % 7 in self._weekdays
+        if self._any_day or self._any_weekday:
+            return in_days and in_weekdays
+        return in_days or in_weekdays
+
+    def next_after(self, ts: float) -> Optional[float]:
+        """The first matching minute strictly after ts, or None if there is none."""
+        dt = datetime.datetime.fromtimestamp(ts).replace(second=0, microsecond=0)
+        dt += datetime.timedelta(minutes=1)
+        last_year = dt.year + _CRON_YEARS
+
+        # Skip whole months, days and hours that don't match.
+        while dt.year <= last_year:
+            if dt.month not in self._months:
+                dt = dt.replace(day=1, hour=0, minute=0) + datetime.timedelta(days=32)
+                dt = dt.replace(day=1)
+            elif not self._day_matches(dt):
+                dt = dt.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif dt.hour not in self._hours:
+                dt = dt.replace(minute=0) + datetime.timedelta(hours=1)
+            elif dt.minute not in self._minutes:
+                dt += datetime.timedelta(minutes=1)
+            else:
+                return dt.timestamp()
+        return None
+
+
+def parse_rule(spec: str, start: float):
+    """Parse an interval or cron rule. Intervals count from ``start``."""
+    spec = spec.strip()
+    match = _INTERVAL.match(spec)
+    if match:
+        number, unit, anchor = match.groups()
+        return IntervalRule(
+            float(number) * _UNITS[unit], float(anchor) if anchor else start
+        )
+    return CronRule(spec)
+
+
+@attr.s(slots=True, frozen=True, cmp=False)
+class Recurring:
+    """The message of a recurring call: the item to dial and its rule."""
+
+    item = attr.ib()
+    rule = attr.ib()
+
+    def __str__(self) -> str:
+        return str(self.item)
+
+    def first(self, ts: float) -> Optional[float]:
+        """The first occurrence at or after ts."""
+        return self.rule.next_after(ts - 1e-3)
+
+    def occurrences(self, ts: float, count: int) -> List[float]:
+        """The occurrence at ts and up to count - 1 after it."""
+        found = [ts]
+        while len(found) < count:
+            ts = self.rule.next_after(ts)
+            if ts is None:
+                break
+            found.append(ts)
+        return found
+
+
+def encode_message(msg: Any) -> str:
+    """Turn a scheduled message into a string, keeping the rule of recurring ones."""
+    if isinstance(msg, Recurring):
+        return json.dumps({"item": msg.item, "repeat": str(msg.rule)})
+    return str(msg)
+
+
+def decode_message(text: str) -> Any:
+    """Turn a string from encode_message back into the scheduled message."""
+    if text.startswith("{"):
+        fields = json.loads(text)
+        return Recurring(fields["item"], parse_rule(fields["repeat"], 0.0))
+    return text
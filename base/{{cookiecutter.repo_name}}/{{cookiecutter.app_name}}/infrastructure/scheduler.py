@@ -1,71 +1,316 @@
 import asyncio
+import collections
 import heapq
+import itertools
+import logging
+import math
 import time
-from typing import Any, Callable, List, Mapping, Optional
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+)
 
 import attr
 from aiohttp import ClientSession
 
 from {{cookiecutter.app_name}}.infrastructure.call_control import CallControl
+from {{cookiecutter.app_name}}.infrastructure.events import (
+    DISPATCHED,
+    EventBroadcaster,
+    call_data,
+)
+from {{cookiecutter.app_name}}.infrastructure.metrics import (
+    DIAL_ERRORS,
+    DIAL_SECONDS,
+    DISPATCH_LATENESS,
+)
+from {{cookiecutter.app_name}}.infrastructure.persistence import SchedulerJournal
+from {{cookiecutter.app_name}}.infrastructure.rate_limit import SlotAllocator
+from {{cookiecutter.app_name}}.infrastructure.recurrence import Recurring
 
 _epsilon = 1e-6
 
+# Cancelled entries are left in place until they outnumber the live ones.
+MIN_COMPACTION = 1024
 
-@attr.s(slots=True, frozen=True)
+logger = logging.getLogger(__name__)
+
+
+@attr.s(slots=True, frozen=True, cmp=False)
 class QueuedMessage:
-    """Request with a timestamp"""
+    """Request with a timestamp, and the handle it was scheduled under"""
 
     ts = attr.ib()
     msg = attr.ib()
+    handle = attr.ib(default=0)
 
     # The comparison operators are necessary to determine priority
+    # (cmp=False stops attrs from replacing them with field-by-field comparisons,
+    # which would try to order the messages when timestamps are equal)
+    # Handles increase, so items with the same timestamp keep their insertion order.
     def __lt__(self, other) -> bool:
-        return self.ts < other.ts
+        return (self.ts, self.handle) < (other.ts, other.handle)
 
     def __eq__(self, other) -> bool:
-        return self.ts == other.ts
+        return (self.ts, self.handle) == (other.ts, other.handle)
+
+
+def finite_ts(ts: float) -> float:
+    """Return ts, raising ValueError unless a call can be scheduled at it.
+
+    NaN compares false with every time, so it would stall the queue, and an
+    infinite time can never be reached.
+    """
+    if not math.isfinite(ts):
+        raise ValueError(f"Can't schedule a call at {ts}")
+    return ts
+
+
+def _percentile(ordered: List[float], q: float) -> float:
+    """Return the q-th percentile (0-100) of an already sorted list."""
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class DispatchStats:
+    """Tracks how late items are dispatched compared to their timestamp."""
+
+    __slots__ = ("count", "total_lateness", "max_lateness", "recent")
+
+    def __init__(self, window: int = 1000) -> None:
+        self.count = 0
+        self.total_lateness = 0.0
+        self.max_lateness = 0.0
+        self.recent: Deque[float] = collections.deque(maxlen=window)
+
+    def record(self, lateness: float) -> None:
+        """Record the lateness in seconds of a single dispatched item."""
+        self.count += 1
+        self.total_lateness += lateness
+        if lateness > self.max_lateness:
+            self.max_lateness = lateness
+        self.recent.append(lateness)
+
+    def as_dict(self) -> Mapping:
+        """Summarise the lateness seen so far, percentiles are over recent items."""
+        ordered = sorted(self.recent)
+        return {
+            "dispatched": self.count,
+            "mean_lateness": self.total_lateness / self.count if self.count else 0.0,
+            "max_lateness": self.max_lateness,
+            "p50_lateness": _percentile(ordered, 50),
+            "p99_lateness": _percentile(ordered, 99),
+        }
+
+
+def publish_dispatch(
+    events: EventBroadcaster, qm: QueuedMessage, next_qm: Optional[QueuedMessage]
+) -> None:
+    """Publish that a call was dispatched, and when it recurs next if it does."""
+    data = call_data(qm)
+    data["next_ts"] = next_qm.ts if next_qm is not None else None
+    events.publish(DISPATCHED, data)
+
+
+class DialWorkers:
+    """A bounded pool of workers that dial the items handed to them.
+
+    Due items are submitted without waiting, and at most ``concurrency``
+    dials are in flight at any time.
+    """
+
+    def __init__(
+        self,
+        handler: CallControl,
+        concurrency: int = 1,
+        *,
+        loop: asyncio.AbstractEventLoop = None,
+    ) -> None:
+        self._handler = handler
+        self._concurrency = max(1, concurrency)
+        self._loop = loop or asyncio.get_event_loop()
+        self._pending: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Future] = []
+        self.stats = DispatchStats()
+
+    def __len__(self) -> int:
+        """Number of submitted items waiting for a free worker."""
+        return self._pending.qsize() if self._pending else 0
+
+    def _start(self) -> None:
+        """Start the workers the first time something is submitted."""
+        self._pending = asyncio.Queue()
+        self._workers = [
+            asyncio.ensure_future(self._work(), loop=self._loop)
+            for _ in range(self._concurrency)
+        ]
+
+    async def _work(self) -> None:
+        """Dial submitted items one at a time."""
+        while True:
+            qm = await self._pending.get()
+            lateness = time.time() - qm.ts
+            self.stats.record(lateness)
+            DISPATCH_LATENESS.observe(lateness)
+
+            started = time.monotonic()
+            try:
+                # Initiate the call
+                await self._handler.dial(qm.msg)
+            except Exception:
+                DIAL_ERRORS.inc()
+                logger.exception("Failed to dial scheduled call %s", qm.msg)
+            finally:
+                self._pending.task_done()
+            DIAL_SECONDS.observe(time.monotonic() - started)
+
+    def submit(self, qm: QueuedMessage) -> None:
+        """Hand a due item over to the workers."""
+        if self._pending is None:
+            self._start()
+        self._pending.put_nowait(qm)
+
+    async def close(self) -> None:
+        """Stop the workers, abandoning anything not yet dialled."""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._pending = None
 
 
 class UnifiedTimedQueue:
     """Stores items with timestamps in a priority queue.
     Fires the given handler whenever an item at the front of the queue
     is ready for processing.
+
+    Due items are dialled by a pool of ``concurrency`` workers, so a burst of
+    calls booked for the same time is not dialled strictly one after another.
+
+    ``put`` returns a handle that can be used to cancel or reschedule the item.
+    Both leave the superseded heap entry behind as a tombstone, which is skipped
+    when it reaches the front. Once tombstones outnumber the live entries the
+    heap is rebuilt from the live ones.
+
+    If a journal is given, every change is recorded in it so the queue can be
+    restored after a restart. Any object with ``record_put``, ``record_dispatch``
+    and ``record_cancel`` methods will do.
+
+    If an ``admission`` slot allocator is given, new and rescheduled items are
+    moved to the first time slot with capacity left, and the handle of the item
+    can be used to ``get`` the time it will actually be dispatched.
+
+    ``version`` goes up with every change to the pending items, so that views
+    of them can tell when they are out of date.
+
+    If an ``events`` broadcaster is given, every dispatch is published to it.
     """
 
     def __init__(
-        self, handler: CallControl, *, loop: asyncio.AbstractEventLoop = None
+        self,
+        handler: CallControl,
+        *,
+        loop: asyncio.AbstractEventLoop = None,
+        concurrency: int = 1,
+        journal: SchedulerJournal = None,
+        admission: SlotAllocator = None,
+        events: EventBroadcaster = None,
     ) -> None:
         self._queue: List[QueuedMessage] = []
+        self._entries: Dict[int, QueuedMessage] = {}
+        self._handles = itertools.count(1)
+        self._tombstones = 0
         self._handler = handler
         self._task: Optional[asyncio.Future[None]] = None
         self._loop = loop or asyncio.get_event_loop()
+        self._workers = DialWorkers(handler, concurrency, loop=self._loop)
+        self._journal = journal
+        self._admission = admission
+        self._events = events
+        self.version = 0
 
     def __len__(self) -> int:
-        return len(self._queue)
+        return len(self._entries)
+
+    @property
+    def stats(self) -> DispatchStats:
+        """Lateness statistics of the dispatched items."""
+        return self._workers.stats
 
     async def _sleep_and_process(self, ts: float) -> None:
         """Sleep until the specified timestamp, then process items that are ready."""
 
         # If necessary, sleep until timestamp is reached.
         sleep_time = ts - time.time()
-        if ts >= _epsilon:
+        if sleep_time >= _epsilon:
             await asyncio.sleep(sleep_time)
 
         # Process all items that are ready (allowing a bit of wiggle room).
+        # Nothing is awaited here, the dial workers initiate the calls.
         cutoff = time.time() + _epsilon
         while self._queue and self._queue[0].ts < cutoff:
             qm = heapq.heappop(self._queue)
+            if not self._is_live(qm):
+                self._tombstones -= 1
+                continue
 
-            # Initiate the call
-            await self._handler.dial(qm.msg)
+            self._dispatch(qm)
 
         # Reset processing flag and sleep task.
         self._task = None
 
         # If there are items in queue, schedule the next sleep.
+        self._discard_head_tombstones()
         if self._queue:
             self._reschedule(self._queue[0].ts)
 
+    def _dispatch(self, qm: QueuedMessage) -> None:
+        """Hand a due entry to the dial workers.
+
+        A recurring entry is put back under the same handle for its next
+        occurrence, if it has one.
+        """
+        self.version += 1
+        msg = qm.msg
+        next_qm = None
+        if isinstance(msg, Recurring):
+            self._workers.submit(QueuedMessage(qm.ts, msg.item, qm.handle))
+            next_ts = msg.rule.next_after(max(qm.ts, time.time()))
+            if next_ts is not None:
+                next_qm = QueuedMessage(self._admit(next_ts), msg, qm.handle)
+        else:
+            self._workers.submit(qm)
+
+        if self._events is not None:
+            publish_dispatch(self._events, qm, next_qm)
+        if next_qm is not None:
+            self._requeue(next_qm)
+            return
+
+        del self._entries[qm.handle]
+        if self._journal:
+            self._journal.record_dispatch(qm.handle)
+
+    def _requeue(self, qm: QueuedMessage) -> None:
+        """Put an entry back while the due ones are being processed.
+
+        Processing reschedules the sleep task for the new head when it is done.
+        """
+        self._entries[qm.handle] = qm
+        heapq.heappush(self._queue, qm)
+        if self._journal:
+            self._journal.record_put(qm.handle, qm.ts, qm.msg)
+
     def _reschedule(self, new_ts: float) -> None:
         """Schedule a task to sleep until the next item should be processed."""
 
@@ -80,13 +325,158 @@ class UnifiedTimedQueue:
             self._sleep_and_process(new_ts), loop=self._loop
         )
 
-    def put(self, item: Any, ts: float) -> None:
-        """Add a new item to the queue."""
+    def _is_live(self, qm: QueuedMessage) -> bool:
+        """Whether the heap entry has not been cancelled or rescheduled."""
+        return self._entries.get(qm.handle) is qm
+
+    def _discard_head_tombstones(self) -> None:
+        """Pop tombstones off the front, so that the head is a live entry."""
+        while self._queue and not self._is_live(self._queue[0]):
+            heapq.heappop(self._queue)
+            self._tombstones -= 1
+
+    def _bury(self) -> None:
+        """Account for a new tombstone, compacting the heap when there are too many."""
+        self._tombstones += 1
+        if self._tombstones > max(MIN_COMPACTION, len(self._entries)):
+            self._queue = list(self._entries.values())
+            heapq.heapify(self._queue)
+            self._tombstones = 0
+        else:
+            self._discard_head_tombstones()
+
+    def _push(self, qm: QueuedMessage) -> None:
+        """Push an entry onto the heap, waking up earlier if it is the new head."""
 
         # If the queue is empty, or if the new item precedes all items on the queue, adjust the
         # schedule accordingly.
-        if not self._queue or self._queue[0].ts > ts:
-            self._reschedule(ts)
+        if not self._queue or self._queue[0].ts > qm.ts:
+            self._reschedule(qm.ts)
 
         # Add item to queue.
-        heapq.heappush(self._queue, QueuedMessage(ts, item))
+        self.version += 1
+        self._entries[qm.handle] = qm
+        heapq.heappush(self._queue, qm)
+
+    def _admit(self, ts: float) -> float:
+        """Book a slot for an item due at ts, returning when it will be due."""
+        if self._admission is None:
+            return ts
+        return self._admission.allocate(ts)
+
+    def _release(self, ts: float) -> None:
+        """Give back the slot of an item that is no longer due at ts."""
+        if self._admission is not None:
+            self._admission.release(ts)
+
+    def put(self, item: Any, ts: float) -> int:
+        """Add a new item to the queue and return its handle."""
+        ts = self._admit(finite_ts(ts))
+        handle = next(self._handles)
+        self._push(QueuedMessage(ts, item, handle))
+
+        if self._journal:
+            self._journal.record_put(handle, ts, item)
+        return handle
+
+    def put_many(self, items: Iterable[Tuple[Any, float]]) -> List[int]:
+        """Add (item, ts) pairs to the queue, returning their handles.
+
+        When pushing the new entries one by one would cost more than rebuilding
+        the heap, they are appended and the heap is heapified once.
+        """
+        # Checked up front, so a bad time adds none of the items
+        items = [(item, finite_ts(ts)) for item, ts in items]
+        new = [
+            QueuedMessage(self._admit(ts), item, next(self._handles))
+            for item, ts in items
+        ]
+        if not new:
+            return []
+
+        self.version += 1
+        first = min(new)
+        if not self._queue or self._queue[0].ts > first.ts:
+            self._reschedule(first.ts)
+
+        for qm in new:
+            self._entries[qm.handle] = qm
+        size = len(self._queue) + len(new)
+        if len(new) * math.log2(size + 1) > size:
+            self._queue.extend(new)
+            heapq.heapify(self._queue)
+        else:
+            for qm in new:
+                heapq.heappush(self._queue, qm)
+
+        if self._journal:
+            for qm in new:
+                self._journal.record_put(qm.handle, qm.ts, qm.msg)
+        return [qm.handle for qm in new]
+
+    def get(self, handle: int) -> Optional[QueuedMessage]:
+        """Return the pending item with the given handle, if any."""
+        return self._entries.get(handle)
+
+    def cancel(self, handle: int) -> bool:
+        """Remove a pending item. Returns whether it was still pending."""
+        qm = self._entries.pop(handle, None)
+        if qm is None:
+            return False
+
+        self.version += 1
+        self._release(qm.ts)
+        if self._journal:
+            self._journal.record_cancel(handle)
+        self._bury()
+        return True
+
+    def reschedule(self, handle: int, new_ts: float) -> bool:
+        """Move a pending item to a new timestamp. Returns whether it was pending."""
+        qm = self._entries.get(handle)
+        if qm is None:
+            return False
+
+        finite_ts(new_ts)
+        self._release(qm.ts)
+        new_ts = self._admit(new_ts)
+        self._push(QueuedMessage(new_ts, qm.msg, handle))
+        self._bury()
+
+        if self._journal:
+            self._journal.record_put(handle, new_ts, qm.msg)
+        return True
+
+    def items(self) -> Iterator[QueuedMessage]:
+        """Iterate over the queued items, in no particular order."""
+        return iter(self._entries.values())
+
+    def restore(
+        self, entries: Iterable[Tuple[float, Any, int]], next_handle: int
+    ) -> None:
+        """Replace the queue with (ts, item, handle) entries recovered from a journal.
+
+        The heap is built with a single heapify rather than one push per entry.
+        """
+        self._entries = {
+            handle: QueuedMessage(ts, item, handle) for ts, item, handle in entries
+        }
+        self._queue = list(self._entries.values())
+        heapq.heapify(self._queue)
+        self._tombstones = 0
+        self._handles = itertools.count(next_handle)
+        self.version += 1
+
+        if self._admission is not None:
+            for qm in self._queue:
+                self._admission.occupy(qm.ts)
+
+        if self._queue:
+            self._reschedule(self._queue[0].ts)
+
+    async def close(self) -> None:
+        """Stop the sleep task and the dial workers."""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await self._workers.close()
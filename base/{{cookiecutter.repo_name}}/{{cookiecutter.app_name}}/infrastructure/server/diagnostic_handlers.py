@@ -0,0 +1,98 @@
+"""
+HTTP handlers profiling the live process.
+
+They are only there when diagnostics are enabled, and only answer requests
+carrying the diagnostics token.
+"""
+
+from aiohttp import web
+
+from {{cookiecutter.app_name}}.infrastructure import constants
+from {{cookiecutter.app_name}}.infrastructure.profiling import (
+    MEMORY_GROUPS,
+    PSTATS_SORT_KEYS,
+    TOKEN_HEADER,
+    Profiler,
+    ProfilerBusy,
+)
+
+PSTATS = "pstats"
+COLLAPSED = "collapsed"
+
+
+def _get_profiler(request: web.Request) -> Profiler:
+    """The profiler, if diagnostics are on and the request has the token."""
+    profiler = request.app.get(constants.PROFILER)
+    if profiler is None:
+        raise web.HTTPNotFound(text="Diagnostics are not enabled.")
+    if not profiler.authorized(request.headers.get(TOKEN_HEADER)):
+        raise web.HTTPForbidden(text="Wrong diagnostics token.")
+    return profiler
+
+
+def _seconds(request: web.Request, max_seconds: float) -> float:
+    try:
+        seconds = float(request.query.get("seconds", 10))
+    except ValueError:
+        raise web.HTTPBadRequest(text="seconds must be a number.")
+    if not 0 < seconds <= max_seconds:
+        raise web.HTTPBadRequest(text=f"seconds must be between 0 and {max_seconds}.")
+    return seconds
+
+
+def _choice(request: web.Request, name: str, choices, default: str) -> str:
+    value = request.query.get(name, default)
+    if value not in choices:
+        raise web.HTTPBadRequest(text=f"{name} must be one of {', '.join(choices)}.")
+    return value
+
+
+def _limit(request: web.Request) -> int:
+    try:
+        return max(1, int(request.query.get("limit", 50)))
+    except ValueError:
+        raise web.HTTPBadRequest(text="limit must be a whole number.")
+
+
+async def profile(request: web.Request) -> web.Response:
+    """
+    GET Handler profiling the process for ?seconds=
+
+    Returns the cProfile report of the top ?limit= functions by ?sort=, or
+    with ?format=collapsed, sampled stacks to draw a flame graph from.
+    """
+    profiler = _get_profiler(request)
+    seconds = _seconds(request, profiler.max_seconds)
+    output = _choice(request, "format", (PSTATS, COLLAPSED), PSTATS)
+    sort = _choice(request, "sort", PSTATS_SORT_KEYS, "cumulative")
+    limit = _limit(request)
+
+    try:
+        if output == COLLAPSED:
+            text = await profiler.sample(seconds)
+        else:
+            text = await profiler.profile(seconds, sort, limit)
+    except ProfilerBusy as e:
+        raise web.HTTPConflict(text=str(e))
+
+    return web.Response(text=text)
+
+
+async def memory(request: web.Request) -> web.Response:
+    """
+    GET Handler tracing allocations for ?seconds=
+
+    Returns the ?limit= places, grouped by ?group_by=, whose allocations
+    still held at the end grew the most.
+    """
+    profiler = _get_profiler(request)
+    seconds = _seconds(request, profiler.max_seconds)
+    group_by = _choice(request, "group_by", MEMORY_GROUPS, "lineno")
+    limit = _limit(request)
+
+    try:
+        text = await profiler.memory_growth(seconds, group_by, limit)
+    except ProfilerBusy as e:
+        raise web.HTTPConflict(text=str(e))
+
+    return web.Response(text=text)
@@ -1,26 +1,52 @@
+import asyncio
 import datetime
+import json
+import time
+from typing import Mapping
 
 import aiohttp_jinja2
 import marshmallow as mm
-import phonenumbers
 from aiohttp import web
 
-from {{cookiecutter.app_name}}.infrastructure import constants
-from {{cookiecutter.app_name}}.infrastructure.call_control import CallControl
-from {{cookiecutter.app_name}}.infrastructure.usecases import get_post_params
+from {{cookiecutter.app_name}}.infrastructure import bulk, constants, events
+from {{cookiecutter.app_name}}.infrastructure.listing import (
+    ScheduleListing,
+    format_cursor,
+    parse_cursor,
+)
+from {{cookiecutter.app_name}}.infrastructure.recurrence import Recurring, parse_rule
+from {{cookiecutter.app_name}}.infrastructure.usecases import get_post_params, resolve
 from {{cookiecutter.app_name}}.infrastructure.validators import validate_dt
+from {{cookiecutter.app_name}}.infrastructure.webhook_queue import WebhookDispatcher
+from {{cookiecutter.app_name}}.infrastructure.workers import SchedulerUnavailable
+
+# How many occurrences after the next one the homepage lists for recurring calls
+UPCOMING_OCCURRENCES = 3
+
+# How many calls the homepage shows, and the most the JSON API lists at once
+HOMEPAGE_CALLS = 50
+MAX_PAGE = 1000
+
+# How long the live feed may stay quiet before a keepalive is sent
+KEEPALIVE_SECONDS = 15
+
+
+def _publish(request: web.Request, event: str, data: Mapping) -> None:
+    """Publish an event to the live feed, if there is one."""
+    broadcaster = request.app.get(constants.EVENTS)
+    if broadcaster is not None:
+        broadcaster.publish(event, data)
 
 
-@aiohttp_jinja2.template("index.html")
 async def homepage(request: web.Request):
-    """Renders the UI to view and schedule new calls"""
+    """Renders the UI to view and schedule new calls
 
-    calls_scheduler = request.app[constants.SCHEDULER]
+    Only the first page of calls is shown, the rest are listed by /calls. The
+    page is rendered again when the calls or the default time have changed.
+    """
 
-    scheduled_calls = [
-        (datetime.datetime.fromtimestamp(q_message.ts), q_message.msg)
-        for q_message in calls_scheduler._queue
-    ]
+    listing: ScheduleListing = request.app[constants.LISTING]
+    await listing.refresh()
 
     date = datetime.datetime.today().strftime("%Y-%m-%d")
     time_now = datetime.datetime.now()
@@ -28,33 +54,198 @@ async def homepage(request: web.Request):
 
     time = time_future.strftime("%H:%M")
 
-    print(time)
+    key = (listing.generation, date, time)
+    if listing.homepage is None or listing.homepage[0] != key:
+        first_page, _ = await listing.page(limit=HOMEPAGE_CALLS)
+
+        scheduled_calls = []
+        for q_message in first_page:
+            # Only the next occurrence is scheduled, work out the ones after it
+            upcoming = []
+            if isinstance(q_message.msg, Recurring):
+                upcoming = [
+                    datetime.datetime.fromtimestamp(ts)
+                    for ts in q_message.msg.occurrences(
+                        q_message.ts, UPCOMING_OCCURRENCES + 1
+                    )[1:]
+                ]
+            scheduled_calls.append(
+                (
+                    datetime.datetime.fromtimestamp(q_message.ts),
+                    q_message.msg,
+                    q_message.handle,
+                    upcoming,
+                )
+            )
+
+        text = aiohttp_jinja2.render_string(
+            "index.html",
+            request,
+            {
+                "scheduled_calls": scheduled_calls,
+                "more_calls": len(listing) - len(scheduled_calls),
+                "date": date,
+                "time": time,
+            },
+        )
+        listing.homepage = (key, text)
+
+    return web.Response(text=listing.homepage[1], content_type="text/html")
+
+
+async def list_calls(request: web.Request) -> web.Response:
+    """
+    GET Handler listing the scheduled calls in time order, a page at a time
+
+    Takes ?limit= and the ?after= cursor of the previous page, and replies
+    with the calls and the cursor of the next page, or null after the last.
+    """
+    listing: ScheduleListing = request.app[constants.LISTING]
+
+    try:
+        limit = min(int(request.query.get("limit", 100)), MAX_PAGE)
+        after = request.query.get("after")
+        cursor = parse_cursor(after) if after else None
+        if limit < 1:
+            raise ValueError
+    except ValueError:
+        return web.Response(text="Bad limit or cursor.", status=400)
+
+    calls, next_cursor = await listing.page(cursor, limit)
+    return web.json_response(
+        {
+            "calls": [events.call_data(qm) for qm in calls],
+            "next": format_cursor(next_cursor) if next_cursor else None,
+        }
+    )
+
+
+async def live_events(request: web.Request) -> web.StreamResponse:
+    """
+    GET Handler streaming changes to the schedule and the calls as server-sent events
+
+    The stream ends when the client falls too far behind, after an event
+    telling it to reload.
+    """
+    broadcaster = request.app.get(constants.EVENTS)
+    if broadcaster is None:
+        raise web.HTTPNotFound(text="The live feed is disabled.")
+
+    response = web.StreamResponse(
+        headers={
+            "Content-Type": "text/event-stream",
+            "Cache-Control": "no-cache",
+            # Stop proxies from buffering the stream
+            "X-Accel-Buffering": "no",
+        }
+    )
+    await response.prepare(request)
+
+    subscription = broadcaster.subscribe()
+    try:
+        await response.write(events.KEEPALIVE)
+        while True:
+            chunk = await subscription.get(KEEPALIVE_SECONDS)
+            if chunk is None:
+                break
+            await response.write(chunk)
+
+        if subscription.dropped:
+            await response.write(events.RESET)
+        await response.write_eof()
+    except ConnectionResetError:
+        # The dashboard went away
+        pass
+    finally:
+        broadcaster.unsubscribe(subscription)
 
-    return {"scheduled_calls": scheduled_calls, "date": date, "time": time}
+    return response
 
 
 async def telnyx_webhook(request: web.Request) -> web.Response:
     """
     Telnyx Webhook Handler.
 
-    Recevies the webhook from Telnyx and processes it and fires
-    off the appropriate corresponding command.
+    Recevies the webhook from Telnyx and queues it to be processed in the
+    background, where the appropriate corresponding command is fired off.
 
     """
-    call_control_app: CallControl = request.app[constants.CALL_CONTROL_APP]
+    dispatcher: WebhookDispatcher = request.app[constants.WEBHOOK_DISPATCHER]
+    deduplicator = request.app.get(constants.WEBHOOK_DEDUPLICATOR)
 
     # Parse the webhook data
     data = await request.json()
+    event_id = data["data"].get("id")
     event_type = data["data"].get("event_type", "")
     call_control_id = data["data"]["payload"].get("call_control_id", None)
 
-    # Send to the call control app to process the webhook fully
-    await call_control_app.process_webhook(call_control_id, event_type)
+    # A redelivery of a webhook we already have, acknowledge it and move on
+    if deduplicator is not None and event_id and event_id in deduplicator:
+        return web.Response(text="ok")
+
+    # Hand over to the webhook workers to process the webhook fully
+    try:
+        dispatcher.submit(call_control_id, event_type)
+    except asyncio.QueueFull:
+        # Telnyx will resend the webhook later
+        return web.Response(
+            text="Too many webhooks queued.", status=503, headers={"Retry-After": "1"}
+        )
+
+    # Only remember accepted webhooks, so a rejected one is processed when resent
+    if deduplicator is not None and event_id:
+        deduplicator.add(event_id)
 
     # Return a 200 response to the Telnyx server
     return web.Response(text="ok")
 
 
+def _parse_datetime(params: Mapping) -> datetime.datetime:
+    """Deserialize the date and time params into a datetime object."""
+
+    # Setup the marshmallow validators
+    d = mm.fields.Date(format="%Y-%m-%d")
+    t = mm.fields.Time(formt="%H:%M")
+
+    date = d.deserialize(params["date"])
+    time = t.deserialize(params["time"])
+
+    # Create a datetime object from the request
+    return datetime.datetime.combine(date, time)
+
+
+async def _scheduled_response(
+    request: web.Request, handle: int, requested_ts: float, event: str
+):
+    """Publish the call to the live feed, then reply with the handle and dispatch
+    time to JSON clients, and redirect everyone else.
+
+    The scheduler may have moved the call to a later time slot.
+    """
+    is_json = request.content_type == "application/json"
+    if is_json or constants.EVENTS in request.app:
+        qm = await resolve(request.app[constants.SCHEDULER].get(handle))
+        if qm is not None:
+            _publish(request, event, events.call_data(qm))
+
+    if is_json:
+        ts = qm.ts if qm is not None else requested_ts
+        return web.json_response(
+            {"handle": handle, "ts": ts, "requested_ts": requested_ts}
+        )
+
+    # Redirect the user back to the the main page
+    raise web.HTTPFound("/")
+
+
+def _get_handle(request: web.Request) -> int:
+    """Parse the call handle from the URL."""
+    try:
+        return int(request.match_info["handle"])
+    except ValueError:
+        raise web.HTTPNotFound(text="Unknown call.")
+
+
 async def schedule_call(request):
     """
     POST Handler to schedule a new call
@@ -69,24 +260,16 @@ async def schedule_call(request):
             text="Bad request. Please ensure the request is valid.", status=400
         )
 
-    # Setup the marshmallow validators
-    d = mm.fields.Date(format="%Y-%m-%d")
-    t = mm.fields.Time(formt="%H:%M")
-
     try:
         # Validate the request
-        date = d.deserialize(params["date"])
-        time = t.deserialize(params["time"])
-        num = phonenumbers.parse(params["phone_number"])
+        dt = _parse_datetime(params)
+        num = request.app[constants.NUMBERS].normalise(params["phone_number"])
 
     except Exception:
         return web.Response(
             text="Bad request. Please ensure the request is valid.", status=400
         )
 
-    # Create a datetime object from the request
-    dt = datetime.datetime.combine(date, time)
-
     try:
         dt_secs = validate_dt(dt)
     except AssertionError:
@@ -94,7 +277,141 @@ async def schedule_call(request):
             text="The scheduled time must be in the future.", status=400
         )
 
-    call_scheduler.put(num, dt_secs)
+    # A recurring call starts at its first occurrence from the given time
+    item = num
+    if params.get("repeat"):
+        try:
+            item = Recurring(num, parse_rule(params["repeat"], dt_secs))
+        except ValueError:
+            return web.Response(
+                text="Bad repeat rule. Use e.g. every 1d, @daily or 0 9 * * 1-5.",
+                status=400,
+            )
+        dt_secs = item.first(dt_secs)
+        if dt_secs is None:
+            return web.Response(text="The repeat rule never occurs.", status=400)
+
+    handle = await resolve(call_scheduler.put(item, dt_secs))
+
+    return await _scheduled_response(request, handle, dt_secs, events.SCHEDULED)
+
+
+def _ndjson(lines) -> bytes:
+    return "".join(json.dumps(line) + "\n" for line in lines).encode()
+
+
+async def schedule_calls(request):
+    """
+    POST Handler to schedule many calls from a CSV or NDJSON body
+
+    Rows are read and scheduled a batch at a time as the body arrives. The
+    response is NDJSON streamed back as it goes: a line for each row that
+    failed, a line with the handle of each scheduled call if ?handles=true,
+    and a final line with the totals.
+    """
+    call_scheduler = request.app[constants.SCHEDULER]
+    numbers = request.app[constants.NUMBERS]
+    batch_size = request.app.get(constants.BULK_BATCH_SIZE, 1000)
+
+    fmt = bulk.CONTENT_TYPES.get(request.content_type)
+    if fmt is None:
+        return web.Response(
+            text="Send the calls as text/csv or application/x-ndjson.", status=415
+        )
+    with_handles = request.query.get("handles", "").lower() in ("1", "true")
+
+    response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+    await response.prepare(request)
+
+    scheduled = failed = 0
+    async for rows in bulk.read_rows(request.content, fmt, batch_size):
+        calls, errors = await bulk.validate_rows(rows, time.time(), numbers)
+
+        try:
+            handles = await resolve(
+                call_scheduler.put_many([(num, ts) for _, num, ts in calls])
+            )
+        except SchedulerUnavailable:
+            # Too late for a 503, so tell the client where the upload stopped
+            await response.write(
+                _ndjson(
+                    [
+                        {
+                            "scheduled": scheduled,
+                            "failed": failed,
+                            "error": "The scheduler is unavailable.",
+                            "line": rows[0][0],
+                        }
+                    ]
+                )
+            )
+            return response
+
+        lines = [{"line": line, "error": error} for line, error in errors]
+        if with_handles:
+            lines.extend(
+                {"line": line, "handle": handle}
+                for (line, _, _), handle in zip(calls, handles)
+            )
+            lines.sort(key=lambda line: line["line"])
+        if lines:
+            await response.write(_ndjson(lines))
+
+        # One event for the batch, rather than one for every call in it
+        if calls:
+            _publish(request, events.BULK_SCHEDULED, {"scheduled": len(calls)})
+
+        scheduled += len(calls)
+        failed += len(errors)
+
+    await response.write(_ndjson([{"scheduled": scheduled, "failed": failed}]))
+    await response.write_eof()
+    return response
+
+
+async def cancel_call(request):
+    """
+    DELETE (or POST from the UI) Handler to cancel a scheduled call
+    """
+    call_scheduler = request.app[constants.SCHEDULER]
+    handle = _get_handle(request)
+
+    if not await resolve(call_scheduler.cancel(handle)):
+        return web.Response(text="Unknown call.", status=404)
+
+    _publish(request, events.CANCELLED, {"handle": handle})
+
+    if request.method == "DELETE":
+        return web.json_response({"cancelled": True})
 
     # Redirect the user back to the the main page
     raise web.HTTPFound("/")
+
+
+async def reschedule_call(request):
+    """
+    POST Handler to move a scheduled call to a new date and time
+    """
+    call_scheduler = request.app[constants.SCHEDULER]
+    handle = _get_handle(request)
+
+    try:
+        # Parse and validate the request body
+        params = await get_post_params(request)
+        dt = _parse_datetime(params)
+    except Exception:
+        return web.Response(
+            text="Bad request. Please ensure the request is valid.", status=400
+        )
+
+    try:
+        dt_secs = validate_dt(dt)
+    except AssertionError:
+        return web.Response(
+            text="The scheduled time must be in the future.", status=400
+        )
+
+    if not await resolve(call_scheduler.reschedule(handle, dt_secs)):
+        return web.Response(text="Unknown call.", status=404)
+
+    return await _scheduled_response(request, handle, dt_secs, events.RESCHEDULED)
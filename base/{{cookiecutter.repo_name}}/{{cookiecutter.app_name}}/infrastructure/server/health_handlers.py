@@ -10,6 +10,13 @@ import time
 
 from aiohttp import web
 
+from {{cookiecutter.app_name}}.infrastructure import constants, metrics as app_metrics
+from {{cookiecutter.app_name}}.infrastructure.sharding import ShardedScheduler
+from {{cookiecutter.app_name}}.infrastructure.workers import (
+    SchedulerProxy,
+    SchedulerUnavailable,
+)
+
 START_TIME = time.time()
 
 INFO = {"host": socket.gethostname()}
@@ -20,14 +27,104 @@ def _dumps(obj):
     return json.dumps(obj, indent=4, sort_keys=True) + "\n"
 
 
-async def health_check(_request: web.Request):
-    """Health check handler."""
+async def health_check(request: web.Request):
+    """Health check handler.
+
+    Reports degraded while the event loop lags behind for too long.
+    """
+    monitor = request.app.get(constants.LOOP_MONITOR)
+    if monitor is not None and monitor.degraded:
+        stats = monitor.stats()
+        return web.json_response(
+            {"status": "DEGRADED", "p99_lag": stats["p99_lag"]}, status=503
+        )
     return web.json_response({"status": "OK"})
 
 
-async def info(_request: web.Request):
+async def info(request: web.Request):
     """Metadata."""
     INFO["start_time"] = str(round(START_TIME, 2))
     INFO["uptime"] = f"{round(time.time() - START_TIME, 2)} s"
     INFO["date"] = datetime.datetime.now().isoformat()
+
+    scheduler = request.app.get(constants.SCHEDULER)
+    if isinstance(scheduler, (SchedulerProxy, ShardedScheduler)):
+        INFO["scheduler"] = await scheduler.info()
+    elif scheduler is not None:
+        INFO["scheduler"] = dict(pending=len(scheduler), **scheduler.stats.as_dict())
+
+    call_states = request.app.get(constants.CALL_STATES)
+    if call_states is not None:
+        INFO["calls"] = call_states.stats()
+
+    call_control_app = request.app.get(constants.CALL_CONTROL_APP)
+    if call_control_app is not None:
+        INFO["prefetch"] = call_control_app.prefetch_stats()
+        INFO["routes"] = call_control_app.routes.stats()
+        if call_control_app.rate_limiter is not None:
+            INFO["rate_limit"] = call_control_app.rate_limiter.stats()
+
+    broadcaster = request.app.get(constants.EVENTS)
+    if broadcaster is not None:
+        INFO["events"] = broadcaster.stats()
+
+    exporter = request.app.get(constants.TELEGRAF)
+    if exporter is not None:
+        INFO["telegraf"] = exporter.stats()
+
+    monitor = request.app.get(constants.LOOP_MONITOR)
+    if monitor is not None:
+        INFO["loop"] = monitor.stats()
+
+    profiler = request.app.get(constants.PROFILER)
+    if profiler is not None:
+        INFO["diagnostics"] = profiler.stats()
+
+    numbers = request.app.get(constants.NUMBERS)
+    if numbers is not None:
+        INFO["numbers"] = numbers.stats()
+
+    joke_source = request.app.get(constants.JOKE_SOURCE)
+    if joke_source is not None:
+        INFO["joke_api"] = joke_source.stats()
+
+    joke_pool = request.app.get(constants.JOKE_POOL)
+    if joke_pool is not None:
+        INFO["jokes"] = joke_pool.stats()
+
+    dispatcher = request.app.get(constants.WEBHOOK_DISPATCHER)
+    if dispatcher is not None:
+        INFO["webhooks"] = dict(pending=len(dispatcher), **dispatcher.stats.as_dict())
+
+    deduplicator = request.app.get(constants.WEBHOOK_DEDUPLICATOR)
+    if deduplicator is not None:
+        INFO["webhook_dedupe"] = deduplicator.stats()
+
     return web.json_response(INFO, dumps=_dumps)
+
+
+async def update_queue_gauges(app: web.Application) -> None:
+    """Read the queue depths into their gauges, rather than track every change."""
+    scheduler = app.get(constants.SCHEDULER)
+    if isinstance(scheduler, (SchedulerProxy, ShardedScheduler)):
+        try:
+            stats = await scheduler.info()
+            app_metrics.SCHEDULER_PENDING.set(stats["pending"])
+        except SchedulerUnavailable:
+            pass
+    elif scheduler is not None:
+        app_metrics.SCHEDULER_PENDING.set(len(scheduler))
+
+    dispatcher = app.get(constants.WEBHOOK_DISPATCHER)
+    if dispatcher is not None:
+        app_metrics.WEBHOOKS_PENDING.set(len(dispatcher))
+
+
+async def metrics(request: web.Request):
+    """Metrics in the Prometheus text format."""
+    await update_queue_gauges(request.app)
+
+    return web.Response(
+        body=app_metrics.REGISTRY.expose().encode(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
@@ -2,18 +2,38 @@
 Setup functions for HTTP server.
 """
 
-import aiohttp_cors
-
-from {{cookiecutter.app_name}}.infrastructure.server import handlers, health_handlers
+import asyncio
+import time
 
+import aiohttp_cors
+from aiohttp import web
+
+from {{cookiecutter.app_name}}.infrastructure.server import (
+    diagnostic_handlers,
+    handlers,
+    health_handlers,
+    shard_handlers,
+)
+from {{cookiecutter.app_name}}.infrastructure.metrics import HTTP_REQUEST_SECONDS
+from {{cookiecutter.app_name}}.infrastructure.sharding import NODES_PATH, OP_PATH
+from {{cookiecutter.app_name}}.infrastructure.workers import SchedulerUnavailable
 
 # Define the private diagnostic paths
 HEALTH = "/health"
 INFO = "/info"
+METRICS = "/metrics"
+PROFILE = "/debug/profile"
+MEMORY = "/debug/memory"
 
 # Define the public paths
 HOME = "/"
 TELNYX_WEBHOOK = "/webhook"
+BULK_SCHEDULE = "/calls/bulk"
+CALLS = "/calls"
+EVENTS = "/events"
+CALL = "/calls/{handle}"
+CANCEL_CALL = "/calls/{handle}/cancel"
+RESCHEDULE_CALL = "/calls/{handle}/reschedule"
 
 
 def _setup_routes(app):
@@ -35,17 +55,72 @@ def _setup_routes(app):
     # App Metadata.
     app.router.add_get(INFO, health_handlers.info)
 
+    # App Metrics.
+    app.router.add_get(METRICS, health_handlers.metrics)
+
+    # Profiling, when diagnostics are enabled.
+    app.router.add_get(PROFILE, diagnostic_handlers.profile)
+    app.router.add_get(MEMORY, diagnostic_handlers.memory)
+
     # Webhoook Routes.
     cors.add(app.router.add_post(TELNYX_WEBHOOK, handlers.telnyx_webhook))
 
     # Schedule Calls.
     cors.add(app.router.add_get(HOME, handlers.homepage))
     cors.add(app.router.add_post(HOME, handlers.schedule_call))
+    cors.add(app.router.add_post(BULK_SCHEDULE, handlers.schedule_calls))
+    cors.add(app.router.add_get(CALLS, handlers.list_calls))
+    cors.add(app.router.add_get(EVENTS, handlers.live_events))
+    cors.add(app.router.add_delete(CALL, handlers.cancel_call))
+    cors.add(app.router.add_post(CANCEL_CALL, handlers.cancel_call))
+    cors.add(app.router.add_post(RESCHEDULE_CALL, handlers.reschedule_call))
+
+    # Requests between the nodes of a sharded scheduler.
+    app.router.add_post(OP_PATH, shard_handlers.shard_op)
+    app.router.add_post(NODES_PATH, shard_handlers.shard_nodes)
+
+
+@web.middleware
+async def request_metrics(request, handler):
+    """Time every request, by the route it matched and the status it got."""
+    started = time.monotonic()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    except asyncio.CancelledError:
+        # The client went away before it got a response
+        status = 499
+        raise
+    finally:
+        resource = request.match_info.route.resource
+        route = resource.canonical if resource is not None else "unmatched"
+        HTTP_REQUEST_SECONDS.labels(request.method, route, str(status)).observe(
+            time.monotonic() - started
+        )
+
+
+@web.middleware
+async def scheduler_unavailable(request, handler):
+    """Ask clients to retry while the worker owning the scheduler fails over."""
+    try:
+        return await handler(request)
+    except SchedulerUnavailable:
+        return web.Response(
+            text="The scheduler is unavailable.",
+            status=503,
+            headers={"Retry-After": "1"},
+        )
 
 
 def _setup_middlewares(app):
     """Add middlewares to the given aiohttp app."""
-    pass
+    app.middlewares.append(request_metrics)
+    app.middlewares.append(scheduler_unavailable)
 
 
 def configure_app(app, startup_handler):
@@ -0,0 +1,58 @@
+"""
+HTTP handlers for the requests between the nodes of a sharded scheduler.
+"""
+
+import logging
+
+from aiohttp import web
+
+from {{cookiecutter.app_name}}.infrastructure import constants
+from {{cookiecutter.app_name}}.infrastructure.sharding import SECRET_HEADER, ShardedScheduler
+from {{cookiecutter.app_name}}.infrastructure.workers import SchedulerUnavailable
+
+logger = logging.getLogger(__name__)
+
+
+def _get_shards(request: web.Request) -> ShardedScheduler:
+    """The sharded scheduler, if sharding is on and the request is from a node."""
+    shards = request.app.get(constants.SCHEDULER)
+    if not isinstance(shards, ShardedScheduler):
+        raise web.HTTPNotFound(text="Sharding is not enabled.")
+    if not shards.authorized(request.headers.get(SECRET_HEADER)):
+        raise web.HTTPForbidden(text="Unknown node.")
+    return shards
+
+
+async def shard_op(request: web.Request) -> web.Response:
+    """
+    POST Handler for scheduler operations forwarded by another node
+    """
+    shards = _get_shards(request)
+    body = await request.json()
+
+    try:
+        result = await shards.apply(body["op"], body["args"])
+    except SchedulerUnavailable:
+        raise
+    except Exception as e:
+        logger.exception("Forwarded scheduler request failed")
+        return web.json_response({"error": repr(e)})
+
+    return web.json_response({"result": result})
+
+
+async def shard_nodes(request: web.Request) -> web.Response:
+    """
+    POST Handler to change the nodes of the cluster
+
+    Takes {"nodes": {node id: base URL}}, and tells every other node too
+    unless "propagate" is false. Replies with how many calls each node moved,
+    and the error of each node that could not be told.
+    """
+    shards = _get_shards(request)
+    body = await request.json()
+
+    moved, failed = await shards.set_nodes(
+        body["nodes"], propagate=body.get("propagate", True)
+    )
+    return web.json_response({"moved": moved, "failed": failed})
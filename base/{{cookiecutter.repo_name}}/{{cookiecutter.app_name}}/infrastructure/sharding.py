@@ -0,0 +1,385 @@
+"""
+Splitting the call schedule across several nodes.
+
+Each call is placed on a node by consistent hashing of its destination number,
+so adding or removing a node only moves the calls that hash to it. Handles
+carry the id of the node that holds the call, so any node can route a cancel
+or reschedule to it.
+"""
+
+import asyncio
+import bisect
+import collections
+import hashlib
+import hmac
+import logging
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Tuple
+
+from aiohttp import ClientError, ClientSession, ClientTimeout
+
+from {{cookiecutter.app_name}}.infrastructure.cache import TTLMap
+from {{cookiecutter.app_name}}.infrastructure.recurrence import Recurring
+from {{cookiecutter.app_name}}.infrastructure.usecases import resolve
+from {{cookiecutter.app_name}}.infrastructure.workers import RemoteEntry, SchedulerUnavailable
+
+logger = logging.getLogger(__name__)
+
+# Handles are local handles times SHARD_SPACE plus the node id, so node ids
+# must be below it.
+SHARD_SPACE = 1024
+
+SECRET_HEADER = "X-Shard-Secret"
+
+OP_PATH = "/shard/op"
+NODES_PATH = "/shard/nodes"
+
+
+def _hash(key: str) -> int:
+    """A hash that is the same in every process, unlike hash()."""
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent hashing of keys onto node ids.
+
+    Every node is placed at ``vnodes`` points on the ring, and a key belongs to
+    the node at the first point after the key's hash.
+    """
+
+    def __init__(self, nodes: Iterable[int], vnodes: int = 64) -> None:
+        self._nodes = sorted(set(nodes))
+        if not self._nodes:
+            raise ValueError("A hash ring needs at least one node.")
+
+        points = sorted(
+            (_hash(f"{node}-{i}"), node) for node in self._nodes for i in range(vnodes)
+        )
+        self._points = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    @property
+    def nodes(self) -> List[int]:
+        return list(self._nodes)
+
+    def node_for(self, key: str) -> int:
+        index = bisect.bisect(self._points, _hash(key))
+        return self._owners[index % len(self._owners)]
+
+
+def split_handle(handle: int) -> Tuple[int, int]:
+    """Return the node id and local handle of a sharded handle."""
+    return handle % SHARD_SPACE, handle // SHARD_SPACE
+
+
+class ShardedScheduler:
+    """The call schedule of a cluster, as seen from one node.
+
+    Calls whose destination hashes to this node go to the ``local`` scheduler,
+    the others are forwarded to their node over HTTP with ``session``. ``nodes``
+    maps the node ids to their base URLs, this node's included. ``encode``
+    turns a call into the string sent to other nodes, and ``decode`` turns it
+    back. Requests between nodes must carry the shared ``secret``, so sharding
+    can't be enabled without one.
+
+    When the nodes change, the calls that now hash to another node are moved
+    there. Their old handles keep working for ``moved_ttl`` seconds, by
+    forwarding to the new ones.
+
+    Every method returns a coroutine. The local scheduler may be a plain
+    scheduler or a SchedulerProxy.
+    """
+
+    def __init__(
+        self,
+        local,
+        node_id: int,
+        nodes: Mapping[int, str],
+        session: ClientSession,
+        *,
+        encode: Callable[[Any], str],
+        decode: Callable[[str], Any],
+        vnodes: int = 64,
+        secret: str = "",
+        timeout: float = 5.0,
+        moved_ttl: float = 24 * 60 * 60,
+        batch_size: int = 1000,
+    ) -> None:
+        if not 0 <= node_id < SHARD_SPACE:
+            raise ValueError(f"Node ids must be between 0 and {SHARD_SPACE - 1}")
+        if not secret:
+            raise ValueError("Sharding needs a secret shared by the nodes.")
+
+        self.local = local
+        self.node_id = node_id
+        self._session = session
+        self._encode = encode
+        self._decode = decode
+        self._vnodes = vnodes
+        self._secret = secret
+        self._timeout = ClientTimeout(total=timeout)
+        self._batch_size = batch_size
+        # Where the calls moved to another node went, by their old handle.
+        self._moved = TTLMap(moved_ttl, max_size=1000000)
+        self._set_ring(nodes)
+
+        self.forwarded = 0
+        self.rebalanced = 0
+
+    def _set_ring(self, nodes: Mapping[int, str]) -> None:
+        self._nodes = {int(node): url.rstrip("/") for node, url in nodes.items()}
+        self._ring = HashRing(self._nodes, self._vnodes)
+
+    @property
+    def nodes(self) -> Dict[int, str]:
+        return dict(self._nodes)
+
+    def node_for(self, item: Any) -> int:
+        """The node of a call, by its destination number."""
+        if isinstance(item, Recurring):
+            item = item.item
+        return self._ring.node_for(str(item))
+
+    def _global(self, local_handle: int) -> int:
+        return local_handle * SHARD_SPACE + self.node_id
+
+    def _entry(self, qm) -> Optional[RemoteEntry]:
+        if qm is None:
+            return None
+        return RemoteEntry(qm.ts, qm.msg, self._global(qm.handle))
+
+    def authorized(self, secret: Optional[str]) -> bool:
+        """Whether a request between nodes carries the shared secret."""
+        return bool(self._secret) and hmac.compare_digest(self._secret, secret or "")
+
+    # Talking to the other nodes
+
+    async def _post(self, node: int, path: str, body: Mapping) -> Any:
+        url = self._nodes.get(node)
+        if url is None:
+            raise SchedulerUnavailable(f"Unknown node {node}")
+
+        self.forwarded += 1
+        try:
+            async with self._session.post(
+                url + path,
+                json=body,
+                headers={SECRET_HEADER: self._secret},
+                timeout=self._timeout,
+            ) as resp:
+                resp.raise_for_status()
+                response = await resp.json()
+        except (ClientError, asyncio.TimeoutError) as e:
+            raise SchedulerUnavailable(f"Node {node} did not answer: {e!r}")
+
+        if "error" in response:
+            raise RuntimeError(f"Node {node} failed: {response['error']}")
+        return response["result"]
+
+    async def _call(self, node: int, op: str, *args: Any) -> Any:
+        return await self._post(node, OP_PATH, {"op": op, "args": args})
+
+    def _decode_entry(self, entry: Optional[List]) -> Optional[RemoteEntry]:
+        if entry is None:
+            return None
+        ts, msg, handle = entry
+        return RemoteEntry(ts, self._decode(msg), handle)
+
+    # The cluster wide schedule
+
+    async def put(self, item: Any, ts: float) -> int:
+        """Schedule a call on the node its destination hashes to."""
+        node = self.node_for(item)
+        if node == self.node_id:
+            return self._global(await resolve(self.local.put(item, ts)))
+        return await self._call(node, "put", self._encode(item), ts)
+
+    async def put_many(self, items: Iterable[Tuple[Any, float]]) -> List[int]:
+        """Schedule calls on their nodes, sending each node its calls at once."""
+        by_node = collections.defaultdict(list)
+        for index, (item, ts) in enumerate(items):
+            by_node[self.node_for(item)].append((index, item, ts))
+
+        async def put_on(node, calls):
+            batch = [(item, ts) for _, item, ts in calls]
+            if node == self.node_id:
+                handles = await resolve(self.local.put_many(batch))
+                return [self._global(handle) for handle in handles]
+            return await self._call(
+                node, "put_many", [[self._encode(item), ts] for item, ts in batch]
+            )
+
+        nodes = list(by_node)
+        results = await asyncio.gather(*(put_on(node, by_node[node]) for node in nodes))
+
+        handles = [0] * sum(len(calls) for calls in by_node.values())
+        for node, node_handles in zip(nodes, results):
+            for (index, _, _), handle in zip(by_node[node], node_handles):
+                handles[index] = handle
+        return handles
+
+    def _route(self, handle: int) -> Tuple[int, int]:
+        """Follow a moved call to where it is now."""
+        handle = self._moved.get(handle) or handle
+        return split_handle(handle)[0], handle
+
+    async def get(self, handle: int) -> Optional[RemoteEntry]:
+        node, handle = self._route(handle)
+        if node == self.node_id:
+            return self._entry(await resolve(self.local.get(handle // SHARD_SPACE)))
+        return self._decode_entry(await self._call(node, "get", handle))
+
+    async def cancel(self, handle: int) -> bool:
+        node, handle = self._route(handle)
+        if node == self.node_id:
+            return await resolve(self.local.cancel(handle // SHARD_SPACE))
+        return await self._call(node, "cancel", handle)
+
+    async def reschedule(self, handle: int, new_ts: float) -> bool:
+        node, handle = self._route(handle)
+        if node == self.node_id:
+            return await resolve(self.local.reschedule(handle // SHARD_SPACE, new_ts))
+        return await self._call(node, "reschedule", handle, new_ts)
+
+    async def local_items(self) -> List[RemoteEntry]:
+        return [self._entry(qm) for qm in await resolve(self.local.items())]
+
+    async def items(self) -> List[RemoteEntry]:
+        """The calls scheduled on every node."""
+        others = [node for node in self._nodes if node != self.node_id]
+        results = await asyncio.gather(
+            self.local_items(), *(self._call(node, "items") for node in others)
+        )
+        entries = results[0]
+        for node_entries in results[1:]:
+            entries.extend(self._decode_entry(entry) for entry in node_entries)
+        return entries
+
+    async def info(self) -> Mapping:
+        local = self.local
+        if hasattr(local, "info"):
+            stats = await local.info()
+        else:
+            stats = dict(pending=len(local), **local.stats.as_dict())
+        return dict(
+            stats,
+            node=self.node_id,
+            nodes=len(self._nodes),
+            forwarded=self.forwarded,
+            rebalanced=self.rebalanced,
+        )
+
+    # Requests from the other nodes
+
+    async def apply(self, op: str, args: List) -> Any:
+        """Carry out an operation forwarded by another node on this node."""
+        if op == "put":
+            return self._global(
+                await resolve(self.local.put(self._decode(args[0]), args[1]))
+            )
+        if op == "put_many":
+            handles = await resolve(
+                self.local.put_many([(self._decode(msg), ts) for msg, ts in args[0]])
+            )
+            return [self._global(handle) for handle in handles]
+        if op == "get":
+            entry = await self.get(args[0])
+            return [entry.ts, self._encode(entry.msg), entry.handle] if entry else None
+        if op == "cancel":
+            return await self.cancel(args[0])
+        if op == "reschedule":
+            return await self.reschedule(args[0], args[1])
+        if op == "items":
+            return [
+                [entry.ts, self._encode(entry.msg), entry.handle]
+                for entry in await self.local_items()
+            ]
+        raise ValueError(f"Unknown scheduler operation {op!r}")
+
+    # Changing the nodes
+
+    async def set_nodes(
+        self, nodes: Mapping[int, str], propagate: bool = False
+    ) -> Tuple[Dict[int, int], Dict[int, str]]:
+        """Change the nodes of the cluster, moving calls to their new nodes.
+
+        With ``propagate``, every node in the old or new cluster is told as
+        well. Returns how many calls each node moved, and why each node that
+        could not be told failed, so that it can be told again.
+        """
+        others = set(self._nodes) | {int(node) for node in nodes}
+        others.discard(self.node_id)
+        old_nodes = self._nodes
+        self._set_ring(nodes)
+        # Reach the nodes being removed at their old address.
+        targets = {node: self._nodes.get(node) or old_nodes[node] for node in others}
+
+        moved = {self.node_id: await self.rebalance()}
+        failed: Dict[int, str] = {}
+        if propagate:
+            body = {"nodes": self._nodes, "propagate": False}
+            results = await asyncio.gather(
+                *(self._post_nodes(url, body) for url in targets.values()),
+                return_exceptions=True,
+            )
+            for node, result in zip(targets, results):
+                if isinstance(result, BaseException):
+                    logger.warning("Failed to tell node %d the nodes: %r", node, result)
+                    failed[node] = repr(result)
+                else:
+                    moved.update({int(other): n for other, n in result.items()})
+        return moved, failed
+
+    async def _post_nodes(self, url: str, body: Mapping) -> Mapping:
+        async with self._session.post(
+            url + NODES_PATH,
+            json=body,
+            headers={SECRET_HEADER: self._secret},
+            timeout=self._timeout,
+        ) as resp:
+            resp.raise_for_status()
+            return (await resp.json())["moved"]
+
+    async def rebalance(self) -> int:
+        """Move the local calls that hash to other nodes there."""
+        by_node = collections.defaultdict(list)
+        for qm in list(await resolve(self.local.items())):
+            node = self.node_for(qm.msg)
+            if node != self.node_id:
+                by_node[node].append(qm)
+
+        moved = 0
+        for node, calls in by_node.items():
+            for start in range(0, len(calls), self._batch_size):
+                moved += await self._move(node, calls[start : start + self._batch_size])
+
+        self.rebalanced += moved
+        if moved:
+            logger.info("Moved %d calls to other nodes", moved)
+        return moved
+
+    async def _move(self, node: int, calls: List) -> int:
+        # Cancel first, so a call that is dialled meanwhile is not moved as well.
+        calls = [qm for qm in calls if await resolve(self.local.cancel(qm.handle))]
+        if not calls:
+            return 0
+
+        moved = len(calls)
+        try:
+            handles = await self._call(
+                node, "put_many", [[self._encode(qm.msg), qm.ts] for qm in calls]
+            )
+        except Exception:
+            # Keep the calls here rather than lose them, under new handles.
+            logger.exception("Failed to move calls to node %d", node)
+            handles = [
+                self._global(await resolve(self.local.put(qm.msg, qm.ts)))
+                for qm in calls
+            ]
+            moved = 0
+
+        for qm, handle in zip(calls, handles):
+            self._moved.set(self._global(qm.handle), handle)
+        return moved
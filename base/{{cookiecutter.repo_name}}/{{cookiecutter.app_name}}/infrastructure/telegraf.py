@@ -0,0 +1,193 @@
+"""
+Pushing the metrics to Telegraf over UDP.
+
+Nothing is sent when something is observed. The metrics are already added up
+in memory by the registry, and every ``interval`` seconds the exporter turns
+what changed since the last flush into InfluxDB line protocol, packing as many
+lines as fit into each UDP packet:
+
+- counters send how much they went up,
+- gauges send their value,
+- histograms send the count, sum, mean and estimated percentiles of the
+  observations since the last flush.
+"""
+
+import asyncio
+import logging
+import math
+from typing import Awaitable, Callable, Dict, List, Mapping, Optional, Tuple
+
+from aiotelegraf import Client
+from telegraf.protocol import Line
+
+from {{cookiecutter.app_name}}.infrastructure.metrics import (
+    REGISTRY,
+    Counter,
+    Gauge,
+    Histogram,
+    Registry,
+)
+
+logger = logging.getLogger(__name__)
+
+# Percentiles sent for histograms, estimated from their buckets.
+PERCENTILES = (50, 90, 99)
+
+
+def bucket_percentile(buckets: List[Tuple[float, int]], q: float) -> float:
+    """Estimate a percentile from (upper bound, count) buckets.
+
+    Observations are taken to be spread evenly within their bucket. Ones above
+    the last bound are counted at it.
+    """
+    total = sum(count for _, count in buckets)
+    rank = q / 100 * total
+    seen = 0
+    lower = 0.0
+    for bound, count in buckets:
+        if count and seen + count >= rank:
+            if bound == math.inf:
+                return lower
+            return lower + (bound - lower) * (rank - seen) / count
+        seen += count
+        if bound != math.inf:
+            lower = bound
+    return lower
+
+
+class TelegrafExporter:
+    """Sends the metrics in ``registry`` to Telegraf through ``client``.
+
+    A flush sends at most ``max_packet`` bytes per packet. ``collect`` is
+    awaited before each flush, to bring gauges up to date.
+    """
+
+    def __init__(
+        self,
+        client: Client,
+        registry: Registry = REGISTRY,
+        *,
+        interval: float = 10.0,
+        max_packet: int = 1400,
+        collect: Optional[Callable[[], Awaitable[None]]] = None,
+        loop: asyncio.AbstractEventLoop = None,
+    ) -> None:
+        self._client = client
+        self._registry = registry
+        self._interval = interval
+        self._max_packet = max_packet
+        self._collect = collect
+        self._loop = loop or asyncio.get_event_loop()
+        self._task: Optional[asyncio.Future] = None
+        # What each series had reached at the last flush.
+        self._last: Dict[Tuple, Tuple[float, List[int]]] = {}
+
+        self.flushes = 0
+        self.packets = 0
+        self.lines = 0
+
+    def _fields(self, key: Tuple, series) -> Optional[Mapping]:
+        """The fields to send for a series, or None if there is nothing new."""
+        # Values are always sent as floats, so their field type never changes
+        if isinstance(series, Gauge):
+            return {"value": float(series.value)}
+
+        if isinstance(series, Counter):
+            last, _ = self._last.get(key, (0.0, []))
+            self._last[key] = (series.value, [])
+            delta = series.value - last
+            if not delta:
+                return None
+            return {"value": float(delta)}
+
+        if isinstance(series, Histogram):
+            buckets = series.buckets()
+            last_sum, last_counts = self._last.get(key, (0.0, [0] * len(buckets)))
+            self._last[key] = (series.sum, [count for _, count in buckets])
+            new = [
+                (bound, count - last)
+                for (bound, count), last in zip(buckets, last_counts)
+            ]
+            count = sum(n for _, n in new)
+            if not count:
+                return None
+
+            total = float(series.sum - last_sum)
+            fields = {"count": count, "sum": total, "mean": total / count}
+            for q in PERCENTILES:
+                fields[f"p{q}"] = bucket_percentile(new, q)
+            return fields
+
+        return None
+
+    def _lines(self) -> List[str]:
+        tags = self._client.tags
+        lines = []
+        for metric in self._registry:
+            for values, series in metric.series():
+                key = (metric.name, values)
+                fields = self._fields(key, series)
+                if fields is None:
+                    continue
+                line = Line(
+                    metric.name,
+                    fields,
+                    dict(tags, **dict(zip(metric.labelnames, values))),
+                )
+                lines.append(line.to_line_protocol())
+        return lines
+
+    async def flush(self) -> int:
+        """Send what changed since the last flush, returning the packets sent."""
+        if self._collect is not None:
+            await self._collect()
+
+        packets = 0
+        batch: List[str] = []
+        size = 0
+        for line in self._lines():
+            # The client ends every packet with a newline
+            line_size = len(line.encode()) + 1
+            if batch and size + line_size > self._max_packet:
+                self._client.send("\n".join(batch))
+                packets += 1
+                batch, size = [], 0
+            batch.append(line)
+            size += line_size
+            self.lines += 1
+        if batch:
+            self._client.send("\n".join(batch))
+            packets += 1
+
+        self.flushes += 1
+        self.packets += packets
+        return packets
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self._interval)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Failed to send the metrics to Telegraf")
+
+    def start(self) -> None:
+        """Start flushing every interval in the background."""
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run(), loop=self._loop)
+
+    async def close(self) -> None:
+        """Stop flushing, send what is left and close the client."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            await self.flush()
+        finally:
+            await self._client.close()
+
+    def stats(self) -> Mapping:
+        return {"flushes": self.flushes, "packets": self.packets, "lines": self.lines}
@@ -0,0 +1,114 @@
+"""
+Asyncio native Telnyx Call Control client.
+
+Mirrors the small part of the ``telnyx`` SDK that CallControl relies on
+(``Call()``, ``Call.create``, ``speak`` and ``hangup``) but sends the requests
+through a shared aiohttp ClientSession instead of blocking the event loop.
+"""
+
+from typing import Any, Mapping, Optional
+
+import aiohttp
+from aiohttp import ClientSession
+
+TELNYX_API_BASE = "https://api.telnyx.com/v2"
+
+DEFAULT_TIMEOUT = 10
+
+
+class TelnyxAPIError(Exception):
+    """Raised when the Telnyx API answers with a non 2xx status."""
+
+    def __init__(self, status: int, body: Any) -> None:
+        super().__init__(f"Telnyx API error {status}: {body}")
+        self.status = status
+        self.body = body
+
+
+class AsyncCall:
+    """A single call, addressed by its call control id."""
+
+    def __init__(self, client: "AsyncTelnyx", call_control_id: Optional[str] = None):
+        self._client = client
+        self.call_control_id = call_control_id
+
+    async def _action(self, action: str, params: Mapping) -> Mapping:
+        """Send a call command to the Telnyx API."""
+        path = f"/calls/{self.call_control_id}/actions/{action}"
+        return await self._client.post(path, params)
+
+    async def speak(self, **params) -> Mapping:
+        """Speak the given payload in the call."""
+        return await self._action("speak", params)
+
+    async def hangup(self, **params) -> Mapping:
+        """Hang up the call."""
+        return await self._action("hangup", params)
+
+
+class _CallResource:
+    """Callable stand-in for ``telnyx.Call``.
+
+    ``Call()`` builds an empty call object and ``Call.create`` dials a new call.
+    """
+
+    def __init__(self, client: "AsyncTelnyx") -> None:
+        self._client = client
+
+    def __call__(self, call_control_id: Optional[str] = None) -> AsyncCall:
+        return AsyncCall(self._client, call_control_id)
+
+    async def create(self, **params) -> AsyncCall:
+        """Initiate an outbound call and return it."""
+        # Follow the SDK convention of suffixing reserved words.
+        if "from_" in params:
+            params["from"] = params.pop("from_")
+
+        data = await self._client.post("/calls", params)
+
+        return AsyncCall(self._client, data.get("call_control_id"))
+
+
+class AsyncTelnyx:
+    """Telnyx Call Control client that runs on the event loop.
+
+    Uses the given session for every request so that connections to the
+    Telnyx API are pooled and kept alive between calls.
+    """
+
+    def __init__(
+        self,
+        client_session: ClientSession,
+        api_key: str,
+        *,
+        base_url: str = TELNYX_API_BASE,
+        timeout: float = DEFAULT_TIMEOUT,
+    ) -> None:
+        self._client_session = client_session
+        self._base_url = base_url.rstrip("/")
+        self._headers = {
+            "Accept": "application/json",
+            "Authorization": f"Bearer {api_key}",
+        }
+        self._timeout = aiohttp.ClientTimeout(total=timeout)
+        self.Call = _CallResource(self)
+
+    async def post(self, path: str, params: Mapping) -> Mapping:
+        """POST the params as JSON and return the ``data`` of the response."""
+        async with self._client_session.post(
+            self._base_url + path,
+            json=params,
+            headers=self._headers,
+            timeout=self._timeout,
+        ) as resp:
+            try:
+                body = await resp.json(content_type=None)
+            except ValueError:
+                body = await resp.text()
+
+            if resp.status >= 300:
+                raise TelnyxAPIError(resp.status, body)
+
+        if isinstance(body, dict):
+            return body.get("data") or {}
+        return {}
@@ -0,0 +1,359 @@
+"""
+Hierarchical timing wheel scheduler backend.
+
+An alternative to the heap backed UnifiedTimedQueue for very large backlogs.
+Inserting is O(1) and a single long lived task advances the wheel once per tick,
+so bursts of near-term inserts never cancel and recreate tasks.
+"""
+
+import asyncio
+import itertools
+import math
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from {{cookiecutter.app_name}}.infrastructure.call_control import CallControl
+from {{cookiecutter.app_name}}.infrastructure.events import EventBroadcaster
+from {{cookiecutter.app_name}}.infrastructure.persistence import SchedulerJournal
+from {{cookiecutter.app_name}}.infrastructure.rate_limit import SlotAllocator
+from {{cookiecutter.app_name}}.infrastructure.recurrence import Recurring
+from {{cookiecutter.app_name}}.infrastructure.scheduler import (
+    MIN_COMPACTION,
+    DialWorkers,
+    DispatchStats,
+    QueuedMessage,
+    finite_ts,
+    publish_dispatch,
+)
+
+
+class HierarchicalTimingWheel:
+    """A hierarchy of wheels of ``1 << bits`` slots each, indexed by tick.
+
+    Level 0 holds entries expiring within the next ``1 << bits`` ticks, level 1
+    the next ``1 << 2 * bits`` ticks, and so on. Whenever the level 0 wheel
+    wraps around, the matching slot of the level above is cascaded down.
+    Entries further away than the top level can reach wait in its last slot.
+    """
+
+    def __init__(self, levels: int = 4, bits: int = 8, start_tick: int = 0) -> None:
+        self._levels = levels
+        self._bits = bits
+        self._mask = (1 << bits) - 1
+        self._span = 1 << (bits * levels)
+        self._wheels: List[List[List[Tuple[int, Any]]]] = [
+            [[] for _ in range(1 << bits)] for _ in range(levels)
+        ]
+        self._overdue: List[Tuple[int, Any]] = []
+        self._count = 0
+
+        # The next tick to be processed, every earlier tick has been expired.
+        self._base = start_tick
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def base(self) -> int:
+        """The next tick that will be expired."""
+        return self._base
+
+    def reset(self, tick: int) -> None:
+        """Move an empty wheel to the given tick, skipping the ticks in between."""
+        if self._count:
+            raise ValueError("Only an empty wheel can be reset")
+        self._base = tick
+
+    def _place(self, tick: int, entry: Any) -> None:
+        """Put the entry into the slot for its tick, relative to the current base."""
+        delta = tick - self._base
+        if delta < 0:
+            self._overdue.append((tick, entry))
+            return
+
+        # Entries past the reach of the wheels wait at the far end of the top level.
+        if delta >= self._span:
+            slot_tick = self._base + self._span - 1
+            delta = self._span - 1
+        else:
+            slot_tick = tick
+
+        # The level is the number of whole wheels the delta spans.
+        shift = ((delta.bit_length() - 1) // self._bits) * self._bits if delta else 0
+        self._wheels[shift // self._bits][(slot_tick >> shift) & self._mask].append(
+            (tick, entry)
+        )
+
+    def insert(self, tick: int, entry: Any) -> None:
+        """Add an entry that expires at the given tick."""
+        self._place(tick, entry)
+        self._count += 1
+
+    def _cascade(self, level: int, index: int) -> None:
+        """Re-place the entries of an upper level slot into the levels below."""
+        slot = self._wheels[level][index]
+        self._wheels[level][index] = []
+        for tick, entry in slot:
+            self._place(tick, entry)
+
+    def advance(self, tick: int) -> List[Any]:
+        """Expire every tick up to and including the given one.
+
+        Returns the expired entries in tick order.
+        """
+        expired = [entry for _, entry in self._overdue]
+        self._overdue = []
+
+        if not self._count:
+            self._base = max(self._base, tick + 1)
+            return expired
+
+        wheel = self._wheels[0]
+        while self._base <= tick and self._count > len(expired):
+            index = self._base & self._mask
+
+            # The lowest wheel wrapped around, pull the next slot of each level down.
+            if index == 0:
+                for level in range(1, self._levels):
+                    upper = (self._base >> (self._bits * level)) & self._mask
+                    self._cascade(level, upper)
+                    if upper:
+                        break
+
+            slot = wheel[index]
+            if slot:
+                wheel[index] = []
+                for entry_tick, entry in slot:
+                    # Only entries clamped past the reach of the wheels can be early.
+                    if entry_tick > self._base:
+                        self._place(entry_tick, entry)
+                    else:
+                        expired.append(entry)
+
+            self._base += 1
+
+        # Everything left has been expired, skip over the remaining empty ticks.
+        if self._count == len(expired):
+            self._base = max(self._base, tick + 1)
+
+        self._count -= len(expired)
+        return expired
+
+    def entries(self) -> Iterator[Any]:
+        """Iterate over every pending entry, in no particular order."""
+        for _, entry in self._overdue:
+            yield entry
+        for wheel in self._wheels:
+            for slot in wheel:
+                for _, entry in slot:
+                    yield entry
+
+
+class TimingWheelQueue:
+    """Stores items with timestamps in a hierarchical timing wheel.
+
+    Drop-in alternative to UnifiedTimedQueue. Items are dispatched at most one
+    ``tick`` (in seconds) after their timestamp, and never before it.
+
+    Cancelled and rescheduled entries stay in the wheel as tombstones, which are
+    skipped when they expire, until they outnumber the live entries.
+
+    Takes the same ``journal``, ``admission`` and ``events`` options as
+    UnifiedTimedQueue.
+    """
+
+    def __init__(
+        self,
+        handler: CallControl,
+        *,
+        loop: asyncio.AbstractEventLoop = None,
+        concurrency: int = 1,
+        tick: float = 1.0,
+        levels: int = 4,
+        bits: int = 8,
+        journal: SchedulerJournal = None,
+        admission: SlotAllocator = None,
+        events: EventBroadcaster = None,
+    ) -> None:
+        self._tick = tick
+        self._levels = levels
+        self._bits = bits
+        self._wheel = HierarchicalTimingWheel(levels, bits, self._current_tick() + 1)
+        self._entries: Dict[int, QueuedMessage] = {}
+        self._handles = itertools.count(1)
+        self._tombstones = 0
+        self._handler = handler
+        self._task: Optional[asyncio.Future[None]] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop = loop or asyncio.get_event_loop()
+        self._workers = DialWorkers(handler, concurrency, loop=self._loop)
+        self._journal = journal
+        self._admission = admission
+        self._events = events
+        # Counts the changes to the pending items, see UnifiedTimedQueue.
+        self.version = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def stats(self) -> DispatchStats:
+        """Lateness statistics of the dispatched items."""
+        return self._workers.stats
+
+    def _current_tick(self) -> int:
+        """The tick that the current time falls in."""
+        return math.floor(time.time() / self._tick)
+
+    async def _run(self) -> None:
+        """Advance the wheel once per tick, dispatching the expired items."""
+        while True:
+            # Nothing to do, wait for the next put rather than spinning.
+            if not self._wheel:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+
+            now_tick = self._current_tick()
+            for qm in self._wheel.advance(now_tick):
+                if self._entries.get(qm.handle) is not qm:
+                    self._tombstones -= 1
+                    continue
+
+                self._dispatch(qm)
+
+            await asyncio.sleep((now_tick + 1) * self._tick - time.time())
+
+    def _dispatch(self, qm: QueuedMessage) -> None:
+        """Hand an expired entry to the dial workers.
+
+        A recurring entry goes back into the wheel under the same handle for
+        its next occurrence, if it has one.
+        """
+        self.version += 1
+        msg = qm.msg
+        next_qm = None
+        if isinstance(msg, Recurring):
+            self._workers.submit(QueuedMessage(qm.ts, msg.item, qm.handle))
+            next_ts = msg.rule.next_after(max(qm.ts, time.time()))
+            if next_ts is not None:
+                next_qm = QueuedMessage(self._admit(next_ts), msg, qm.handle)
+        else:
+            self._workers.submit(qm)
+
+        if self._events is not None:
+            publish_dispatch(self._events, qm, next_qm)
+        if next_qm is not None:
+            self._insert(next_qm)
+            return
+
+        del self._entries[qm.handle]
+        if self._journal:
+            self._journal.record_dispatch(qm.handle)
+
+    def _insert(self, qm: QueuedMessage) -> None:
+        """Insert an entry into the wheel, starting the tick task if needed."""
+
+        # An idle wheel may be far behind, move it up to now first.
+        if not self._wheel:
+            self._wheel.reset(max(self._wheel.base, self._current_tick() + 1))
+
+        # Round up, so that an item is never dispatched before its timestamp.
+        self.version += 1
+        self._entries[qm.handle] = qm
+        self._wheel.insert(math.ceil(qm.ts / self._tick), qm)
+
+        if self._journal:
+            self._journal.record_put(qm.handle, qm.ts, qm.msg)
+
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run(), loop=self._loop)
+        self._wakeup.set()
+
+    def _bury(self) -> None:
+        """Account for a new tombstone, rebuilding the wheel when there are too many."""
+        self._tombstones += 1
+        if self._tombstones > max(MIN_COMPACTION, len(self._entries)):
+            wheel = HierarchicalTimingWheel(self._levels, self._bits, self._wheel.base)
+            for qm in self._entries.values():
+                wheel.insert(math.ceil(qm.ts / self._tick), qm)
+            self._wheel = wheel
+            self._tombstones = 0
+
+    def _admit(self, ts: float) -> float:
+        """Book a slot for an item due at ts, returning when it will be due."""
+        if self._admission is None:
+            return ts
+        return self._admission.allocate(ts)
+
+    def _release(self, ts: float) -> None:
+        """Give back the slot of an item that is no longer due at ts."""
+        if self._admission is not None:
+            self._admission.release(ts)
+
+    def put(self, item: Any, ts: float) -> int:
+        """Add a new item to the queue and return its handle."""
+        ts = self._admit(finite_ts(ts))
+        handle = next(self._handles)
+        self._insert(QueuedMessage(ts, item, handle))
+        return handle
+
+    def put_many(self, items: Iterable[Tuple[Any, float]]) -> List[int]:
+        """Add (item, ts) pairs to the queue, returning their handles.
+
+        Insertion into the wheel is constant time, so they are simply put in turn.
+        """
+        items = [(item, finite_ts(ts)) for item, ts in items]
+        return [self.put(item, ts) for item, ts in items]
+
+    def get(self, handle: int) -> Optional[QueuedMessage]:
+        """Return the pending item with the given handle, if any."""
+        return self._entries.get(handle)
+
+    def cancel(self, handle: int) -> bool:
+        """Remove a pending item. Returns whether it was still pending."""
+        qm = self._entries.pop(handle, None)
+        if qm is None:
+            return False
+
+        self.version += 1
+        self._release(qm.ts)
+        if self._journal:
+            self._journal.record_cancel(handle)
+        self._bury()
+        return True
+
+    def reschedule(self, handle: int, new_ts: float) -> bool:
+        """Move a pending item to a new timestamp. Returns whether it was pending."""
+        qm = self._entries.get(handle)
+        if qm is None:
+            return False
+
+        finite_ts(new_ts)
+        self._release(qm.ts)
+        self._insert(QueuedMessage(self._admit(new_ts), qm.msg, handle))
+        self._bury()
+        return True
+
+    def items(self) -> Iterator[QueuedMessage]:
+        """Iterate over the queued items, in no particular order."""
+        return iter(self._entries.values())
+
+    def restore(
+        self, entries: Iterable[Tuple[float, Any, int]], next_handle: int
+    ) -> None:
+        """Load (ts, item, handle) entries recovered from a journal."""
+        journal, self._journal = self._journal, None
+        for ts, item, handle in entries:
+            self._insert(QueuedMessage(ts, item, handle))
+            if self._admission is not None:
+                self._admission.occupy(ts)
+        self._journal = journal
+        self._handles = itertools.count(next_handle)
+
+    async def close(self) -> None:
+        """Stop the tick task and the dial workers."""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await self._workers.close()
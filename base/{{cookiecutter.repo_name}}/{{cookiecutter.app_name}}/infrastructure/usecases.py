@@ -1,5 +1,6 @@
+import inspect
 import json
-from typing import Mapping
+from typing import Any, Mapping
 
 from aiohttp import web
 
@@ -24,3 +25,15 @@ async def get_post_params(request: web.Request) -> Mapping:
         raise TypeError
 
     return params
+
+
+async def resolve(result: Any) -> Any:
+    """Wait for a result that may or may not be awaitable.
+
+    The ``telnyx`` SDK returns plain objects, while the AsyncTelnyx client
+    returns coroutines. Likewise a local scheduler answers straight away, while
+    a scheduler owned by another worker answers with coroutines.
+    """
+    if inspect.isawaitable(result):
+        return await result
+    return result
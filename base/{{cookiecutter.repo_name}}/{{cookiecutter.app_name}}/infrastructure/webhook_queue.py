@@ -0,0 +1,162 @@
+"""
+Background processing of Telnyx webhooks.
+
+The webhook handler only parses the event and hands it to the dispatcher, so
+Telnyx gets its response straight away. A pool of workers processes the events,
+each worker owning a bounded queue. Events for the same call always go to the
+same worker, so they are processed in the order they arrived.
+"""
+
+import asyncio
+import collections
+import logging
+import time
+from typing import Deque, List, Mapping, Optional
+
+import attr
+
+from {{cookiecutter.app_name}}.infrastructure.call_control import CallControl
+from {{cookiecutter.app_name}}.infrastructure.metrics import (
+    WEBHOOK_ERRORS,
+    WEBHOOK_SECONDS,
+)
+from {{cookiecutter.app_name}}.infrastructure.scheduler import _percentile
+
+logger = logging.getLogger(__name__)
+
+
+@attr.s(slots=True, frozen=True)
+class WebhookEvent:
+    """A parsed webhook, and the time it was received"""
+
+    call_control_id = attr.ib()
+    event_type = attr.ib()
+    received = attr.ib(factory=time.time)
+
+
+class WebhookStats:
+    """Tracks how many webhooks were handled and how long they took."""
+
+    __slots__ = ("accepted", "rejected", "processed", "failed", "waits", "durations")
+
+    def __init__(self, window: int = 1000) -> None:
+        self.accepted = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+        self.waits: Deque[float] = collections.deque(maxlen=window)
+        self.durations: Deque[float] = collections.deque(maxlen=window)
+
+    def record(self, wait: float, duration: float, failed: bool) -> None:
+        """Record the queueing and processing time in seconds of one webhook."""
+        self.processed += 1
+        if failed:
+            self.failed += 1
+        self.waits.append(wait)
+        self.durations.append(duration)
+
+    def as_dict(self) -> Mapping:
+        """Summarise the webhooks seen so far, percentiles are over recent ones."""
+        waits = sorted(self.waits)
+        durations = sorted(self.durations)
+        return {
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "processed": self.processed,
+            "failed": self.failed,
+            "p50_wait": _percentile(waits, 50),
+            "p99_wait": _percentile(waits, 99),
+            "p50_duration": _percentile(durations, 50),
+            "p99_duration": _percentile(durations, 99),
+        }
+
+
+class WebhookDispatcher:
+    """Processes webhooks on a pool of ``workers`` background workers.
+
+    Each worker has a queue of at most ``max_pending / workers`` events.
+    ``submit`` raises asyncio.QueueFull rather than waiting when the queue
+    for the call is full, so the caller can ask Telnyx to retry later.
+    """
+
+    def __init__(
+        self,
+        handler: CallControl,
+        *,
+        workers: int = 8,
+        max_pending: int = 1000,
+        loop: asyncio.AbstractEventLoop = None,
+    ) -> None:
+        self._handler = handler
+        self._worker_count = max(1, workers)
+        self._shard_size = max(1, max_pending // self._worker_count)
+        self._loop = loop or asyncio.get_event_loop()
+        self._queues: List[asyncio.Queue] = []
+        self._workers: List[asyncio.Future] = []
+        self.stats = WebhookStats()
+
+    def __len__(self) -> int:
+        """Number of events waiting for a worker."""
+        return sum(queue.qsize() for queue in self._queues)
+
+    def _start(self) -> None:
+        """Start the workers the first time something is submitted."""
+        self._queues = [
+            asyncio.Queue(maxsize=self._shard_size) for _ in range(self._worker_count)
+        ]
+        self._workers = [
+            asyncio.ensure_future(self._work(queue), loop=self._loop)
+            for queue in self._queues
+        ]
+
+    async def _work(self, queue: asyncio.Queue) -> None:
+        """Process the events of one queue one at a time."""
+        while True:
+            event = await queue.get()
+            started = time.time()
+            failed = False
+
+            try:
+                await self._handler.process_webhook(
+                    event.call_control_id, event.event_type
+                )
+            except Exception:
+                failed = True
+                logger.exception(
+                    "Failed to process %s webhook for %s",
+                    event.event_type,
+                    event.call_control_id,
+                )
+            finally:
+                duration = time.time() - started
+                self.stats.record(started - event.received, duration, failed)
+                WEBHOOK_SECONDS.labels(event.event_type).observe(duration)
+                if failed:
+                    WEBHOOK_ERRORS.labels(event.event_type).inc()
+                queue.task_done()
+
+    def submit(self, call_control_id: Optional[str], event_type: str) -> None:
+        """Queue a webhook for processing, raising asyncio.QueueFull if busy."""
+        if not self._queues:
+            self._start()
+
+        queue = self._queues[hash(call_control_id) % self._worker_count]
+        try:
+            queue.put_nowait(WebhookEvent(call_control_id, event_type))
+        except asyncio.QueueFull:
+            self.stats.rejected += 1
+            raise
+        self.stats.accepted += 1
+
+    async def join(self) -> None:
+        """Wait until every queued event has been processed."""
+        for queue in self._queues:
+            await queue.join()
+
+    async def close(self) -> None:
+        """Stop the workers, abandoning anything not yet processed."""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queues = []
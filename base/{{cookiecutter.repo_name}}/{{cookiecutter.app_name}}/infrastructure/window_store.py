@@ -0,0 +1,355 @@
+"""
+Windowed scheduler backed by SQLite.
+
+Every scheduled call is stored in an on-disk SQLite table indexed by timestamp,
+but only the calls due within the next ``window`` seconds are held in the
+in-memory heap. A background task slides the window forward ahead of time, so
+memory stays flat however far ahead calls are booked.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import sqlite3
+import time
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Tuple
+
+from {{cookiecutter.app_name}}.infrastructure.call_control import CallControl
+from {{cookiecutter.app_name}}.infrastructure.events import EventBroadcaster
+from {{cookiecutter.app_name}}.infrastructure.rate_limit import SlotAllocator
+from {{cookiecutter.app_name}}.infrastructure.scheduler import (
+    QueuedMessage,
+    UnifiedTimedQueue,
+    finite_ts,
+)
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS scheduled_calls (
+    handle INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    msg TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS scheduled_calls_ts ON scheduled_calls (ts);
+"""
+
+# A stored item: (ts, msg, handle)
+Entry = Tuple[float, Any, int]
+
+
+class SQLiteCallStore:
+    """Scheduled calls on disk, keyed by handle and indexed by timestamp.
+
+    Implements the scheduler journal interface, so every put, dispatch and
+    cancel made through UnifiedTimedQueue is written through to the table.
+    The database runs in WAL mode with each statement committed on its own,
+    which keeps single row writes in the tens of microseconds.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        encode: Callable[[Any], str] = str,
+        decode: Callable[[str], Any] = str,
+    ) -> None:
+        self._encode = encode
+        self._decode = decode
+        self._db = sqlite3.connect(path, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+
+    def record_put(self, handle: int, ts: float, msg: Any) -> None:
+        """Store a new item, or move an existing one."""
+        self._db.execute(
+            "INSERT OR REPLACE INTO scheduled_calls (handle, ts, msg) VALUES (?, ?, ?)",
+            (handle, ts, self._encode(msg)),
+        )
+
+    def record_put_many(self, entries: Iterable[Entry]) -> None:
+        """Store (ts, msg, handle) entries in a single transaction."""
+        self._db.execute("BEGIN")
+        try:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO scheduled_calls (handle, ts, msg) "
+                "VALUES (?, ?, ?)",
+                ((handle, ts, self._encode(msg)) for ts, msg, handle in entries),
+            )
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+
+    def record_dispatch(self, handle: int) -> None:
+        """Forget an item that has been handed to the dial workers."""
+        self.delete(handle)
+
+    def record_cancel(self, handle: int) -> None:
+        """Forget a cancelled item."""
+        self.delete(handle)
+
+    def delete(self, handle: int) -> bool:
+        """Remove an item, returning whether it was stored."""
+        cursor = self._db.execute(
+            "DELETE FROM scheduled_calls WHERE handle = ?", (handle,)
+        )
+        return cursor.rowcount > 0
+
+    def get(self, handle: int) -> Optional[Entry]:
+        """Return the stored item with the given handle, if any."""
+        row = self._db.execute(
+            "SELECT ts, msg FROM scheduled_calls WHERE handle = ?", (handle,)
+        ).fetchone()
+        if row is None:
+            return None
+        return row[0], self._decode(row[1]), handle
+
+    def count(self) -> int:
+        """Number of stored items."""
+        return self._db.execute("SELECT COUNT(*) FROM scheduled_calls").fetchone()[0]
+
+    def next_handle(self) -> int:
+        """The handle after the highest stored one."""
+        row = self._db.execute("SELECT MAX(handle) FROM scheduled_calls").fetchone()
+        return (row[0] or 0) + 1
+
+    def after(
+        self, ts: float, handle: int, end: float, limit: int = -1
+    ) -> Iterator[Entry]:
+        """Stored items ordered after (ts, handle) and due before end, in time order.
+
+        Rows are decoded lazily as the iterator is consumed.
+        """
+        rows = self._db.execute(
+            "SELECT ts, msg, handle FROM scheduled_calls "
+            "WHERE ts < ? AND (ts > ? OR (ts = ? AND handle > ?)) "
+            "ORDER BY ts, handle LIMIT ?",
+            (end, ts, ts, handle, limit),
+        )
+        return ((ts, self._decode(msg), handle) for ts, msg, handle in rows)
+
+    def close(self) -> None:
+        self._db.close()
+
+
+class WindowedTimedQueue(UnifiedTimedQueue):
+    """A UnifiedTimedQueue that only keeps the near-term calls in memory.
+
+    All calls are written through to the SQLite store. The heap holds exactly
+    the calls due before ``horizon``, and every ``window / 4`` seconds the
+    horizon is moved to ``window`` seconds from now and the calls that entered
+    the window are loaded from the store.
+    """
+
+    def __init__(
+        self,
+        handler: CallControl,
+        store: SQLiteCallStore,
+        *,
+        loop: asyncio.AbstractEventLoop = None,
+        concurrency: int = 1,
+        window: float = 600,
+        batch_size: int = 10000,
+        admission: SlotAllocator = None,
+        events: EventBroadcaster = None,
+    ) -> None:
+        super().__init__(
+            handler,
+            loop=loop,
+            concurrency=concurrency,
+            journal=store,
+            admission=admission,
+            events=events,
+        )
+        self._store = store
+        self._window = window
+        self._batch_size = batch_size
+        self._horizon = time.time() + window
+        self._outside = 0
+        self._refill_task: Optional[asyncio.Future[None]] = None
+
+    def __len__(self) -> int:
+        return len(self._entries) + self._outside
+
+    def load(self) -> None:
+        """Load the window from the store and start sliding it forward."""
+        self.restore(
+            self._store.after(float("-inf"), 0, self._horizon),
+            self._store.next_handle(),
+        )
+        self._outside = self._store.count() - len(self._entries)
+
+        # Calls outside the window hold their slots too.
+        if self._admission is not None:
+            for ts, _, _ in self._store.after(self._horizon, 0, float("inf")):
+                self._admission.occupy(ts)
+        self._refill_task = asyncio.ensure_future(self._refill(), loop=self._loop)
+
+    async def _refill(self) -> None:
+        """Periodically move the horizon forward, loading the calls it passes."""
+        while True:
+            await asyncio.sleep(self._window / 4)
+            try:
+                await self._slide(time.time() + self._window)
+            except Exception:
+                logger.exception("Failed to refill the scheduler window")
+
+    async def _slide(self, new_horizon: float) -> None:
+        """Load the calls due before the new horizon, a batch at a time."""
+        start, self._horizon = self._horizon, max(self._horizon, new_horizon)
+        last_handle = 0
+
+        while True:
+            batch = list(
+                self._store.after(start, last_handle, self._horizon, self._batch_size)
+            )
+            for ts, msg, handle in batch:
+                # Calls put or moved since the horizon changed are already in memory.
+                if handle not in self._entries:
+                    self._push(QueuedMessage(ts, msg, handle))
+                    self._outside -= 1
+
+            if len(batch) < self._batch_size:
+                return
+
+            # Continue after the last item, letting other tasks run in between.
+            start, _, last_handle = batch[-1]
+            await asyncio.sleep(0)
+
+    def put(self, item: Any, ts: float) -> int:
+        """Add a new item, keeping it only on disk if it is outside the window."""
+        if finite_ts(ts) < self._horizon:
+            return super().put(item, ts)
+
+        handle = next(self._handles)
+        ts = self._admit(ts)
+        self._store.record_put(handle, ts, item)
+        self._outside += 1
+        self.version += 1
+        return handle
+
+    def put_many(self, items: Iterable[Tuple[Any, float]]) -> List[int]:
+        """Add (item, ts) pairs, returning their handles.
+
+        The ones outside the window are stored in a single transaction.
+        """
+        items = [(item, finite_ts(ts)) for item, ts in items]
+        inside = []
+        outside = []
+        handles: List[Optional[int]] = []
+        for item, ts in items:
+            if ts < self._horizon:
+                inside.append((item, ts))
+                handles.append(None)
+            else:
+                handle = next(self._handles)
+                outside.append((self._admit(ts), item, handle))
+                handles.append(handle)
+
+        self._store.record_put_many(outside)
+        self._outside += len(outside)
+        self.version += 1
+
+        inside_handles = iter(super().put_many(inside))
+        return [
+            handle if handle is not None else next(inside_handles) for handle in handles
+        ]
+
+    def _requeue(self, qm: QueuedMessage) -> None:
+        """Put an entry back, keeping it only on disk if it is outside the window."""
+        if qm.ts < self._horizon:
+            super()._requeue(qm)
+            return
+
+        del self._entries[qm.handle]
+        self._store.record_put(qm.handle, qm.ts, qm.msg)
+        self._outside += 1
+
+    def get(self, handle: int) -> Optional[QueuedMessage]:
+        """Return the pending item with the given handle, if any."""
+        qm = super().get(handle)
+        if qm is not None:
+            return qm
+
+        entry = self._store.get(handle)
+        return QueuedMessage(*entry) if entry else None
+
+    def cancel(self, handle: int) -> bool:
+        """Remove a pending item. Returns whether it was still pending."""
+        if super().cancel(handle):
+            return True
+
+        entry = self._store.get(handle)
+        if entry is not None and self._store.delete(handle):
+            self._release(entry[0])
+            self._outside -= 1
+            self.version += 1
+            return True
+        return False
+
+    def reschedule(self, handle: int, new_ts: float) -> bool:
+        """Move a pending item to a new timestamp. Returns whether it was pending."""
+        qm = self.get(handle)
+        if qm is None:
+            return False
+
+        finite_ts(new_ts)
+        in_window = handle in self._entries
+        if in_window and new_ts < self._horizon:
+            return super().reschedule(handle, new_ts)
+
+        self._release(qm.ts)
+        new_ts = self._admit(new_ts)
+        if new_ts < self._horizon:
+            # Bring the call into the window.
+            self._push(QueuedMessage(new_ts, qm.msg, handle))
+            self._outside -= 1
+        elif in_window:
+            # Push the call out of the window.
+            del self._entries[handle]
+            self._bury()
+            self._outside += 1
+
+        self._store.record_put(handle, new_ts, qm.msg)
+        self.version += 1
+        return True
+
+    def items(self) -> Iterator[QueuedMessage]:
+        """Iterate over the items in the window, then the ones on disk."""
+        outside = (
+            QueuedMessage(*entry)
+            for entry in self._store.after(self._horizon, 0, float("inf"))
+        )
+        return itertools.chain(super().items(), outside)
+
+    def page(
+        self, after: Optional[Tuple[float, int]], limit: int
+    ) -> List[QueuedMessage]:
+        """The first limit items ordered after (ts, handle), in time order.
+
+        The window's items all come before the ones on disk, so those are only
+        read from the store's ts index once the window runs out.
+        """
+        key = after or (float("-inf"), 0)
+        inside = heapq.nsmallest(
+            limit,
+            (qm for qm in self._entries.values() if (qm.ts, qm.handle) > key),
+            key=lambda qm: (qm.ts, qm.handle),
+        )
+        if len(inside) == limit:
+            return inside
+
+        ts, handle = max(key, (self._horizon, 0))
+        outside = self._store.after(ts, handle, float("inf"), limit - len(inside))
+        return inside + [QueuedMessage(*entry) for entry in outside]
+
+    async def close(self) -> None:
+        """Stop refilling, the sleep task and the dial workers."""
+        if self._refill_task:
+            self._refill_task.cancel()
+            self._refill_task = None
+        await super().close()
+        self._store.close()
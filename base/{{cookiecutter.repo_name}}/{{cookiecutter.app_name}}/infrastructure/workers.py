@@ -0,0 +1,406 @@
+"""
+Sharing the call scheduler between pre-forked worker processes.
+
+In worker mode several processes serve HTTP on the same port. Exactly one of
+them, elected with a file lock, owns the call scheduler and dials the calls.
+The others forward their schedule changes to it over a Unix socket, and take
+over when it dies, since the operating system releases its lock.
+"""
+
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import struct
+import time
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+)
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct("!I")
+
+
+class SchedulerUnavailable(Exception):
+    """No worker answered for the call scheduler in time."""
+
+
+class OwnerLock:
+    """An exclusive lock on a file, held until released or the process exits."""
+
+    def __init__(self, path: str) -> None:
+        self._path = path
+        self._fd: Optional[int] = None
+
+    @property
+    def held(self) -> bool:
+        return self._fd is not None
+
+    def acquire(self) -> bool:
+        """Try to take the lock without waiting. Returns whether it is held."""
+        if self._fd is not None:
+            return True
+
+        fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+
+        # Leave the owner's pid in the file, for whoever is debugging.
+        os.ftruncate(fd, 0)
+        os.write(fd, f"{os.getpid()}\n".encode())
+        self._fd = fd
+        return True
+
+    def release(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+def _frame(obj: Any) -> bytes:
+    body = json.dumps(obj).encode()
+    return _HEADER.pack(len(body)) + body
+
+
+async def _read_frame(reader: asyncio.StreamReader) -> Optional[Any]:
+    """Read a length prefixed JSON message, or None at the end of the stream."""
+    try:
+        header = await reader.readexactly(_HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            raise
+        return None
+    (size,) = _HEADER.unpack(header)
+    return json.loads(await reader.readexactly(size))
+
+
+class SchedulerServer:
+    """Serves a local scheduler to the other workers over a Unix socket.
+
+    Scheduled items travel as ``encode(item)``, and are turned back into items
+    with ``decode``.
+    """
+
+    def __init__(
+        self,
+        scheduler,
+        path: str,
+        *,
+        encode: Callable[[Any], Any],
+        decode: Callable[[Any], Any],
+    ) -> None:
+        self._scheduler = scheduler
+        self._path = path
+        self._encode = encode
+        self._decode = decode
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._clients: Set[asyncio.StreamWriter] = set()
+
+    async def start(self) -> None:
+        # Whoever held the socket before has lost the lock, so it can go.
+        if os.path.exists(self._path):
+            os.unlink(self._path)
+        self._server = await asyncio.start_unix_server(self._serve, path=self._path)
+
+    def _encode_entry(self, qm) -> List:
+        return [qm.ts, self._encode(qm.msg), qm.handle]
+
+    def _apply(self, op: str, args: List) -> Any:
+        scheduler = self._scheduler
+        if op == "put":
+            return scheduler.put(self._decode(args[0]), args[1])
+        if op == "put_many":
+            return scheduler.put_many((self._decode(msg), ts) for msg, ts in args[0])
+        if op == "get":
+            qm = scheduler.get(args[0])
+            return self._encode_entry(qm) if qm is not None else None
+        if op == "cancel":
+            return scheduler.cancel(args[0])
+        if op == "reschedule":
+            return scheduler.reschedule(args[0], args[1])
+        if op == "items":
+            return [self._encode_entry(qm) for qm in scheduler.items()]
+        if op == "stats":
+            return dict(pending=len(scheduler), **scheduler.stats.as_dict())
+        raise ValueError(f"Unknown scheduler operation {op!r}")
+
+    async def _serve(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        self._clients.add(writer)
+        try:
+            while True:
+                request = await _read_frame(reader)
+                if request is None:
+                    break
+
+                try:
+                    response = {"result": self._apply(request["op"], request["args"])}
+                except Exception as e:
+                    logger.exception("Forwarded scheduler request failed")
+                    response = {"error": repr(e)}
+
+                writer.write(_frame(response))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._clients.discard(writer)
+            writer.close()
+
+    async def close(self) -> None:
+        """Stop serving, hanging up on the workers connected."""
+        if self._server is not None:
+            self._server.close()
+            for writer in list(self._clients):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+        if os.path.exists(self._path):
+            os.unlink(self._path)
+
+
+class RemoteEntry:
+    """A scheduled item as reported by the worker or node that holds it"""
+
+    __slots__ = ("ts", "msg", "handle")
+
+    def __init__(self, ts: float, msg: Any, handle: int) -> None:
+        self.ts = ts
+        self.msg = msg
+        self.handle = handle
+
+
+class RemoteScheduler:
+    """Forwards scheduler operations to the owner over a Unix socket.
+
+    Requests are sent one at a time over a single connection. While the owner
+    is failing over, requests are retried for up to ``timeout`` seconds before
+    SchedulerUnavailable is raised. A put that reached the old owner just
+    before it died may therefore be applied twice.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        encode: Callable[[Any], Any],
+        decode: Callable[[Any], Any],
+        timeout: float = 10.0,
+    ) -> None:
+        self._path = path
+        self._encode = encode
+        self._decode = decode
+        self._timeout = timeout
+        self._lock = asyncio.Lock()
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+
+    def _disconnect(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def _call(self, op: str, *args: Any) -> Any:
+        deadline = time.monotonic() + self._timeout
+        async with self._lock:
+            while True:
+                try:
+                    if self._writer is None:
+                        self._reader, self._writer = await asyncio.open_unix_connection(
+                            self._path
+                        )
+                    self._writer.write(_frame({"op": op, "args": args}))
+                    await self._writer.drain()
+                    response = await _read_frame(self._reader)
+                    if response is not None:
+                        break
+                except (OSError, asyncio.IncompleteReadError):
+                    pass
+
+                self._disconnect()
+                if time.monotonic() >= deadline:
+                    raise SchedulerUnavailable(f"No scheduler at {self._path}")
+                await asyncio.sleep(0.1)
+
+        if "error" in response:
+            raise RuntimeError(f"Scheduler {op} failed: {response['error']}")
+        return response["result"]
+
+    def _decode_entry(self, entry: Optional[List]) -> Optional[RemoteEntry]:
+        if entry is None:
+            return None
+        ts, msg, handle = entry
+        return RemoteEntry(ts, self._decode(msg), handle)
+
+    async def put(self, item: Any, ts: float) -> int:
+        return await self._call("put", self._encode(item), ts)
+
+    async def put_many(self, items: Iterable[Tuple[Any, float]]) -> List[int]:
+        return await self._call(
+            "put_many", [[self._encode(item), ts] for item, ts in items]
+        )
+
+    async def get(self, handle: int) -> Optional[RemoteEntry]:
+        return self._decode_entry(await self._call("get", handle))
+
+    async def cancel(self, handle: int) -> bool:
+        return await self._call("cancel", handle)
+
+    async def reschedule(self, handle: int, new_ts: float) -> bool:
+        return await self._call("reschedule", handle, new_ts)
+
+    async def items(self) -> List[RemoteEntry]:
+        return [self._decode_entry(entry) for entry in await self._call("items")]
+
+    async def stats(self) -> Mapping:
+        return await self._call("stats")
+
+    def close(self) -> None:
+        self._disconnect()
+
+
+# Builds the local scheduler when a worker becomes the owner, returning it
+# together with a coroutine function that closes it.
+TakeOver = Callable[[], Awaitable[Tuple[Any, Callable[[], Awaitable[None]]]]]
+
+
+class SchedulerProxy:
+    """The call scheduler as seen by one worker.
+
+    The worker that holds the lock at ``lock_path`` owns the scheduler, built
+    with ``take_over``, and serves it at ``socket_path``. The other workers
+    forward to it, and try to take the lock every ``election_interval``
+    seconds, so one of them takes over when the owner dies. The schedule then
+    carries on from the journal or store, if the scheduler has one.
+
+    The methods answer straight away in the owner, and with a coroutine in the
+    other workers.
+    """
+
+    def __init__(
+        self,
+        lock_path: str,
+        socket_path: str,
+        take_over: TakeOver,
+        *,
+        encode: Callable[[Any], Any],
+        decode: Callable[[Any], Any],
+        election_interval: float = 1.0,
+        timeout: float = 10.0,
+        loop: asyncio.AbstractEventLoop = None,
+    ) -> None:
+        self._lock = OwnerLock(lock_path)
+        self._socket_path = socket_path
+        self._take_over = take_over
+        self._encode = encode
+        self._decode = decode
+        self._election_interval = election_interval
+        self._loop = loop or asyncio.get_event_loop()
+        self._remote = RemoteScheduler(
+            socket_path, encode=encode, decode=decode, timeout=timeout
+        )
+        self._server: Optional[SchedulerServer] = None
+        self._close_local: Optional[Callable[[], Awaitable[None]]] = None
+        self._campaign_task: Optional[asyncio.Future] = None
+
+        self.local = None
+
+    @property
+    def owner(self) -> bool:
+        """Whether this worker owns the scheduler."""
+        return self.local is not None
+
+    @property
+    def version(self) -> Optional[int]:
+        """The version of the scheduler, when this worker owns it."""
+        return self.local.version if self.local is not None else None
+
+    async def start(self) -> None:
+        """Become the owner if no other worker is, or wait for the chance to."""
+        if not await self._elect():
+            self._campaign_task = asyncio.ensure_future(
+                self._campaign(), loop=self._loop
+            )
+
+    async def _elect(self) -> bool:
+        if not self._lock.acquire():
+            return False
+
+        logger.info("Worker %d owns the call scheduler", os.getpid())
+        local, self._close_local = await self._take_over()
+        self._server = SchedulerServer(
+            local, self._socket_path, encode=self._encode, decode=self._decode
+        )
+        await self._server.start()
+        self.local = local
+        return True
+
+    async def _campaign(self) -> None:
+        while not await self._elect():
+            await asyncio.sleep(self._election_interval)
+        self._campaign_task = None
+
+    def put(self, item: Any, ts: float):
+        if self.local is not None:
+            return self.local.put(item, ts)
+        return self._remote.put(item, ts)
+
+    def put_many(self, items: Iterable[Tuple[Any, float]]):
+        if self.local is not None:
+            return self.local.put_many(items)
+        return self._remote.put_many(items)
+
+    def get(self, handle: int):
+        if self.local is not None:
+            return self.local.get(handle)
+        return self._remote.get(handle)
+
+    def cancel(self, handle: int):
+        if self.local is not None:
+            return self.local.cancel(handle)
+        return self._remote.cancel(handle)
+
+    def reschedule(self, handle: int, new_ts: float):
+        if self.local is not None:
+            return self.local.reschedule(handle, new_ts)
+        return self._remote.reschedule(handle, new_ts)
+
+    def items(self):
+        if self.local is not None:
+            return self.local.items()
+        return self._remote.items()
+
+    async def info(self) -> Mapping:
+        """The scheduler stats from the owner, and which worker that is."""
+        if self.local is not None:
+            stats = dict(pending=len(self.local), **self.local.stats.as_dict())
+        else:
+            stats = await self._remote.stats()
+        return dict(stats, worker=os.getpid(), owner=self.owner)
+
+    async def close(self) -> None:
+        """Stop campaigning, or hand the scheduler over to the next worker."""
+        if self._campaign_task is not None:
+            self._campaign_task.cancel()
+            self._campaign_task = None
+        self._remote.close()
+
+        if self.local is not None:
+            await self._server.close()
+            await self._close_local()
+            self.local = None
+        self._lock.release()
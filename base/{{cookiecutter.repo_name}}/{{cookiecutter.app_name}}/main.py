@@ -10,19 +10,277 @@ import os
 import signal
 import socket
 import sys
+import time
 from pathlib import Path
-from typing import Mapping
+from typing import Awaitable, Callable, Mapping, Optional, Tuple
 
 import aiohttp
 from aiohttp import web
 import aiohttp_jinja2
+import aiotelegraf
 import jinja2
 import telnyx
 
 from {{cookiecutter.app_name}}.infrastructure import constants
 from {{cookiecutter.app_name}}.infrastructure import server
-from {{cookiecutter.app_name}}.infrastructure.call_control import CallControl
+from {{cookiecutter.app_name}}.infrastructure.cache import TTLMap
+from {{cookiecutter.app_name}}.infrastructure.call_control import (
+    CallControl,
+    discard_prefetch,
+)
+from {{cookiecutter.app_name}}.infrastructure.call_state import CallStateTable
+from {{cookiecutter.app_name}}.infrastructure.circuit_breaker import CircuitBreaker
+from {{cookiecutter.app_name}}.infrastructure.dedupe import WebhookDeduplicator
+from {{cookiecutter.app_name}}.infrastructure.events import EventBroadcaster
+from {{cookiecutter.app_name}}.infrastructure.jokes import (
+    JokePool,
+    JokeSource,
+    load_corpus,
+)
+from {{cookiecutter.app_name}}.infrastructure.listing import ScheduleListing
+from {{cookiecutter.app_name}}.infrastructure.loop_monitor import LoopMonitor
+from {{cookiecutter.app_name}}.infrastructure.number_pool import RoutePool
+from {{cookiecutter.app_name}}.infrastructure.numbers import NumberNormaliser
+from {{cookiecutter.app_name}}.infrastructure.persistence import SchedulerJournal
+from {{cookiecutter.app_name}}.infrastructure.profiling import Profiler
+from {{cookiecutter.app_name}}.infrastructure.rate_limit import (
+    DialRateLimiter,
+    SlotAllocator,
+)
+from {{cookiecutter.app_name}}.infrastructure.recurrence import (
+    decode_message,
+    encode_message,
+)
 from {{cookiecutter.app_name}}.infrastructure.scheduler import UnifiedTimedQueue
+from {{cookiecutter.app_name}}.infrastructure.server.health_handlers import (
+    update_queue_gauges,
+)
+from {{cookiecutter.app_name}}.infrastructure.sharding import ShardedScheduler
+from {{cookiecutter.app_name}}.infrastructure.telegraf import TelegrafExporter
+from {{cookiecutter.app_name}}.infrastructure.telnyx_client import AsyncTelnyx
+from {{cookiecutter.app_name}}.infrastructure.timing_wheel import TimingWheelQueue
+from {{cookiecutter.app_name}}.infrastructure.webhook_queue import WebhookDispatcher
+from {{cookiecutter.app_name}}.infrastructure.window_store import (
+    SQLiteCallStore,
+    WindowedTimedQueue,
+)
+from {{cookiecutter.app_name}}.infrastructure.workers import SchedulerProxy
+
+
+def create_journal(persistence_conf: Mapping) -> Optional[SchedulerJournal]:
+    """Build the scheduler journal, if persistence is enabled in the config."""
+    if not persistence_conf.get("enabled", False):
+        return None
+
+    return SchedulerJournal(
+        persistence_conf["directory"],
+        encode=encode_message,
+        decode=decode_message,
+        flush_interval=persistence_conf.get("flush_interval", 0.05),
+        compact_bytes=persistence_conf.get("compact_bytes", 64 * 1024 * 1024),
+    )
+
+
+def create_joke_source(
+    client_session: aiohttp.ClientSession, joke_url: str, joke_api_conf: Mapping
+) -> JokeSource:
+    """Build the joke API client, with its circuit breaker and local corpus."""
+    corpus_path = joke_api_conf.get("corpus_path")
+    corpus = load_corpus(corpus_path) if corpus_path else []
+
+    breaker = CircuitBreaker(
+        failure_threshold=joke_api_conf.get("failure_threshold", 5),
+        reset_timeout=joke_api_conf.get("reset_timeout", 30),
+        half_open_calls=joke_api_conf.get("half_open_calls", 1),
+    )
+    return JokeSource(
+        client_session,
+        joke_url,
+        timeout=joke_api_conf.get("timeout", 2.0),
+        hedge_delay=joke_api_conf.get("hedge_delay", 0.5),
+        hedge_attempts=joke_api_conf.get("hedge_attempts", 2),
+        breaker=breaker,
+        corpus=corpus,
+    )
+
+
+def create_joke_pool(
+    joke_source: JokeSource, joke_pool_conf: Mapping
+) -> Optional[JokePool]:
+    """Build the pool of pre-fetched jokes, unless it is disabled in the config."""
+    if not joke_pool_conf.get("enabled", True):
+        return None
+
+    return JokePool(
+        joke_source.fetch,
+        size=joke_pool_conf.get("size", 50),
+        max_age=joke_pool_conf.get("max_age", 3600),
+        max_uses=joke_pool_conf.get("max_uses", 1),
+        refill_interval=joke_pool_conf.get("refill_interval", 5),
+        concurrency=joke_pool_conf.get("fetch_concurrency", 4),
+    )
+
+
+def create_scheduler(
+    call_control_app: CallControl,
+    scheduler_conf: Mapping,
+    journal: Optional[SchedulerJournal] = None,
+    events: Optional[EventBroadcaster] = None,
+):
+    """Build the call scheduler backend selected in the config."""
+    backend = scheduler_conf.get("backend", "heap")
+    concurrency = scheduler_conf.get("dispatch_concurrency", 1)
+
+    # Spread scheduled calls out so no more than admission_cps are due each second
+    admission = None
+    if scheduler_conf.get("admission_cps", 0):
+        admission = SlotAllocator(scheduler_conf["admission_cps"])
+
+    if backend == "heap":
+        return UnifiedTimedQueue(
+            call_control_app,
+            concurrency=concurrency,
+            journal=journal,
+            admission=admission,
+            events=events,
+        )
+
+    if backend == "timing_wheel":
+        return TimingWheelQueue(
+            call_control_app,
+            concurrency=concurrency,
+            tick=scheduler_conf.get("tick_seconds", 1.0),
+            journal=journal,
+            admission=admission,
+            events=events,
+        )
+
+    if backend == "windowed":
+        # Every call is written through to the store, a journal would be redundant.
+        if journal:
+            raise ValueError("The windowed scheduler backend does not use a journal")
+
+        store_path = Path(scheduler_conf.get("store_path", "data/scheduler.db"))
+        store_path.parent.mkdir(parents=True, exist_ok=True)
+        store = SQLiteCallStore(
+            str(store_path), encode=encode_message, decode=decode_message
+        )
+        return WindowedTimedQueue(
+            call_control_app,
+            store,
+            concurrency=concurrency,
+            window=scheduler_conf.get("window_seconds", 600),
+            admission=admission,
+            events=events,
+        )
+
+    raise ValueError(f"Unknown scheduler backend {backend!r}")
+
+
+def start_scheduler(
+    call_control_app: CallControl,
+    conf: Mapping,
+    events: Optional[EventBroadcaster] = None,
+) -> Tuple[UnifiedTimedQueue, Callable[[], Awaitable[None]]]:
+    """Build the call scheduler and rebuild the schedule from the last run.
+
+    Returns the scheduler, and a coroutine function that closes it.
+    """
+    journal = create_journal(conf.get("persistence", {}))
+    call_scheduler = create_scheduler(
+        call_control_app, conf.get("scheduler", {}), journal, events
+    )
+
+    if journal:
+        entries, next_handle = journal.recover()
+        call_scheduler.restore(entries, next_handle)
+        journal.start(call_scheduler.items)
+    elif isinstance(call_scheduler, WindowedTimedQueue):
+        call_scheduler.load()
+
+    async def close():
+        await call_scheduler.close()
+        if journal:
+            await journal.close()
+
+    return call_scheduler, close
+
+
+def create_scheduler_proxy(
+    call_control_app: CallControl,
+    conf: Mapping,
+    events: Optional[EventBroadcaster] = None,
+) -> SchedulerProxy:
+    """Share the call scheduler between the workers, one of which owns it."""
+    workers_conf = conf.get("workers", {})
+    lock_path = Path(workers_conf.get("lock_path", "data/scheduler.lock"))
+    socket_path = Path(workers_conf.get("socket_path", "data/scheduler.sock"))
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    socket_path.parent.mkdir(parents=True, exist_ok=True)
+
+    async def take_over():
+        return start_scheduler(call_control_app, conf, events)
+
+    return SchedulerProxy(
+        str(lock_path),
+        str(socket_path),
+        take_over,
+        encode=encode_message,
+        decode=decode_message,
+        election_interval=workers_conf.get("election_interval", 1.0),
+        timeout=workers_conf.get("forward_timeout", 10.0),
+    )
+
+
+async def start_telegraf_exporter(
+    app: web.Application, telegraf_conf: Mapping
+) -> Optional[TelegrafExporter]:
+    """Start pushing the metrics to Telegraf, if it is enabled in the config."""
+    if not telegraf_conf.get("enabled", False):
+        return None
+
+    client = aiotelegraf.Client(
+        host=telegraf_conf.get("host", "localhost"),
+        port=telegraf_conf.get("port", 8094),
+        tags=telegraf_conf.get("tags", {}),
+    )
+    await client.connect()
+
+    exporter = TelegrafExporter(
+        client,
+        interval=telegraf_conf.get("interval", 10.0),
+        max_packet=telegraf_conf.get("max_packet", 1400),
+        collect=lambda: update_queue_gauges(app),
+    )
+    exporter.start()
+    return exporter
+
+
+def start_loop_monitor(loop_monitor_conf: Mapping) -> Optional[LoopMonitor]:
+    """Start watching the event loop for lag, if it is enabled in the config."""
+    if not loop_monitor_conf.get("enabled", False):
+        return None
+
+    monitor = LoopMonitor(
+        interval=loop_monitor_conf.get("interval", 0.1),
+        slow_threshold=loop_monitor_conf.get("slow_threshold", 0.25),
+        degraded_lag=loop_monitor_conf.get("degraded_lag", 0.5),
+        degraded_after=loop_monitor_conf.get("degraded_after", 10.0),
+    )
+    monitor.start()
+    return monitor
+
+
+def create_profiler(diagnostics_conf: Mapping) -> Optional[Profiler]:
+    """Create the profiler, if diagnostics are enabled in the config."""
+    if not diagnostics_conf.get("enabled", False):
+        return None
+
+    return Profiler(
+        diagnostics_conf.get("token", ""),
+        max_seconds=diagnostics_conf.get("max_seconds", 60),
+        sample_interval=diagnostics_conf.get("sample_interval", 0.005),
+    )
 
 
 def on_startup(conf: Mapping):
@@ -39,34 +297,191 @@ def on_startup(conf: Mapping):
         telnyx_api_key = conf["telnyx_api_key"]
         telnyx_connection_id = conf["telnyx_connection_id"]
         src_number = conf["src_number"]
+        http_client_conf = conf.get("http_client", {})
+        webhooks_conf = conf.get("webhooks", {})
+        prefetch_conf = conf.get("prefetch", {})
+        call_state_conf = conf.get("call_state", {})
+        rate_limit_conf = conf.get("rate_limit", {})
+        numbers_conf = conf.get("numbers", {})
+        events_conf = conf.get("events", {})
 
         # Setup client session
-        client_session = aiohttp.ClientSession()
+        # The connector pools keep-alive connections to the Telnyx and joke APIs.
+        connector = aiohttp.TCPConnector(
+            limit=http_client_conf.get("limit", 100),
+            keepalive_timeout=http_client_conf.get("keepalive_timeout", 30),
+        )
+        client_session = aiohttp.ClientSession(connector=connector)
 
         # Setup Telnyx settings
         telnyx.api_key = telnyx_api_key
 
+        # Use the asyncio native client unless the blocking SDK is requested.
+        if conf.get("telnyx_async_client", True):
+            telnyx_app = AsyncTelnyx(client_session, telnyx_api_key)
+        else:
+            telnyx_app = telnyx
+
         # Setup the jinga template for the front-end webpage
         templates_dir = Path(conf["templates_dir"]).resolve()
         aiohttp_jinja2.setup(app, loader=jinja2.FileSystemLoader(str(templates_dir)))
 
+        # Guard the joke API, falling back to local jokes when it is down
+        joke_source = create_joke_source(
+            client_session, joke_url, conf.get("joke_api", {})
+        )
+
+        # Keep some jokes ready, so answered calls don't wait on the joke API
+        joke_pool = create_joke_pool(joke_source, conf.get("joke_pool", {}))
+        if joke_pool:
+            joke_pool.start()
+
+        # Fetch each call's joke while it rings, for as long as a call may ring
+        prefetched = None
+        if prefetch_conf.get("enabled", True):
+            prefetched = TTLMap(
+                prefetch_conf.get("ttl", 120),
+                prefetch_conf.get("max_size", 10000),
+                on_evict=discard_prefetch,
+            )
+
+        # Keep track of the calls in progress
+        call_states = CallStateTable(
+            ttl=call_state_conf.get("ttl", 3600),
+            max_size=call_state_conf.get("max_size", 200000),
+        )
+
+        # Stay within the carrier's calls per second limits
+        rate_limiter = DialRateLimiter(
+            connection_cps=rate_limit_conf.get("connection_cps", 0),
+            connection_burst=rate_limit_conf.get("connection_burst", 1),
+            number_cps=rate_limit_conf.get("number_cps", 0),
+            number_burst=rate_limit_conf.get("number_burst", 1),
+        )
+
+        # Spread the calls over the source numbers in the pool
+        routes = RoutePool.from_config(
+            conf.get("outbound_routes", {}), telnyx_connection_id, src_number
+        )
+
+        # Stream changes to the schedule and the calls to the dashboards
+        events = None
+        if events_conf.get("enabled", True):
+            events = EventBroadcaster(max_pending=events_conf.get("max_pending", 100))
+
         # Setup the Call Control App
         call_control_app = CallControl(
-            client_session, telnyx, telnyx_connection_id, joke_url, src_number
+            client_session,
+            telnyx_app,
+            telnyx_connection_id,
+            joke_url,
+            src_number,
+            joke_pool=joke_pool,
+            joke_source=joke_source,
+            prefetched=prefetched,
+            call_states=call_states,
+            rate_limiter=rate_limiter,
+            routes=routes,
+            events=events,
         )
 
-        # Setup the Call Schedule
-        call_scheduler = UnifiedTimedQueue(call_control_app)
+        # Parse the numbers calls are scheduled to, large batches off the loop
+        numbers = NumberNormaliser(
+            cache_size=numbers_conf.get("cache_size", 100000),
+            pool_threshold=numbers_conf.get("pool_threshold", 1000),
+            chunk_size=numbers_conf.get("chunk_size", 1000),
+            processes=numbers_conf.get("processes", 0),
+        )
+
+        # Setup the background webhook processing
+        webhook_dispatcher = WebhookDispatcher(
+            call_control_app,
+            workers=webhooks_conf.get("workers", 8),
+            max_pending=webhooks_conf.get("max_pending", 1000),
+        )
+        webhook_deduplicator = WebhookDeduplicator(
+            max_size=webhooks_conf.get("dedupe_size", 100000),
+            bloom_capacity=webhooks_conf.get("dedupe_bloom_capacity", 0),
+            bloom_error_rate=webhooks_conf.get("dedupe_bloom_error_rate", 0.001),
+        )
+
+        # Setup the Call Schedule, rebuilt from the last run before accepting
+        # new calls. With several workers, only one of them owns it.
+        if conf.get("workers", {}).get("processes", 1) > 1:
+            call_scheduler = create_scheduler_proxy(call_control_app, conf, events)
+            await call_scheduler.start()
+            close_scheduler = call_scheduler.close
+        else:
+            call_scheduler, close_scheduler = start_scheduler(
+                call_control_app, conf, events
+            )
+
+        # Split the schedule with the other nodes, if there are any
+        sharding_conf = conf.get("sharding", {})
+        if sharding_conf.get("enabled", False):
+            call_scheduler = ShardedScheduler(
+                call_scheduler,
+                sharding_conf["node_id"],
+                sharding_conf["nodes"],
+                client_session,
+                encode=encode_message,
+                decode=decode_message,
+                vnodes=sharding_conf.get("vnodes", 64),
+                secret=sharding_conf.get("secret", ""),
+                timeout=sharding_conf.get("timeout", 5.0),
+                moved_ttl=sharding_conf.get("moved_ttl", 24 * 60 * 60),
+            )
 
         # Register App dependencies
         # These will be accessible via the Request object
         app[constants.SCHEDULER] = call_scheduler
-        app[constants.TELNYX] = telnyx
+        app[constants.LISTING] = ScheduleListing(
+            call_scheduler, max_age=conf.get("listing", {}).get("max_age", 1.0)
+        )
+        app[constants.TELNYX] = telnyx_app
         app[constants.CALL_CONTROL_APP] = call_control_app
+        app[constants.CALL_STATES] = call_states
+        app[constants.NUMBERS] = numbers
+        if events is not None:
+            app[constants.EVENTS] = events
+        app[constants.JOKE_SOURCE] = joke_source
+        if joke_pool:
+            app[constants.JOKE_POOL] = joke_pool
+        app[constants.WEBHOOK_DISPATCHER] = webhook_dispatcher
+        app[constants.WEBHOOK_DEDUPLICATOR] = webhook_deduplicator
+        app[constants.BULK_BATCH_SIZE] = conf.get("bulk", {}).get("batch_size", 1000)
+
+        # Push the metrics to Telegraf, once the queues they read are registered
+        exporter = await start_telegraf_exporter(app, conf.get("telegraf", {}))
+        if exporter is not None:
+            app[constants.TELEGRAF] = exporter
+
+        loop_monitor = start_loop_monitor(conf.get("loop_monitor", {}))
+        if loop_monitor is not None:
+            app[constants.LOOP_MONITOR] = loop_monitor
+
+        # Allow profiling the live process, for requests with the token
+        profiler = create_profiler(conf.get("diagnostics", {}))
+        if profiler is not None:
+            app[constants.PROFILER] = profiler
 
         # Define required cleanup
         async def cleanup(app):
             """Perform required cleanup on shutdown"""
+            # Send the last metrics while the queues they read are still there
+            if exporter is not None:
+                await exporter.close()
+            if loop_monitor is not None:
+                await loop_monitor.close()
+            if profiler is not None:
+                profiler.close()
+            if events is not None:
+                events.close()
+            await webhook_dispatcher.close()
+            await close_scheduler()
+            numbers.close()
+            if joke_pool:
+                await joke_pool.close()
             await client_session.close()
 
         app.on_shutdown.append(cleanup)
@@ -74,6 +489,75 @@ def on_startup(conf: Mapping):
     return startup_handler
 
 
+def run_worker(conf: Mapping) -> None:
+    """Serve HTTP from this process until it is stopped."""
+    http_socket = conf["http"]
+
+    # Setup the web server.
+    app = web.Application()
+
+    # Configure the web server.
+    server.configure_app(app, on_startup(conf))
+
+    # Start the HTTP server.
+    # Workers each listen on the port, and the kernel spreads connections over them.
+    loop = asyncio.get_event_loop()
+    loop.add_signal_handler(signal.SIGTERM, loop.stop)
+    web.run_app(
+        app,
+        host=http_socket["host"],
+        port=http_socket["port"],
+        reuse_port=conf.get("workers", {}).get("processes", 1) > 1,
+    )
+
+
+def run_workers(conf: Mapping, processes: int) -> None:
+    """Fork the worker processes, replacing any that die until stopped."""
+    children = {}
+    stopping = False
+
+    def spawn(index):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            status = 1
+            try:
+                run_worker(conf)
+                status = 0
+            finally:
+                os._exit(status)
+        children[pid] = index
+
+    def stop(_signum, _frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for index in range(processes):
+        spawn(index)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index = children.pop(pid, None)
+        if index is not None and not stopping:
+            logging.warning(
+                "Worker %d exited with status %d, restarting it", pid, status
+            )
+            time.sleep(1)
+            spawn(index)
+
+
 def main():
     # Load config.
     with open("config.dev.json", "r") as f:
@@ -86,18 +570,20 @@ def main():
     # Initialize logger.
     logging.basicConfig(stream=sys.stdout, level="INFO")
 
-    http_socket = conf["http"]
-
-    # Setup the web server.
-    app = web.Application()
+    # Use several processes if asked to, one per core for 0.
+    processes = conf.get("workers", {}).get("processes", 1) or os.cpu_count()
+    conf.setdefault("workers", {})["processes"] = processes
 
-    # Configure the web server.
-    server.configure_app(app, on_startup(conf))
-
-    # Start the HTTP server.
-    loop = asyncio.get_event_loop()
-    loop.add_signal_handler(signal.SIGTERM, loop.stop)
-    web.run_app(app, host=http_socket["host"], port=http_socket["port"])
+    if processes > 1:
+        # Each worker receives its own share of the webhooks.
+        logging.warning(
+            "Running %d workers: webhook deduplication and per-call ordering "
+            "only hold within each worker",
+            processes,
+        )
+        run_workers(conf, processes)
+    else:
+        run_worker(conf)
 
 
 if __name__ == "__main__":